@@ -1,6 +1,10 @@
-from .jet import Jet
+from .jet import Jet, OutputOptions
 from .shell import Shell, ShellSet
-from .distribution import InitialConditions, GammaDistribution, SingleGammaCosine, SingleGammaStep
+from .distribution import InitialConditions, GammaDistribution, SingleGammaCosine, SingleGammaStep, TabulatedGamma
+from .ensemble import EnsembleStore
+from .cache import ResultCache
+from .scaling import rescale_results
+from .accumulators import Accumulator, Histogram, LightCurve, QuantileSketch, Reservoir, Summary, Totals, merge_accumulators
 
 from ._version import get_versions
 __version__ = get_versions()['version']
@@ -0,0 +1,980 @@
+import copy
+import json
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+from .collision import COLLISION_COLUMNS, CollisionHistory
+from .io.hdf5_writer import replace_dataset
+from .io.logging import setup_logger
+from .utils.constants import c
+
+log = setup_logger(__name__)
+
+# what an accumulator can follow
+ACCUMULATOR_COLUMNS = COLLISION_COLUMNS + ("time_observer",)
+
+
+def _columns(radiated_energy, gamma, radius, time) -> Dict[str, np.ndarray]:
+
+    columns = dict(
+        radiated_energy=np.atleast_1d(np.asarray(radiated_energy, dtype=float)),
+        gamma=np.atleast_1d(np.asarray(gamma, dtype=float)),
+        radius=np.atleast_1d(np.asarray(radius, dtype=float)),
+        time=np.atleast_1d(np.asarray(time, dtype=float)),
+    )
+
+    columns["time_observer"] = columns["time"] - columns["radius"] / c
+
+    return columns
+
+
+def _check_column(name: Optional[str], optional: bool = False) -> None:
+
+    if name is None and optional:
+
+        return
+
+    if name not in ACCUMULATOR_COLUMNS:
+
+        log.error(f"{name} is not one of {ACCUMULATOR_COLUMNS}")
+
+        raise ValueError()
+
+
+class Accumulator(object):
+    """
+    Follows the collisions of a jet as they happen without keeping
+    them, see the accumulators argument of Jet. Accumulators of the same
+    kind and settings from separate runs can be merged
+    """
+
+    def add(self, radiated_energy, gamma, radius, time) -> None:
+        """
+        add one or more collisions
+
+        :param radiated_energy:
+        :param gamma:
+        :param radius:
+        :param time: the time of the collision in the jet frame
+        :returns:
+
+        """
+
+        self._add(_columns(radiated_energy, gamma, radius, time))
+
+    def add_history(self, collisions: CollisionHistory) -> None:
+        """
+        add the collisions of a finished run
+
+        :param collisions:
+        :returns:
+
+        """
+
+        self.add(*(collisions.column(name) for name in COLLISION_COLUMNS))
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        raise NotImplementedError()
+
+    def _settings(self) -> tuple:
+
+        return ()
+
+    def merge(self, other: "Accumulator") -> "Accumulator":
+        """
+        add in what another accumulator has seen
+
+        :param other: an accumulator of the same kind and settings
+        :returns: this accumulator
+
+        """
+
+        if type(other) is not type(self) or other._settings() != self._settings():
+
+            log.error(f"can not merge {type(other).__name__} into {type(self).__name__} with other settings")
+
+            raise ValueError()
+
+        self._merge(other)
+
+        return self
+
+    def _merge(self, other: "Accumulator") -> None:
+
+        raise NotImplementedError()
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        raise NotImplementedError()
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        raise NotImplementedError()
+
+    def to_hdf5(self, group) -> None:
+        """
+        write the accumulator to an HDF5 group: its settings
+        and counts as attributes and its arrays as datasets. It
+        can be written again to the same group
+
+        :param group:
+        :returns:
+
+        """
+
+        group.attrs["kind"] = type(self).__name__
+
+        for name, value in self._get_state().items():
+
+            if isinstance(value, np.ndarray):
+
+                replace_dataset(group, name, value)
+
+            else:
+
+                group.attrs[name] = value
+
+    @classmethod
+    def from_hdf5(cls, group) -> "Accumulator":
+        """
+        read an accumulator written by to_hdf5
+
+        :param group:
+        :returns: an accumulator of the kind that was written
+
+        """
+
+        kind = group.attrs["kind"]
+
+        if kind not in _ACCUMULATORS:
+
+            log.error(f"{kind} is not an accumulator that can be read")
+
+            raise RuntimeError()
+
+        state: Dict[str, Any] = {name: value for name, value in group.attrs.items() if name != "kind"}
+
+        state.update((name, group[name][()]) for name in group)
+
+        out = _ACCUMULATORS[kind].__new__(_ACCUMULATORS[kind])
+
+        out._set_state(state)
+
+        return out
+
+
+def merge_accumulators(accumulators: Sequence[Accumulator]) -> Accumulator:
+    """
+    merge accumulators, e.g. those of the runs of an
+    ensemble, into a new one
+
+    :param accumulators:
+    :returns:
+
+    """
+
+    if len(accumulators) == 0:
+
+        log.error("there is nothing to merge")
+
+        raise ValueError()
+
+    out = copy.deepcopy(accumulators[0])
+
+    for other in accumulators[1:]:
+
+        out.merge(other)
+
+    return out
+
+
+class Totals(Accumulator):
+
+    def __init__(self, injected_energy: float = 0.0) -> None:
+        """
+        The number of collisions and the radiated energy
+
+        :param injected_energy: the kinetic energy of the shells, for the
+        efficiency. It is in the units of the radiated energy (erg / c^2),
+        see InitialConditions.kinetic_energy
+        :type injected_energy: float
+        :returns:
+
+        """
+
+        self._n_collisions: int = 0
+
+        self._radiated_energy: float = 0.0
+
+        self._injected_energy: float = float(injected_energy)
+
+    @property
+    def n_collisions(self) -> int:
+
+        return self._n_collisions
+
+    @property
+    def radiated_energy(self) -> float:
+
+        return self._radiated_energy
+
+    @property
+    def injected_energy(self) -> float:
+
+        return self._injected_energy
+
+    @property
+    def efficiency(self) -> float:
+        """
+        the fraction of the injected energy that was radiated
+
+        :returns:
+
+        """
+
+        if self._injected_energy == 0.0:
+
+            return np.nan
+
+        return self._radiated_energy / self._injected_energy
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        self._n_collisions += len(columns["time"])
+
+        self._radiated_energy += float(np.sum(columns["radiated_energy"]))
+
+    def _merge(self, other: "Totals") -> None:
+
+        self._n_collisions += other._n_collisions
+
+        self._radiated_energy += other._radiated_energy
+
+        self._injected_energy += other._injected_energy
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        return dict(
+            n_collisions=self._n_collisions,
+            radiated_energy=self._radiated_energy,
+            injected_energy=self._injected_energy,
+        )
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self._n_collisions = int(state["n_collisions"])
+
+        self._radiated_energy = float(state["radiated_energy"])
+
+        self._injected_energy = float(state["injected_energy"])
+
+
+class Histogram(Accumulator):
+
+    def __init__(self, column: str, edges: np.ndarray, weight: Optional[str] = None) -> None:
+        """
+        A histogram with fixed bins of one of the columns. The
+        collisions outside of the bins are counted in underflow and
+        overflow
+
+        :param column: the column to bin, e.g. radius or time_observer
+        :type column: str
+        :param edges: the bin edges
+        :type edges: np.ndarray
+        :param weight: weight the collisions by this column, e.g. radiated_energy
+        :type weight: Optional[str]
+        :returns:
+
+        """
+
+        _check_column(column)
+        _check_column(weight, optional=True)
+
+        self._column: str = column
+
+        self._edges: np.ndarray = np.asarray(edges, dtype=float)
+
+        self._weight: Optional[str] = weight
+
+        self._counts: np.ndarray = np.zeros(len(self._edges) - 1)
+
+        self._underflow: float = 0.0
+
+        self._overflow: float = 0.0
+
+    @property
+    def edges(self) -> np.ndarray:
+
+        return self._edges
+
+    @property
+    def counts(self) -> np.ndarray:
+
+        return self._counts
+
+    @property
+    def underflow(self) -> float:
+
+        return self._underflow
+
+    @property
+    def overflow(self) -> float:
+
+        return self._overflow
+
+    def _settings(self) -> tuple:
+
+        return (self._column, self._weight, self._edges.tobytes())
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        values = columns[self._column]
+
+        weights = columns[self._weight] if self._weight is not None else np.ones_like(values)
+
+        counts, _ = np.histogram(values, bins=self._edges, weights=weights)
+
+        self._counts += counts
+
+        self._underflow += float(np.sum(weights[values < self._edges[0]]))
+
+        self._overflow += float(np.sum(weights[values > self._edges[-1]]))
+
+    def _merge(self, other: "Histogram") -> None:
+
+        self._counts += other._counts
+
+        self._underflow += other._underflow
+
+        self._overflow += other._overflow
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        return dict(
+            column=self._column,
+            weight=self._weight if self._weight is not None else "",
+            edges=self._edges,
+            counts=self._counts,
+            underflow=self._underflow,
+            overflow=self._overflow,
+        )
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self._column = str(state["column"])
+
+        self._weight = str(state["weight"]) or None
+
+        self._edges = np.asarray(state["edges"], dtype=float)
+
+        self._counts = np.asarray(state["counts"], dtype=float)
+
+        self._underflow = float(state["underflow"])
+
+        self._overflow = float(state["overflow"])
+
+
+class QuantileSketch(Accumulator):
+
+    def __init__(self, column: str, relative_accuracy: float = 0.01, weight: Optional[str] = None) -> None:
+        """
+        A DDSketch of one of the columns: the values are counted in
+        logarithmic buckets, so any quantile is known to within the
+        relative accuracy. The number of buckets only grows with the
+        logarithm of the range of the values
+
+        :param column: the column to follow
+        :type column: str
+        :param relative_accuracy: the relative accuracy of the quantiles
+        :type relative_accuracy: float
+        :param weight: weight the collisions by this column, e.g. radiated_energy
+        :type weight: Optional[str]
+        :returns:
+
+        """
+
+        _check_column(column)
+        _check_column(weight, optional=True)
+
+        if not 0.0 < relative_accuracy < 1.0:
+
+            log.error(f"the relative accuracy must be between 0 and 1 not {relative_accuracy}")
+
+            raise ValueError()
+
+        self._column: str = column
+
+        self._weight: Optional[str] = weight
+
+        self._relative_accuracy: float = float(relative_accuracy)
+
+        self._log_gamma: float = np.log((1.0 + relative_accuracy) / (1.0 - relative_accuracy))
+
+        # the weight in each bucket of the positive and negative values
+
+        self._positive: Dict[int, float] = {}
+        self._negative: Dict[int, float] = {}
+
+        self._zero: float = 0.0
+
+    @property
+    def count(self) -> float:
+
+        return self._zero + sum(self._positive.values()) + sum(self._negative.values())
+
+    def _settings(self) -> tuple:
+
+        return (self._column, self._weight, self._relative_accuracy)
+
+    def _fill(self, store: Dict[int, float], values: np.ndarray, weights: np.ndarray) -> None:
+
+        if len(values) == 0:
+
+            return
+
+        keys, inverse = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_inverse=True)
+
+        for key, weight in zip(keys.tolist(), np.bincount(inverse.ravel(), weights=weights).tolist()):
+
+            store[key] = store.get(key, 0.0) + weight
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        values = columns[self._column]
+
+        weights = columns[self._weight] if self._weight is not None else np.ones_like(values)
+
+        positive = values > 0.0
+        negative = values < 0.0
+
+        self._fill(self._positive, values[positive], weights[positive])
+        self._fill(self._negative, -values[negative], weights[negative])
+
+        self._zero += float(np.sum(weights[~positive & ~negative]))
+
+    def _merge(self, other: "QuantileSketch") -> None:
+
+        for store, other_store in ((self._positive, other._positive), (self._negative, other._negative)):
+
+            for key, weight in other_store.items():
+
+                store[key] = store.get(key, 0.0) + weight
+
+        self._zero += other._zero
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        state: Dict[str, Any] = dict(
+            column=self._column,
+            weight=self._weight if self._weight is not None else "",
+            relative_accuracy=self._relative_accuracy,
+            zero=self._zero,
+        )
+
+        for sign, store in (("positive", self._positive), ("negative", self._negative)):
+
+            keys = sorted(store)
+
+            state[f"{sign}_keys"] = np.array(keys, dtype=np.int64)
+
+            state[f"{sign}_weights"] = np.array([store[key] for key in keys], dtype=float)
+
+        return state
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self._column = str(state["column"])
+
+        self._weight = str(state["weight"]) or None
+
+        self._relative_accuracy = float(state["relative_accuracy"])
+
+        self._log_gamma = np.log((1.0 + self._relative_accuracy) / (1.0 - self._relative_accuracy))
+
+        self._zero = float(state["zero"])
+
+        self._positive = dict(zip(state["positive_keys"].tolist(), state["positive_weights"].tolist()))
+
+        self._negative = dict(zip(state["negative_keys"].tolist(), state["negative_weights"].tolist()))
+
+    def _value(self, key: int) -> float:
+
+        # the middle of the bucket in relative terms
+
+        gamma = np.exp(self._log_gamma)
+
+        return 2.0 * gamma ** key / (gamma + 1.0)
+
+    def quantile(self, q) -> np.ndarray:
+        """
+        the quantiles of the values seen so far
+
+        :param q: one or more quantiles between 0 and 1
+        :returns: an array shaped like q
+
+        """
+
+        q = np.asarray(q, dtype=float)
+
+        # the buckets from the smallest value to the largest
+
+        values = [-self._value(key) for key in sorted(self._negative, reverse=True)]
+        weights = [self._negative[key] for key in sorted(self._negative, reverse=True)]
+
+        values.append(0.0)
+        weights.append(self._zero)
+
+        values.extend(self._value(key) for key in sorted(self._positive))
+        weights.extend(self._positive[key] for key in sorted(self._positive))
+
+        # only the buckets that hold something, so that 0 and 1
+        # are the smallest and largest values seen
+
+        weights = np.asarray(weights)
+
+        values = np.asarray(values)[weights > 0.0]
+
+        cumulative = np.cumsum(weights[weights > 0.0])
+
+        if len(cumulative) == 0:
+
+            return np.full(q.shape, np.nan)
+
+        index = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+
+        return values[np.minimum(index, len(values) - 1)]
+
+
+class Reservoir(Accumulator):
+
+    def __init__(self, size: int, seed: Optional[int] = None) -> None:
+        """
+        A uniform random sample of the collisions
+
+        :param size: the number of collisions to keep
+        :type size: int
+        :param seed: the seed of the random numbers
+        :type seed: Optional[int]
+        :returns:
+
+        """
+
+        self._size: int = int(size)
+
+        self._rng = np.random.default_rng(seed)
+
+        self._sample: Dict[str, np.ndarray] = {name: np.empty(0) for name in COLLISION_COLUMNS}
+
+        self._n_seen: int = 0
+
+    @property
+    def n_seen(self) -> int:
+
+        return self._n_seen
+
+    @property
+    def sample(self) -> CollisionHistory:
+
+        return CollisionHistory.from_arrays(**{name: self._sample[name].copy() for name in COLLISION_COLUMNS})
+
+    def _settings(self) -> tuple:
+
+        return (self._size,)
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        n = len(columns["time"])
+
+        # fill up first
+
+        n_fill = max(0, min(n, self._size - len(self._sample["time"])))
+
+        for name in COLLISION_COLUMNS:
+
+            self._sample[name] = np.concatenate([self._sample[name], columns[name][:n_fill]])
+
+        # then each collision replaces a random one with
+        # the probability of it being in a uniform sample
+
+        seen = self._n_seen + np.arange(n_fill, n)
+
+        slots = self._rng.integers(0, seen + 1)
+
+        take = np.flatnonzero(slots < self._size) + n_fill
+
+        if len(take) > 0:
+
+            # the last collision to land on a slot keeps it
+
+            slots = slots[take - n_fill]
+
+            _, last = np.unique(slots[::-1], return_index=True)
+
+            keep = take[::-1][last]
+
+            for name in COLLISION_COLUMNS:
+
+                self._sample[name][slots[::-1][last]] = columns[name][keep]
+
+        self._n_seen += n
+
+    def _merge(self, other: "Reservoir") -> None:
+
+        n_self, n_other = len(self._sample["time"]), len(other._sample["time"])
+
+        if n_other == 0:
+
+            return
+
+        n_keep = min(self._size, n_self + n_other)
+
+        # a uniform sample of both runs takes as many collisions
+        # from each as drawing n_keep of all the collisions seen
+
+        n_from_self = self._rng.hypergeometric(self._n_seen, other._n_seen, n_keep)
+
+        # which then are a uniform sample of the sample of that run
+
+        from_self = self._rng.choice(n_self, size=n_from_self, replace=False)
+        from_other = self._rng.choice(n_other, size=n_keep - n_from_self, replace=False)
+
+        for name in COLLISION_COLUMNS:
+
+            self._sample[name] = np.concatenate([self._sample[name][from_self], other._sample[name][from_other]])
+
+        self._n_seen += other._n_seen
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        state: Dict[str, Any] = dict(
+            size=self._size,
+            n_seen=self._n_seen,
+            rng=json.dumps(self._rng.bit_generator.state),
+        )
+
+        state.update((name, self._sample[name]) for name in COLLISION_COLUMNS)
+
+        return state
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self._size = int(state["size"])
+
+        self._n_seen = int(state["n_seen"])
+
+        self._rng = np.random.default_rng()
+
+        self._rng.bit_generator.state = json.loads(state["rng"])
+
+        self._sample = {name: np.asarray(state[name], dtype=float) for name in COLLISION_COLUMNS}
+
+
+def exponential_pulse(dt: np.ndarray, radius: np.ndarray, gamma: np.ndarray) -> np.ndarray:
+    """
+    the fraction of the energy of a collision seen by dt after its
+    observer time for a pulse that decays over the angular spreading
+    time R / (2 Gamma^2 c)
+
+    :param dt: the time since the observer time, not negative
+    :param radius: the radius of the collision
+    :param gamma: the Lorentz factor of the collision
+    :returns:
+
+    """
+
+    return -np.expm1(-dt / (radius / (2.0 * gamma * gamma * c)))
+
+
+_PULSES = dict(exponential=exponential_pulse)
+
+# the largest (collisions x edges) block spread at once
+_PULSE_BLOCK = 2 ** 20
+
+
+class LightCurve(Accumulator):
+
+    def __init__(self, edges: np.ndarray, pulse=None) -> None:
+        """
+        The radiated energy binned in observer time. Without a pulse,
+        the energy of each collision goes into the bin of its observer
+        time. A pulse spreads it over the following bins: it is exponential
+        or a function pulse(dt, radius, gamma) giving the fraction of the
+        energy seen by dt after the observer time. The energy that falls
+        outside of the bins is counted in outside
+
+        :param edges: the bin edges in observer time
+        :type edges: np.ndarray
+        :param pulse: None, exponential or a function
+        :returns:
+
+        """
+
+        if isinstance(pulse, str):
+
+            if pulse not in _PULSES:
+
+                log.error(f"pulse must be one of {sorted(_PULSES)} or a function not {pulse}")
+
+                raise ValueError()
+
+            pulse = _PULSES[pulse]
+
+        self._edges: np.ndarray = np.asarray(edges, dtype=float)
+
+        self._pulse = pulse
+
+        self._values: np.ndarray = np.zeros(len(self._edges) - 1)
+
+        self._outside: float = 0.0
+
+    @property
+    def edges(self) -> np.ndarray:
+
+        return self._edges
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        the energy in each bin
+
+        :returns:
+
+        """
+
+        return self._values
+
+    @property
+    def rate(self) -> np.ndarray:
+        """
+        the energy per unit observer time in each bin
+
+        :returns:
+
+        """
+
+        return self._values / np.diff(self._edges)
+
+    @property
+    def outside(self) -> float:
+
+        return self._outside
+
+    def _settings(self) -> tuple:
+
+        return (self._edges.tobytes(), self._pulse)
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        energy = columns["radiated_energy"]
+
+        time_observer = columns["time_observer"]
+
+        if self._pulse is None:
+
+            values, _ = np.histogram(time_observer, bins=self._edges, weights=energy)
+
+        else:
+
+            values = np.zeros_like(self._values)
+
+            block = max(1, _PULSE_BLOCK // len(self._edges))
+
+            for start in range(0, len(energy), block):
+
+                rows = slice(start, start + block)
+
+                dt = self._edges[np.newaxis, :] - time_observer[rows, np.newaxis]
+
+                seen = np.where(
+                    dt > 0.0,
+                    self._pulse(np.maximum(dt, 0.0), columns["radius"][rows, np.newaxis], columns["gamma"][rows, np.newaxis]),
+                    0.0,
+                )
+
+                values += energy[rows] @ np.diff(seen, axis=1)
+
+        self._values += values
+
+        self._outside += float(np.sum(energy) - np.sum(values))
+
+    def _merge(self, other: "LightCurve") -> None:
+
+        self._values += other._values
+
+        self._outside += other._outside
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        pulse = [name for name, function in _PULSES.items() if function is self._pulse]
+
+        if self._pulse is not None and not pulse:
+
+            log.error("a light curve with a pulse function of its own can not be written")
+
+            raise RuntimeError()
+
+        return dict(
+            edges=self._edges,
+            pulse=pulse[0] if pulse else "",
+            values=self._values,
+            outside=self._outside,
+        )
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self._edges = np.asarray(state["edges"], dtype=float)
+
+        self._pulse = _PULSES[str(state["pulse"])] if state["pulse"] else None
+
+        self._values = np.asarray(state["values"], dtype=float)
+
+        self._outside = float(state["outside"])
+
+
+# the radius decades of a summary, log10 of the radius in cm.
+# Collisions outside of them count in the first or last decade
+SUMMARY_DECADES = (4, 20)
+
+SUMMARY_DTYPE = np.dtype(
+    [
+        ("n_collisions", "i8"),
+        ("radiated_energy", "f8"),
+        ("radiated_energy_per_decade", "f8", (SUMMARY_DECADES[1] - SUMMARY_DECADES[0],)),
+        ("first_time_observer", "f8"),
+        ("last_time_observer", "f8"),
+        ("n_shells_final", "i8"),
+        ("efficiency", "f8"),
+    ]
+)
+
+
+class Summary(Accumulator):
+
+    def __init__(self, injected_energy: float = 0.0) -> None:
+        """
+        A fixed size summary of the collisions of a jet, see
+        SUMMARY_DTYPE and the summary_only mode of Jet. Single collisions
+        are added with plain float arithmetic
+
+        :param injected_energy: the kinetic energy of the shells, for the
+        efficiency, in the units of the radiated energy (erg / c^2)
+        :type injected_energy: float
+        :returns:
+
+        """
+
+        # set by the jet when it finishes, see Jet.injected_energy
+        self.injected_energy: float = float(injected_energy)
+
+        self._n_collisions: int = 0
+
+        self._radiated_energy: float = 0.0
+
+        self._per_decade: list = [0.0] * (SUMMARY_DECADES[1] - SUMMARY_DECADES[0])
+
+        self._first: float = np.inf
+
+        self._last: float = -np.inf
+
+        # set by the jet when it finishes
+        self.n_shells_final: int = 0
+
+    def add_one(self, radiated_energy: float, radius: float, time: float) -> None:
+
+        self._n_collisions += 1
+
+        self._radiated_energy += radiated_energy
+
+        decade = min(max(int(np.floor(np.log10(radius))) - SUMMARY_DECADES[0], 0), len(self._per_decade) - 1)
+
+        self._per_decade[decade] += radiated_energy
+
+        time_observer = time - radius / c
+
+        if time_observer < self._first:
+
+            self._first = time_observer
+
+        if time_observer > self._last:
+
+            self._last = time_observer
+
+    def _add(self, columns: Dict[str, np.ndarray]) -> None:
+
+        for radiated_energy, radius, time in zip(
+            columns["radiated_energy"].tolist(), columns["radius"].tolist(), columns["time"].tolist()
+        ):
+
+            self.add_one(radiated_energy, radius, time)
+
+    def _merge(self, other: "Summary") -> None:
+
+        self.injected_energy += other.injected_energy
+
+        self._n_collisions += other._n_collisions
+
+        self._radiated_energy += other._radiated_energy
+
+        self._per_decade = [a + b for a, b in zip(self._per_decade, other._per_decade)]
+
+        self._first = min(self._first, other._first)
+
+        self._last = max(self._last, other._last)
+
+        self.n_shells_final += other.n_shells_final
+
+    def _get_state(self) -> Dict[str, Any]:
+
+        return dict(
+            injected_energy=self.injected_energy,
+            n_collisions=self._n_collisions,
+            radiated_energy=self._radiated_energy,
+            per_decade=np.array(self._per_decade, dtype=float),
+            first=self._first,
+            last=self._last,
+            n_shells_final=self.n_shells_final,
+        )
+
+    def _set_state(self, state: Dict[str, Any]) -> None:
+
+        self.injected_energy = float(state["injected_energy"])
+
+        self._n_collisions = int(state["n_collisions"])
+
+        self._radiated_energy = float(state["radiated_energy"])
+
+        self._per_decade = state["per_decade"].tolist()
+
+        self._first = float(state["first"])
+
+        self._last = float(state["last"])
+
+        self.n_shells_final = int(state["n_shells_final"])
+
+    @property
+    def record(self) -> np.void:
+        """
+        the summary as a record of SUMMARY_DTYPE. The observer
+        times are NaN without collisions
+
+        :returns:
+
+        """
+
+        out = np.zeros((), dtype=SUMMARY_DTYPE)
+
+        out["n_collisions"] = self._n_collisions
+        out["radiated_energy"] = self._radiated_energy
+        out["radiated_energy_per_decade"] = self._per_decade
+        out["first_time_observer"] = self._first if self._n_collisions > 0 else np.nan
+        out["last_time_observer"] = self._last if self._n_collisions > 0 else np.nan
+        out["n_shells_final"] = self.n_shells_final
+        out["efficiency"] = self._radiated_energy / self.injected_energy if self.injected_energy != 0.0 else np.nan
+
+        return out[()]
+
+
+# the accumulators that can be read back by from_hdf5
+_ACCUMULATORS = {cls.__name__: cls for cls in (Totals, Histogram, QuantileSketch, Reservoir, LightCurve, Summary)}
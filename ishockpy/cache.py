@@ -0,0 +1,419 @@
+import fcntl
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import h5py
+
+from ._version import get_versions
+from .collision import CollisionHistory
+from .distribution import InitialConditions
+from .io.hdf5_writer import WriterOptions
+from .io.logging import setup_logger
+from .jet import Jet
+from .scaling import rescale_results
+from .shell_history import DetailedHistory
+from .utils.configuration import ishockpy_config
+
+log = setup_logger(__name__)
+
+# results from another version of the engine are not reused
+ENGINE_VERSION: str = get_versions()["version"]
+
+_SUFFIX = ".h5"
+
+
+class ResultCache(object):
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_size: Optional[float] = None,
+        version: str = ENGINE_VERSION,
+        prefix_every: Optional[int] = None,
+    ) -> None:
+        """
+        An on-disk cache of jet results addressed by a hash of their
+        initial conditions and the engine version. Each entry is a jet
+        file that also holds the initial conditions.
+
+        The hash leaves out the total energy, r_min and the time scale
+        (see InitialConditions.canonical_digest), so a single run serves
+        every jet that only differs in those, with its results rescaled
+        by rescale_results.
+
+        Entries are written to a temporary file and renamed into place,
+        so readers never see a partial entry and need no lock. Writers
+        and eviction take an exclusive lock on <directory>/.lock, so
+        several processes can share a cache. When the cache grows beyond
+        max_size, the least recently used entries are removed.
+
+        Jets run through the cache also leave checkpoints under
+        <directory>/prefixes every prefix_every emitted shells, keyed by
+        a hash of the gamma and mass of the shells emitted so far. A
+        jet that only differs in the shells emitted later resumes from
+        the longest of these instead of starting over.
+
+        :param directory: the cache directory. By default, that of the configuration
+        :type directory: Optional[str]
+        :param max_size: the size limit in GB. By default, that of the configuration
+        :type max_size: Optional[float]
+        :param version: the engine version the results belong to
+        :type version: str
+        :param prefix_every: the number of shells between checkpoints. By
+        default, that of the configuration, and 0 turns them off
+        :type prefix_every: Optional[int]
+        :returns:
+
+        """
+
+        config = ishockpy_config.cache
+
+        self._directory: Path = Path(directory if directory is not None else config.directory).expanduser()
+
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+        self._max_size: float = float(max_size if max_size is not None else config.max_size)
+
+        self._version: str = version
+
+        self._prefix_every: int = int(prefix_every if prefix_every is not None else config.prefix_every)
+
+        self._prefix_directory: Path = self._directory / "prefixes"
+
+        self._lock_file: Path = self._directory / ".lock"
+
+    @property
+    def directory(self) -> Path:
+
+        return self._directory
+
+    @contextmanager
+    def _locked(self):
+
+        with open(self._lock_file, "a") as lock:
+
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+
+                yield
+
+            finally:
+
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def key(self, initial_conditions: InitialConditions) -> str:
+
+        return initial_conditions.canonical_digest(self._version)
+
+    def _path(self, key: str) -> Path:
+
+        return self._directory / f"{key}{_SUFFIX}"
+
+    def __contains__(self, initial_conditions: InitialConditions) -> bool:
+
+        return self._path(self.key(initial_conditions)).exists()
+
+    def get(
+        self, initial_conditions: InitialConditions, store: bool = False
+    ) -> Optional[Tuple[CollisionHistory, Optional[DetailedHistory]]]:
+        """
+        the cached results of a jet, or None if there are none.
+        The results of a rescaled jet are rescaled to these
+        initial conditions
+
+        :param initial_conditions:
+        :param store: the shell history is needed as well
+        :returns: the collisions and the shell history (if store)
+
+        """
+
+        path = self._path(self.key(initial_conditions))
+
+        try:
+
+            with h5py.File(path, "r") as f:
+
+                if store and not f.attrs["store"]:
+
+                    return None
+
+                collisions = CollisionHistory.from_hdf5(f["collisions"])
+
+                shells = DetailedHistory.from_hdf5(f["shells"]) if store else None
+
+                source = InitialConditions.from_hdf5(f["initial_conditions"])
+
+        except (FileNotFoundError, OSError):
+
+            # not there or evicted while we looked
+
+            return None
+
+        # the modification time marks the last use
+
+        try:
+
+            os.utime(path)
+
+        except FileNotFoundError:
+
+            pass
+
+        log.debug(f"cache hit for {path.name}")
+
+        return rescale_results(collisions, shells, source, initial_conditions)
+
+    def _has_history(self, path: Path) -> bool:
+
+        try:
+
+            with h5py.File(path, "r") as f:
+
+                return bool(f.attrs["store"])
+
+        except (FileNotFoundError, OSError):
+
+            return False
+
+    def put(self, jet: Jet, options: Optional[WriterOptions] = None) -> str:
+        """
+        add the results of a finished jet. An entry that holds the
+        shell history serves jets with and without one, so it is not
+        replaced by the results of a jet that did not store its history
+
+        :param jet: the jet after start has been called
+        :param options: the writer options. By default, those of the configuration
+        :returns: the key of the entry
+
+        """
+
+        key = self.key(jet.initial_conditions)
+
+        path = self._path(key)
+
+        tmp_file = self._directory / f"{key}.{uuid.uuid4().hex}.tmp"
+
+        try:
+
+            with h5py.File(tmp_file, "w") as f:
+
+                jet.to_hdf5(f, options)
+
+                f.attrs["cache_key"] = key
+                f.attrs["engine_version"] = self._version
+
+            with self._locked():
+
+                if not jet.store and self._has_history(path):
+
+                    log.debug(f"kept {path.name}, which holds the shell history")
+
+                else:
+
+                    os.replace(tmp_file, path)
+
+                    self._evict()
+
+        finally:
+
+            if tmp_file.exists():
+
+                tmp_file.unlink()
+
+        return key
+
+    def run(
+        self, initial_conditions: InitialConditions, store: bool = False
+    ) -> Tuple[CollisionHistory, Optional[DetailedHistory]]:
+        """
+        the results of a jet, from the cache if they are
+        there and otherwise by running the jet and caching them
+
+        :param initial_conditions:
+        :param store: the shell history is needed as well
+        :returns: the collisions and the shell history (if store)
+
+        """
+
+        cached = self.get(initial_conditions, store)
+
+        if cached is not None:
+
+            return cached
+
+        jet = self._run_with_prefixes(initial_conditions, store)
+
+        self.put(jet)
+
+        return jet.collision_history, jet.detailed_history
+
+    def _prefix_lengths(self, initial_conditions: InitialConditions) -> List[int]:
+
+        if self._prefix_every <= 0:
+
+            return []
+
+        # the jet starts out with two shells emitted
+
+        n_shells = int(initial_conditions.n_shells)
+
+        return [k for k in range(self._prefix_every, n_shells, self._prefix_every) if k > 2]
+
+    def _prefix_path(self, key: str) -> Path:
+
+        return self._prefix_directory / f"{key}{_SUFFIX}"
+
+    def _run_with_prefixes(self, initial_conditions: InitialConditions, store: bool) -> Jet:
+
+        lengths = self._prefix_lengths(initial_conditions)
+
+        keys = initial_conditions.prefix_digests(lengths, self._version, store)
+
+        jet = None
+
+        for k in reversed(lengths):
+
+            path = self._prefix_path(keys[k])
+
+            if not path.exists():
+
+                continue
+
+            try:
+
+                jet = Jet.resume(str(path), initial_conditions, prefix=True)
+
+                os.utime(path)
+
+            except (FileNotFoundError, OSError):
+
+                # evicted while we looked
+
+                continue
+
+            log.debug(f"resumed the jet from {k} cached shells")
+
+            lengths = [length for length in lengths if length > k]
+
+            break
+
+        if jet is None:
+
+            jet = Jet(initial_conditions, store=store)
+
+        self._prefix_directory.mkdir(exist_ok=True)
+
+        for k in lengths:
+
+            if not jet.advance_to_shell(k):
+
+                break
+
+            path = self._prefix_path(keys[k])
+
+            if path.exists():
+
+                continue
+
+            tmp_file = self._prefix_directory / f"{keys[k]}.{uuid.uuid4().hex}.tmp"
+
+            try:
+
+                jet.checkpoint(str(tmp_file))
+
+                with self._locked():
+
+                    os.replace(tmp_file, path)
+
+                    self._evict()
+
+            finally:
+
+                if tmp_file.exists():
+
+                    tmp_file.unlink()
+
+        jet.start()
+
+        return jet
+
+    def entries(self) -> List[Path]:
+        """
+        the entry files, including the prefix
+        checkpoints, least recently used first
+
+        :returns:
+
+        """
+
+        entries = []
+
+        for path in self._directory.rglob(f"*{_SUFFIX}"):
+
+            try:
+
+                entries.append((path.stat().st_mtime, path))
+
+            except FileNotFoundError:
+
+                continue
+
+        return [path for _, path in sorted(entries)]
+
+    @property
+    def size(self) -> int:
+        """
+        the size of the entries in bytes
+
+        :returns:
+
+        """
+
+        return sum(path.stat().st_size for path in self.entries())
+
+    def initial_conditions(self, key: str) -> InitialConditions:
+        """
+        the initial conditions of an entry
+
+        :param key:
+        :returns:
+
+        """
+
+        with h5py.File(self._path(key), "r") as f:
+
+            return InitialConditions.from_hdf5(f["initial_conditions"])
+
+    def _evict(self) -> None:
+
+        entries = [(path, path.stat().st_size) for path in self.entries()]
+
+        total = sum(size for _, size in entries)
+
+        limit = self._max_size * 1e9
+
+        # the newest entry always stays
+
+        for path, size in entries[:-1]:
+
+            if total <= limit:
+
+                break
+
+            path.unlink()
+
+            total -= size
+
+            log.debug(f"evicted {path.name} from the cache")
+
+    def clear(self) -> None:
+
+        with self._locked():
+
+            for path in self.entries():
+
+                path.unlink()
@@ -1,14 +1,29 @@
-from dataclasses import dataclass
-from typing import List
+import tempfile
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import h5py
 import numpy as np
+import pandas as pd
 
+from .io.hdf5_writer import WriterOptions, read_column, write_datasets
 from .io.logging import setup_logger
 from .utils.constants import c
 
 log = setup_logger(__name__)
 
+COLLISION_COLUMNS = ("radiated_energy", "gamma", "radius", "time")
+
+# the number of sorted observer times summarised by one block
+OBSERVER_BLOCK = 4096
+
+# the observer times ObserverIndexBuilder sorts in memory at a
+# time, and the rows it reads from each sorted run while merging
+_INDEX_RUN = 1 << 20
+_INDEX_READ = 1 << 14
+
+_INDEX_DTYPE = np.dtype([("time_observer", "f8"), ("order", "i8")])
+
 @dataclass(frozen=True)
 class Collision:
     radiated_energy: float
@@ -27,69 +42,596 @@ class CollisionHistory(object):
 
     def __init__(self, collisions: List[Collision]) -> None:
 
-        self._collisions = collisions
+        self._collisions: Optional[List[Collision]] = collisions
+
+        # the columns, built on demand
+
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def from_arrays(cls, radiated_energy: np.ndarray, gamma: np.ndarray, radius: np.ndarray, time: np.ndarray):
+        """
+        build the history from columns without
+        creating the collisions
+
+        :param radiated_energy: 
+        :param gamma: 
+        :param radius: 
+        :param time: 
+        :returns: 
+
+        """
+
+        obj = cls.__new__(cls)
+
+        obj._collisions = None
+
+        obj._columns = dict(radiated_energy=radiated_energy, gamma=gamma, radius=radius, time=time)
+
+        return obj
+
+    @property
+    def collisions(self) -> List[Collision]:
+
+        if self._collisions is None:
+
+            self._collisions = [Collision(*row) for row in zip(*(self._columns[name] for name in COLLISION_COLUMNS))]
+
+        return self._collisions
+
+    @property
+    def n_collisions(self) -> int:
+
+        if self._collisions is not None:
+
+            return len(self._collisions)
+
+        return len(self._columns["time"])
+
+    def __len__(self) -> int:
+
+        return self.n_collisions
+
+    def _get_columns(self) -> Dict[str, np.ndarray]:
+
+        if self._columns is None:
 
+            self._columns = {
+                name: np.array([getattr(x, name) for x in self._collisions], dtype=float)
+                for name in COLLISION_COLUMNS
+            }
+
+        return self._columns
+
+    def _values(self, name: str) -> List[float]:
+
+        if self._collisions is not None:
+
+            return [getattr(x, name) for x in self._collisions]
+
+        return self._columns[name].tolist()
 
     @property
     def gamma(self) -> List[float]:
 
-        return [x.gamma for x in self._collisions]
+        return self._values("gamma")
 
     @property
     def radiated_energy(self) -> List[float]:
 
-        return [x.radiated_energy for x in self._collisions]
+        return self._values("radiated_energy")
 
     
     @property
     def radius(self) -> List[float]:
 
-        return [x.radius for x in self._collisions]
+        return self._values("radius")
 
     
     @property
     def time(self) -> List[float]:
 
-        return [x.time for x in self._collisions]
+        return self._values("time")
 
     @property
     def time_observer(self) -> List[float]:
 
-        return [x.time_observer for x in self._collisions]
+        return self.column("time_observer").tolist()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        a column as an array. The collision columns are
+        built once and shared, not copied
+
+        :param name: one of COLLISION_COLUMNS or time_observer
+        :returns: 
+
+        """
+
+        columns = self._get_columns()
+
+        if name == "time_observer":
+
+            return columns["time"] - columns["radius"] / c
+
+        if name not in columns:
+
+            log.error(f"{name} is not a collision column")
+
+            raise ValueError()
+
+        return columns[name]
 
 
     
 
-    def to_hdf5(self, group) -> None:
+    def rescaled(
+        self, energy_scale: float = 1.0, time_scale: float = 1.0, r_min: float = 0.0, new_r_min: Optional[float] = None
+    ) -> "CollisionHistory":
+        """
+        the collisions of a jet whose energy and times are scaled
+        and which is launched from another radius. Only the mass ratios
+        of the shells matter, so the radiated energy scales with the
+        energy, and the distance travelled since r_min with the times
+
+        :param energy_scale: the ratio of the total energies
+        :param time_scale: the ratio of the variability times
+        :param r_min: the r_min of this jet
+        :param new_r_min: the r_min of the other jet. By default, r_min
+        :returns: 
+
+        """
+
+        columns = dict(self._get_columns())
+
+        new_r_min = r_min if new_r_min is None else new_r_min
+
+        if energy_scale != 1.0:
+
+            columns["radiated_energy"] = columns["radiated_energy"] * energy_scale
+
+        if time_scale != 1.0:
+
+            columns["time"] = columns["time"] * time_scale
+
+        if time_scale != 1.0 or new_r_min != r_min:
+
+            columns["radius"] = new_r_min + (columns["radius"] - r_min) * time_scale
+
+        return CollisionHistory.from_arrays(**columns)
+
+    def within(self, r_max: float) -> "CollisionHistory":
+        """
+        the collisions inside r_max. Shells beyond r_max can only
+        meet other shells beyond it, so for a jet run without r_max these
+        are the collisions of the same jet with shells leaving at r_max
+
+        :param r_max: 
+        :returns: 
 
-        group.create_dataset("radiated_energy", data= np.array(self.radiated_energy), compression="gzip")
-        group.create_dataset("gamma", data= np.array(self.gamma), compression="gzip")
-        group.create_dataset("radius", data= np.array(self.radius), compression="gzip")
-        group.create_dataset("time", data= np.array(self.time), compression="gzip")
+        """
 
-    def write_to(self, file_name: str) -> None:
+        columns = self._get_columns()
+
+        selection = columns["radius"] < r_max
+
+        return CollisionHistory.from_arrays(**{name: columns[name][selection] for name in COLLISION_COLUMNS})
+
+    def radiated_energy_within(self, r_max) -> np.ndarray:
+        """
+        the total radiated energy of the collisions inside
+        each r_max, see within
+
+        :param r_max: one or more maximum radii
+        :returns: an array shaped like r_max
+
+        """
+
+        columns = self._get_columns()
+
+        order = np.argsort(columns["radius"], kind="stable")
+
+        cumulative = np.concatenate([[0.0], np.cumsum(columns["radiated_energy"][order])])
+
+        return cumulative[np.searchsorted(columns["radius"][order], r_max, side="left")]
+
+    def to_dataframe(self, observer_time: bool = True) -> pd.DataFrame:
+        """
+        the collisions as a DataFrame that wraps the
+        columns without copying them
+
+        :param observer_time: add the (computed) time_observer column
+        :returns: 
+
+        """
+
+        columns = dict(self._get_columns())
+
+        if observer_time:
+
+            columns["time_observer"] = self.column("time_observer")
+
+        return pd.DataFrame(columns, copy=False)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame):
+        """
+        build the history from a DataFrame with the collision
+        columns, e.g. a filtered to_dataframe. Other columns are ignored
+
+        :param df: 
+        :returns: 
+
+        """
+
+        return cls.from_arrays(*(df[name].to_numpy() for name in COLLISION_COLUMNS))
+
+    def to_hdf5(self, group, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the collisions along with an index that
+        sorts them in observer time
+
+        :param group: 
+        :param options: the writer options. By default, those of the configuration
+        :returns: 
+
+        """
+
+        write_datasets(group, self._get_columns(), options)
+
+        write_observer_index(group, self.column("time"), self.column("radius"), options)
+
+    def write_to(self, file_name: str, options: Optional[WriterOptions] = None) -> None:
 
         with h5py.File(file_name, "w") as f:
 
-            self.to_hdf5(f)
+            self.to_hdf5(f, options)
         
         
     @classmethod
-    def from_hdf5(cls, group):
+    def from_hdf5(cls, group, selection=slice(None)):
+
+        return cls.from_arrays(*(read_column(group[name], selection) for name in COLLISION_COLUMNS))
+
+    @classmethod
+    def from_hdf5_observer_window(cls, group, t_start: float, t_stop: float):
+        """
+        read only the collisions with an observer time in [t_start, t_stop].
+        They are returned in observer time order
+
+        :param group: the collisions group
+        :param t_start: 
+        :param t_stop: 
+        :returns: 
+
+        """
+
+        idx = observer_window_indices(group, t_start, t_stop)
+
+        if len(idx) == 0:
+
+            return cls.from_arrays(*(np.empty(0) for _ in COLLISION_COLUMNS))
 
-        radii = group["radius"][()]
-        gamma = group["gamma"][()]
-        rad_energy = group["radiated_energy"][()]
-        time = group["time"][()]
+        # h5py reads increasing indices, so read in storage
+        # order and then put them in observer time order
 
-        collisions =  [Collision(a,b,c,d) for a,b,c,d in zip(rad_energy, gamma, radii, time)]
+        storage = np.sort(idx)
 
-        return cls(collisions)
+        lo, hi = storage[0], storage[-1] + 1
+
+        if len(storage) * 8 >= hi - lo:
+
+            # dense enough to read the whole slab
+            columns = [read_column(group[name], slice(lo, hi))[storage - lo] for name in COLLISION_COLUMNS]
+
+        else:
+
+            columns = [read_column(group[name], storage) for name in COLLISION_COLUMNS]
+
+        order = np.searchsorted(storage, idx)
+
+        return cls.from_arrays(*(column[order] for column in columns))
 
         
     @classmethod
-    def from_file(cls, file_name: str):
+    def from_file(cls, file_name: str, path: str = "/"):
 
         with h5py.File(file_name, "r") as f:
 
-            return cls.from_hdf5(f)
+            return cls.from_hdf5(f[path])
+
+
+def write_observer_index(group, time: np.ndarray, radius: np.ndarray, options: Optional[WriterOptions] = None) -> None:
+    """
+    write the permutation that sorts the collisions in observer
+    time, the sorted observer times and their min/max over blocks
+
+    :param group: the collisions group
+    :param time: the collision times
+    :param radius: the collision radii
+    :param options: the writer options. The index is always double precision
+    :returns: 
+
+    """
+
+    if options is None:
+
+        options = WriterOptions.from_config()
+
+    options = replace(options, float32=False, precision=None)
+
+    index_grp = group.create_group("observer_index")
+
+    index_grp.attrs["block_size"] = OBSERVER_BLOCK
+
+    write_datasets(index_grp, observer_index_arrays(time, radius), options)
+
+
+def observer_index_arrays(time: np.ndarray, radius: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    the datasets of the observer time index
+
+    :param time: the collision times
+    :param radius: the collision radii
+    :returns: 
+
+    """
+
+    time_observer = np.asarray(time, dtype=float) - np.asarray(radius, dtype=float) / c
+
+    order = np.argsort(time_observer, kind="stable")
+
+    sorted_time = time_observer[order]
+
+    starts = np.arange(0, len(sorted_time), OBSERVER_BLOCK)
+
+    stops = np.minimum(starts + OBSERVER_BLOCK, len(sorted_time)) - 1
+
+    return dict(order=order, time_observer=sorted_time, block_min=sorted_time[starts], block_max=sorted_time[stops])
+
+
+class ObserverIndexBuilder(object):
+
+    def __init__(self, directory: Optional[str] = None, run_size: int = _INDEX_RUN) -> None:
+        """
+        Builds the observer time index of collisions that arrive in
+        blocks without holding them all in memory. Every run_size
+        collisions are sorted and spilled to a temporary file, and the
+        sorted runs are merged a slice at a time when the index is
+        written. The index is the same as that of observer_index_arrays
+
+        :param directory: where to keep the temporary file
+        :type directory: Optional[str]
+        :param run_size: the number of collisions sorted at a time
+        :type run_size: int
+        :returns: 
+
+        """
+
+        self._run_size: int = int(run_size)
+
+        self._scratch = tempfile.TemporaryFile(dir=directory)
+
+        # the start and stop rows of the sorted runs in the scratch file
+        self._runs: List[Tuple[int, int]] = []
+
+        self._pending: List[np.ndarray] = []
+
+        self._n_pending: int = 0
+
+        self._n_spilled: int = 0
+
+    @property
+    def n_collisions(self) -> int:
+
+        return self._n_spilled + self._n_pending
+
+    def add(self, time: np.ndarray, radius: np.ndarray) -> None:
+        """
+        add the next collisions
+
+        :param time: the collision times
+        :param radius: the collision radii
+        :returns: 
+
+        """
+
+        time_observer = np.asarray(time, dtype=float) - np.asarray(radius, dtype=float) / c
+
+        self._pending.append(time_observer)
+
+        self._n_pending += len(time_observer)
+
+        if self._n_pending >= self._run_size:
+
+            self._spill()
+
+    def _spill(self) -> None:
+
+        if self._n_pending == 0:
+
+            return
+
+        time_observer = np.concatenate(self._pending)
+
+        order = np.argsort(time_observer, kind="stable")
+
+        run = np.empty(len(order), dtype=_INDEX_DTYPE)
+
+        run["time_observer"] = time_observer[order]
+        run["order"] = order + self._n_spilled
+
+        self._scratch.seek(0, 2)
+
+        run.tofile(self._scratch)
+
+        self._runs.append((self._n_spilled, self._n_spilled + len(run)))
+
+        self._n_spilled += len(run)
+
+        self._pending = []
+
+        self._n_pending = 0
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+
+        self._scratch.seek(start * _INDEX_DTYPE.itemsize)
+
+        return np.fromfile(self._scratch, dtype=_INDEX_DTYPE, count=stop - start)
+
+    def _merged(self) -> Iterator[np.ndarray]:
+
+        # each run is ordered by time and then collision id, as is the
+        # index. Everything up to the smallest last buffered entry of
+        # the runs with more to read can go out
+
+        position = [start for start, _ in self._runs]
+
+        buffers = [np.empty(0, dtype=_INDEX_DTYPE) for _ in self._runs]
+
+        while True:
+
+            for i, (_, stop) in enumerate(self._runs):
+
+                if len(buffers[i]) == 0 and position[i] < stop:
+
+                    buffers[i] = self._read(position[i], min(position[i] + _INDEX_READ, stop))
+
+                    position[i] += len(buffers[i])
+
+            if not any(len(buffer) for buffer in buffers):
+
+                return
+
+            unread = [i for i, (_, stop) in enumerate(self._runs) if position[i] < stop]
+
+            limit = min(tuple(buffers[i][-1].tolist()) for i in unread) if unread else None
+
+            pieces = []
+
+            for i, buffer in enumerate(buffers):
+
+                if limit is not None:
+
+                    n = np.count_nonzero(
+                        (buffer["time_observer"] < limit[0])
+                        | ((buffer["time_observer"] == limit[0]) & (buffer["order"] <= limit[1]))
+                    )
+
+                else:
+
+                    n = len(buffer)
+
+                pieces.append(buffer[:n])
+
+                buffers[i] = buffer[n:]
+
+            piece = np.concatenate(pieces)
+
+            yield piece[np.lexsort((piece["order"], piece["time_observer"]))]
+
+    def write(self, index_grp) -> None:
+        """
+        write the index to the order, time_observer, block_min
+        and block_max datasets of a group, which are resized
+
+        :param index_grp: the observer index group
+        :returns: 
+
+        """
+
+        self._spill()
+
+        n = self._n_spilled
+
+        n_blocks = -(-n // OBSERVER_BLOCK)
+
+        for name in ("order", "time_observer"):
+
+            index_grp[name].resize((n,))
+
+        # the first and last sorted time of every block
+
+        firsts = np.arange(n_blocks) * OBSERVER_BLOCK
+        lasts = np.minimum(firsts + OBSERVER_BLOCK, n) - 1
+
+        block_min = np.empty(n_blocks)
+        block_max = np.empty(n_blocks)
+
+        offset = 0
+
+        for piece in self._merged():
+
+            stop = offset + len(piece)
+
+            index_grp["order"][offset:stop] = piece["order"]
+            index_grp["time_observer"][offset:stop] = piece["time_observer"]
+
+            for rows, out in ((firsts, block_min), (lasts, block_max)):
+
+                inside = (rows >= offset) & (rows < stop)
+
+                out[inside] = piece["time_observer"][rows[inside] - offset]
+
+            offset = stop
+
+        for name, data in (("block_min", block_min), ("block_max", block_max)):
+
+            index_grp[name].resize((n_blocks,))
+
+            index_grp[name][:] = data
+
+    def close(self) -> None:
+
+        self._scratch.close()
+
+
+def observer_window_indices(group, t_start: float, t_stop: float) -> np.ndarray:
+    """
+    the storage indices of the collisions with an observer
+    time in [t_start, t_stop], in observer time order
+
+    :param group: the collisions group
+    :param t_start: 
+    :param t_stop: 
+    :returns: 
+
+    """
+
+    # a file that is still being written (or was never closed)
+    # has an index that does not cover every collision
+
+    if "observer_index" not in group or group["observer_index/order"].shape[0] != group["time"].shape[0]:
+
+        log.warning("there is no complete observer time index, scanning all collisions")
+
+        time_observer = read_column(group["time"]) - read_column(group["radius"]) / c
+
+        order = np.argsort(time_observer, kind="stable")
+
+        sorted_time = time_observer[order]
+
+        return order[np.searchsorted(sorted_time, t_start, "left"): np.searchsorted(sorted_time, t_stop, "right")]
+
+    index_grp = group["observer_index"]
+
+    block_size = int(index_grp.attrs["block_size"])
+
+    # the coarse summaries are small enough to always read
+
+    first_block = np.searchsorted(index_grp["block_max"][()], t_start, "left")
+    last_block = np.searchsorted(index_grp["block_min"][()], t_stop, "right")
+
+    if first_block >= last_block:
+
+        return np.empty(0, dtype=np.int64)
+
+    lo = first_block * block_size
+    hi = last_block * block_size
+
+    sorted_time = index_grp["time_observer"][lo:hi]
+
+    start = lo + np.searchsorted(sorted_time, t_start, "left")
+    stop = lo + np.searchsorted(sorted_time, t_stop, "right")
+
+    return index_grp["order"][start:stop]
@@ -1,4 +1,6 @@
-from typing import Optional
+import copy
+import hashlib
+from typing import Dict, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -174,6 +176,32 @@ class InitialConditions(object):
         return self._n_shells
 
 
+    @property
+    def total_time(self) -> float:
+
+        return self._total_time
+
+    @property
+    def total_energy(self) -> float:
+
+        return self._total_energy
+
+    @property
+    def kinetic_energy(self) -> float:
+        """
+        the kinetic energy of the n_shells shells a jet emits, in
+        the units of the radiated energy of the collisions (erg / c^2)
+
+        :returns: 
+
+        """
+
+        n_shells = int(self._n_shells)
+
+        mass = self._mass_distribution.values[:n_shells]
+
+        return float(np.sum(mass * (self._gamma_distribution.values[:n_shells] - 1.0)))
+
     @property
     def gamma_distribution(self) -> GammaDistribution:
 
@@ -217,6 +245,145 @@ class InitialConditions(object):
         
 
 
+    def digest(self, *extra) -> str:
+        """
+        a hash of everything that determines the jet: the gamma and
+        mass of every shell, the number of shells, r_min, r_max
+        and the variability time, along with anything extra
+
+        :returns: the hex digest
+
+        """
+
+        h = hashlib.sha256()
+
+        h.update(np.ascontiguousarray(self._gamma_distribution.values, dtype="<f8").tobytes())
+        h.update(np.ascontiguousarray(self._mass_distribution.values, dtype="<f8").tobytes())
+
+        r_max = np.nan if self._r_max is None else self._r_max
+
+        h.update(np.array([self._n_shells, self._r_min, r_max, self._delta_time], dtype="<f8").tobytes())
+
+        for item in extra:
+
+            h.update(str(item).encode())
+
+        return h.hexdigest()
+
+    def with_r_max(self, r_max: Optional[float]) -> "InitialConditions":
+        """
+        the same initial conditions with another r_max
+
+        :param r_max: None for no maximum radius
+        :returns: 
+
+        """
+
+        out = copy.copy(self)
+
+        out._r_max = r_max
+
+        return out
+
+    def canonical_digest(self, *extra) -> str:
+        """
+        a hash of what is left of the initial conditions once the
+        total energy, r_min and the time scale are taken out: the gamma
+        of every shell, the number of shells and (r_max - r_min) over
+        the variability time. Jets that share it only differ by a
+        rescaling of their results, see rescale_results
+
+        :returns: the hex digest
+
+        """
+
+        h = hashlib.sha256()
+
+        h.update(np.ascontiguousarray(self._gamma_distribution.values, dtype="<f8").tobytes())
+
+        r_max = np.nan if self._r_max is None else (self._r_max - self._r_min) / self._delta_time
+
+        h.update(np.array([self._n_shells, r_max], dtype="<f8").tobytes())
+
+        for item in extra:
+
+            h.update(str(item).encode())
+
+        return h.hexdigest()
+
+    def prefix_digests(self, lengths, *extra) -> Dict[int, str]:
+        """
+        hashes of the first shells of the jet. Everything up to the
+        emission of shell k only depends on the gamma and mass of the
+        shells before it, r_min, r_max and the variability time, so
+        jets that share the digest for k are identical until then
+
+        :param lengths: the numbers of shells to hash
+        :returns: the hex digest for each length
+
+        """
+
+        gamma = np.ascontiguousarray(self._gamma_distribution.values, dtype="<f8")
+        mass = np.ascontiguousarray(self._mass_distribution.values, dtype="<f8")
+
+        h = hashlib.sha256()
+
+        r_max = np.nan if self._r_max is None else self._r_max
+
+        h.update(np.array([self._r_min, r_max, self._delta_time], dtype="<f8").tobytes())
+
+        for item in extra:
+
+            h.update(str(item).encode())
+
+        out = {}
+
+        start = 0
+
+        for length in sorted(set(int(k) for k in lengths)):
+
+            h.update(np.stack([gamma[start:length], mass[start:length]], axis=1).tobytes())
+
+            out[length] = h.copy().hexdigest()
+
+            start = length
+
+        return out
+
+    def to_hdf5(self, group) -> None:
+        """
+        write the initial conditions to an HDF5 group. The gamma
+        of each shell is stored, so they can be read back without
+        the distribution that made them
+
+        :param group: 
+        :returns: 
+
+        """
+
+        group.attrs["total_time"] = self._total_time
+        group.attrs["delta_time"] = self._delta_time
+        group.attrs["total_energy"] = self._total_energy
+        group.attrs["r_min"] = self._r_min
+        group.attrs["r_max"] = np.nan if self._r_max is None else self._r_max
+        group.attrs["gamma_distribution"] = type(self._gamma_distribution).__name__
+
+        group.create_dataset("gamma", data=self._gamma_distribution.values)
+
+    @classmethod
+    def from_hdf5(cls, group) -> "InitialConditions":
+
+        r_max = float(group.attrs["r_max"])
+
+        return cls(
+            total_time=float(group.attrs["total_time"]),
+            delta_time=float(group.attrs["delta_time"]),
+            total_energy=float(group.attrs["total_energy"]),
+            gamma_distribtuion=TabulatedGamma(group["gamma"][()]),
+            r_min=float(group.attrs["r_min"]),
+            r_max=None if np.isnan(r_max) else r_max,
+        )
+
     def plot_gamma(self) -> plt.Figure:
 
         fig, ax = plt.subplots()
@@ -275,3 +442,30 @@ class SingleGammaStep(GammaDistribution):
 
 
     
+
+
+class TabulatedGamma(GammaDistribution):
+
+    def __init__(self, values: np.ndarray):
+        """
+        A gamma distribution given by the gamma of each shell
+
+        :param values: the gamma of each shell in order of emission
+        :type values: np.ndarray
+        :returns: 
+
+        """
+
+        super(TabulatedGamma, self).__init__()
+
+        self._tabulated: np.ndarray = np.asarray(values, dtype=float)
+
+    def _generate_gamma(self):
+
+        if len(self._tabulated) != len(self._initial_times):
+
+            log.error(f"there are {len(self._tabulated)} values of gamma for {len(self._initial_times)} shells")
+
+            raise ValueError()
+
+        return self._tabulated.copy()
@@ -0,0 +1,283 @@
+import fcntl
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from .collision import CollisionHistory
+from .io.hdf5_writer import WriterOptions
+from .io.lazy import JetFile
+from .io.logging import setup_logger
+from .jet import Jet
+from .shell_history import DetailedHistory
+
+log = setup_logger(__name__)
+
+
+# the columns of the parameter and summary table
+_TABLE_COLUMNS: Tuple[Tuple[str, object], ...] = (
+    ("key", h5py.string_dtype()),
+    ("gamma_distribution", h5py.string_dtype()),
+    ("total_time", "f8"),
+    ("delta_time", "f8"),
+    ("total_energy", "f8"),
+    ("r_min", "f8"),
+    ("r_max", "f8"),
+    ("n_shells", "i8"),
+    ("store", bool),
+    ("n_collisions", "i8"),
+    ("total_radiated_energy", "f8"),
+    ("runtime", "f8"),
+)
+
+_STRING_COLUMNS = ("key", "gamma_distribution")
+
+
+def _summarize(jet: Jet, key: str) -> Dict[str, object]:
+
+    ic = jet.initial_conditions
+
+    return dict(
+        key=key,
+        gamma_distribution=type(ic.gamma_distribution).__name__,
+        total_time=ic.total_time,
+        delta_time=ic.variability_time,
+        total_energy=ic.total_energy,
+        r_min=ic.r_min,
+        r_max=np.nan if ic.r_max is None else ic.r_max,
+        n_shells=int(ic.n_shells),
+        store=jet.store,
+        n_collisions=jet.n_collisions,
+        total_radiated_energy=jet.radiated_energy,
+        runtime=np.nan if jet.runtime is None else jet.runtime,
+    )
+
+
+class EnsembleStore(object):
+
+    def __init__(self, file_name: str) -> None:
+        """
+        A single HDF5 file holding the results of many jets,
+        along with a table of their initial conditions and a
+        summary of each run that can be searched without reading
+        the runs themselves.
+
+        Runs live in runs/<key> with the same layout as the
+        files written by Jet.write_to. Appends take an exclusive lock
+        on <file_name>.lock, so several processes can add runs to
+        the same store.
+
+        :param file_name: the store file, created if needed
+        :type file_name: str
+        :returns:
+
+        """
+
+        self._file_name: str = str(file_name)
+
+        self._lock_file: str = f"{self._file_name}.lock"
+
+        with self._locked(exclusive=True):
+
+            with h5py.File(self._file_name, "a") as f:
+
+                if "table" not in f:
+
+                    self._create_table(f)
+
+                    f.create_group("runs")
+
+    @property
+    def file_name(self) -> str:
+
+        return self._file_name
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+
+        with open(self._lock_file, "a") as lock:
+
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+            try:
+
+                yield
+
+            finally:
+
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _create_table(f) -> None:
+
+        table = f.create_group("table")
+
+        for name, dtype in _TABLE_COLUMNS:
+
+            table.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(1024,))
+
+    def append(self, jet: Jet, key: Optional[str] = None, options: Optional[WriterOptions] = None) -> str:
+        """
+        add a finished jet to the store
+
+        :param jet: the jet after start has been called
+        :type jet: Jet
+        :param key: the key of the run. By default, run_<n>
+        :type key: Optional[str]
+        :param options: the writer options for the run
+        :type options: Optional[WriterOptions]
+        :returns: the key of the run
+
+        """
+
+        with self._locked(exclusive=True):
+
+            with h5py.File(self._file_name, "a") as f:
+
+                table = f["table"]
+
+                n_runs = table["key"].shape[0]
+
+                if key is None:
+
+                    key = f"run_{n_runs}"
+
+                if key in f["runs"]:
+
+                    log.error(f"there is already a run called {key}")
+
+                    raise KeyError(key)
+
+                jet.to_hdf5(f["runs"].create_group(key), options)
+
+                row = _summarize(jet, key)
+
+                for name, _ in _TABLE_COLUMNS:
+
+                    dset = table[name]
+
+                    dset.resize((n_runs + 1,))
+
+                    dset[n_runs] = row[name]
+
+        return key
+
+    @property
+    def n_runs(self) -> int:
+
+        with self._locked(exclusive=False), h5py.File(self._file_name, "r") as f:
+
+            return f["table/key"].shape[0]
+
+    @property
+    def table(self) -> pd.DataFrame:
+        """
+        the initial conditions and summary of every run,
+        indexed by key. No run is read
+
+        :returns:
+
+        """
+
+        with self._locked(exclusive=False), h5py.File(self._file_name, "r") as f:
+
+            table = f["table"]
+
+            columns = {}
+
+            for name, _ in _TABLE_COLUMNS:
+
+                if name in _STRING_COLUMNS:
+
+                    columns[name] = table[name].asstr()[()]
+
+                else:
+
+                    columns[name] = table[name][()]
+
+        return pd.DataFrame(columns).set_index("key")
+
+    def select(self, query: str) -> List[str]:
+        """
+        the keys of the runs matching a pandas query
+        on the table, e.g. "r_min > 1e7 and n_collisions > 100"
+
+        :param query:
+        :type query: str
+        :returns:
+
+        """
+
+        return list(self.table.query(query).index)
+
+    def keys(self) -> List[str]:
+
+        return list(self.table.index)
+
+    def load(self, key: str) -> Tuple[CollisionHistory, Optional[DetailedHistory]]:
+        """
+        read the collisions and shell history of a run
+
+        :param key:
+        :type key: str
+        :returns:
+
+        """
+
+        return self.load_many([key])[key]
+
+    def load_many(self, keys: List[str]) -> Dict[str, Tuple[CollisionHistory, Optional[DetailedHistory]]]:
+        """
+        read several runs while opening the file once
+
+        :param keys:
+        :returns:
+
+        """
+
+        out = {}
+
+        with self._locked(exclusive=False), h5py.File(self._file_name, "r") as f:
+
+            for key in keys:
+
+                run = f["runs"][key]
+
+                if "collisions" not in run:
+
+                    log.error(f"the run {key} did not keep its collisions")
+
+                    raise RuntimeError()
+
+                collisions = CollisionHistory.from_hdf5(run["collisions"])
+
+                shells = DetailedHistory.from_hdf5(run["shells"]) if run.attrs["store"] else None
+
+                out[key] = (collisions, shells)
+
+        return out
+
+    def open_lazy(self, key: str) -> JetFile:
+        """
+        open a run for reading on demand. The returned JetFile
+        holds a shared lock on the store until it is closed, so
+        appends wait for it. Use it as a context manager
+
+        :param key:
+        :returns:
+
+        """
+
+        return JetFile(self._file_name, f"runs/{key}", lock_file=self._lock_file)
+
+    def __len__(self) -> int:
+
+        return self.n_runs
+
+    def __contains__(self, key: str) -> bool:
+
+        with self._locked(exclusive=False), h5py.File(self._file_name, "r") as f:
+
+            return key in f["runs"]
@@ -0,0 +1,513 @@
+import copy
+from dataclasses import replace
+from typing import Iterator, Optional, Tuple
+
+import h5py
+import numpy as np
+
+from .io.hdf5_writer import WriterOptions, append_datasets, read_column, write_datasets
+from .io.logging import setup_logger
+from .shell_history import DetailedHistory, ShellHistory
+from .utils.numba_funcs import velocity
+
+log = setup_logger(__name__)
+
+# the kinds of events. Before the action of an event, every
+# active shell is moved by its delta_time
+
+# a shell is emitted at r_min
+EMISSION = 0
+# shell absorbs other, which dies
+COLLISION = 1
+# shell passed the maximum radius and dies
+EXIT = 2
+# the active shells only move
+MOVE = 3
+# the jet has finished
+END = 4
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("kind", "u1"),
+        ("time", "f8"),
+        ("delta_time", "f8"),
+        ("shell", "i4"),
+        ("other", "i4"),
+        ("gamma_pre", "f8"),
+        ("mass_pre", "f8"),
+        ("gamma_post", "f8"),
+        ("mass_post", "f8"),
+        ("snapshot", "?"),
+    ]
+)
+
+_INITIAL_SIZE = 1024
+
+
+class EventLog(object):
+
+    def __init__(self, initial_gamma: np.ndarray, initial_mass: np.ndarray, r_min: float) -> None:
+        """
+        A compact record of everything that happens to the shells
+        of a jet. Shells only move ballistically between events, so
+        the state of every shell at any time can be rebuilt by replaying
+        the log, at a cost of O(events) storage instead of the
+        O(events x shells) of storing the history.
+
+        Events flagged as snapshots are those after which a jet that
+        is storing records its history, so the replayed DetailedHistory
+        has the same time axis as the stored one.
+
+        :param initial_gamma: the initial gamma of every shell
+        :type initial_gamma: np.ndarray
+        :param initial_mass: the initial mass of every shell
+        :type initial_mass: np.ndarray
+        :param r_min: the radius shells are emitted at
+        :type r_min: float
+        :returns:
+
+        """
+
+        self._initial_gamma: np.ndarray = np.asarray(initial_gamma, dtype=float)
+
+        self._initial_mass: np.ndarray = np.asarray(initial_mass, dtype=float)
+
+        self._r_min: float = float(r_min)
+
+        self._events: np.ndarray = np.zeros(_INITIAL_SIZE, dtype=EVENT_DTYPE)
+
+        self._n_events: int = 0
+
+        # the events are shared with a fork until one of us appends
+        self._shared: bool = False
+
+    @property
+    def n_shells(self) -> int:
+
+        return len(self._initial_gamma)
+
+    @property
+    def initial_gamma(self) -> np.ndarray:
+
+        return self._initial_gamma
+
+    @property
+    def initial_mass(self) -> np.ndarray:
+
+        return self._initial_mass
+
+    @property
+    def n_events(self) -> int:
+
+        return self._n_events
+
+    def __len__(self) -> int:
+
+        return self._n_events
+
+    @property
+    def events(self) -> np.ndarray:
+        """
+        the events as a structured array
+
+        :returns:
+
+        """
+
+        return self._events[: self._n_events]
+
+    def fork(self, initial_gamma: Optional[np.ndarray] = None, initial_mass: Optional[np.ndarray] = None) -> "EventLog":
+        """
+        a log that shares the events so far with this one. The
+        events are copied by whichever log first adds to them
+
+        :param initial_gamma: new initial gamma of the shells, if changed
+        :param initial_mass: new initial mass of the shells, if changed
+        :returns:
+
+        """
+
+        out = copy.copy(self)
+
+        if initial_gamma is not None:
+
+            out._initial_gamma = np.asarray(initial_gamma, dtype=float)
+
+        if initial_mass is not None:
+
+            out._initial_mass = np.asarray(initial_mass, dtype=float)
+
+        self._shared = out._shared = True
+
+        return out
+
+    def _unshare(self) -> None:
+
+        if self._shared:
+
+            self._events = self._events.copy()
+
+            self._shared = False
+
+    def _append(
+        self,
+        kind: int,
+        time: float,
+        delta_time: float,
+        shell: int = -1,
+        other: int = -1,
+        gamma_pre: float = np.nan,
+        mass_pre: float = np.nan,
+        gamma_post: float = np.nan,
+        mass_post: float = np.nan,
+    ) -> None:
+
+        self._unshare()
+
+        if self._n_events == len(self._events):
+
+            self._events = np.concatenate([self._events, np.zeros_like(self._events)])
+
+        self._events[self._n_events] = (
+            kind, time, delta_time, shell, other, gamma_pre, mass_pre, gamma_post, mass_post, False
+        )
+
+        self._n_events += 1
+
+    def emission(self, time: float, delta_time: float, shell: int) -> None:
+
+        self._append(EMISSION, time, delta_time, shell)
+
+    def collision(
+        self,
+        time: float,
+        delta_time: float,
+        shell: int,
+        other: int,
+        gamma_pre: float,
+        mass_pre: float,
+        gamma_post: float,
+        mass_post: float,
+    ) -> None:
+
+        self._append(COLLISION, time, delta_time, shell, other, gamma_pre, mass_pre, gamma_post, mass_post)
+
+    def exit(self, time: float, shell: int) -> None:
+
+        self._append(EXIT, time, 0.0, shell)
+
+    def move(self, time: float, delta_time: float) -> None:
+
+        self._append(MOVE, time, delta_time)
+
+    def end(self, time: float) -> None:
+
+        self._append(END, time, 0.0)
+
+    def mark_snapshot(self) -> None:
+        """
+        flag the last event as one after which the
+        history is recorded
+
+        :returns:
+
+        """
+
+        if self._n_events > 0:
+
+            self._unshare()
+
+            self._events["snapshot"][self._n_events - 1] = True
+
+    def _initial_state(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+
+        gamma = self._initial_gamma.copy()
+
+        radius = np.full(self.n_shells, self._r_min)
+
+        mass = self._initial_mass.copy()
+
+        status = np.zeros(self.n_shells, dtype=bool)
+
+        return gamma, radius, mass, status
+
+    def _replay(self, stop_time: Optional[float] = None) -> Iterator[Tuple[int, float]]:
+        """
+        replay the events into the state arrays, yielding the index and
+        time after each one. The state is in self._state
+
+        """
+
+        gamma, radius, mass, status = self._state = self._initial_state()
+
+        # the same velocity a shell caches
+
+        v = np.array([velocity(g) for g in gamma])
+
+        for idx, event in enumerate(self.events):
+
+            if stop_time is not None and event["time"] > stop_time:
+
+                return
+
+            delta_time = event["delta_time"]
+
+            if delta_time != 0.0:
+
+                radius[status] += v[status] * delta_time
+
+            kind = event["kind"]
+
+            if kind == EMISSION:
+
+                status[event["shell"]] = True
+
+            elif kind == COLLISION:
+
+                shell = event["shell"]
+
+                gamma[shell] = event["gamma_post"]
+
+                mass[shell] = event["mass_post"]
+
+                v[shell] = velocity(gamma[shell])
+
+                status[event["other"]] = False
+
+            elif kind == EXIT:
+
+                status[event["shell"]] = False
+
+            yield idx, event["time"]
+
+    def state_at(self, time: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        the gamma, radius, mass and status of every shell at a time.
+        Between events, the shells are moved ballistically if they
+        were moving up to the next event
+
+        :param time:
+        :type time: float
+        :returns: arrays ordered by shell id
+
+        """
+
+        last_idx, last_time = -1, 0.0
+
+        for last_idx, last_time in self._replay(stop_time=time):
+
+            pass
+
+        gamma, radius, mass, status = self._state
+
+        following = last_idx + 1
+
+        if following < self._n_events and self._events["delta_time"][following] != 0.0 and time > last_time:
+
+            v = np.array([velocity(g) for g in gamma[status]])
+
+            radius[status] += v * (time - last_time)
+
+        return gamma, radius, mass, status
+
+    def _snapshots(self) -> Iterator[float]:
+
+        # the history always starts with the initial state
+
+        self._state = self._initial_state()
+
+        yield 0.0
+
+        snapshot = self._events["snapshot"]
+
+        for idx, time in self._replay():
+
+            if snapshot[idx]:
+
+                yield time
+
+    def detailed_history(self) -> DetailedHistory:
+        """
+        rebuild the history that the jet would have stored
+
+        :returns:
+
+        """
+
+        n_snapshots = 1 + int(np.sum(self.events["snapshot"]))
+
+        time = np.empty(n_snapshots)
+
+        columns = [np.empty((n_snapshots, self.n_shells)) for _ in range(3)]
+
+        status = np.empty((n_snapshots, self.n_shells), dtype=bool)
+
+        for i, t in enumerate(self._snapshots()):
+
+            time[i] = t
+
+            for column, values in zip(columns, self._state[:3]):
+
+                column[i] = values
+
+            status[i] = self._state[3]
+
+        return DetailedHistory.from_arrays(time=time, gamma=columns[0], radius=columns[1], mass=columns[2], status=status)
+
+    def shell_history(self, shell_id: int) -> ShellHistory:
+        """
+        rebuild the stored history of a single shell
+
+        :param shell_id:
+        :type shell_id: int
+        :returns:
+
+        """
+
+        if not 0 <= shell_id < self.n_shells:
+
+            raise IndexError(shell_id)
+
+        # only this shell has to be followed
+
+        gamma = float(self._initial_gamma[shell_id])
+
+        mass = float(self._initial_mass[shell_id])
+
+        radius = self._r_min
+
+        active = False
+
+        v = velocity(gamma)
+
+        history = ShellHistory()
+
+        history.add_entry(time=0.0, gamma=gamma, radius=radius, mass=mass, status=active)
+
+        for event in self.events:
+
+            if active and event["delta_time"] != 0.0:
+
+                radius += v * float(event["delta_time"])
+
+            kind = event["kind"]
+
+            if kind == EMISSION and event["shell"] == shell_id:
+
+                active = True
+
+            elif kind == COLLISION and event["shell"] == shell_id:
+
+                gamma = float(event["gamma_post"])
+
+                mass = float(event["mass_post"])
+
+                v = velocity(gamma)
+
+            elif (kind == COLLISION and event["other"] == shell_id) or (kind == EXIT and event["shell"] == shell_id):
+
+                active = False
+
+            if event["snapshot"]:
+
+                history.add_entry(time=float(event["time"]), gamma=gamma, radius=radius, mass=mass, status=active)
+
+        return history
+
+    def to_hdf5(self, group, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the log to an HDF5 group
+
+        :param group:
+        :param options: the writer options. By default, those of the configuration
+        :returns:
+
+        """
+
+        if options is None:
+
+            options = WriterOptions.from_config()
+
+        # the replay has to see exactly what the jet saw
+
+        options = replace(options, float32=False, precision=None)
+
+        group.attrs["r_min"] = self._r_min
+
+        events = self.events
+
+        columns = {name: events[name] for name in EVENT_DTYPE.names}
+
+        columns["initial_gamma"] = self._initial_gamma
+        columns["initial_mass"] = self._initial_mass
+
+        write_datasets(group, columns, options)
+
+    def append_to_hdf5(self, group, start: int, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the events from start on to an HDF5 group, growing the
+        datasets that an earlier call made. Any events written
+        after start before are dropped
+
+        :param group:
+        :param start: the first event to write
+        :param options: the writer options. By default, those of the configuration
+        :returns:
+
+        """
+
+        if options is None:
+
+            options = WriterOptions.from_config()
+
+        options = replace(options, float32=False, precision=None)
+
+        if "initial_gamma" not in group:
+
+            group.attrs["r_min"] = self._r_min
+
+            write_datasets(group, dict(initial_gamma=self._initial_gamma, initial_mass=self._initial_mass), options)
+
+        events = self._events[start : self._n_events]
+
+        append_datasets(group, {name: events[name] for name in EVENT_DTYPE.names}, start, options)
+
+    @classmethod
+    def from_hdf5(cls, group, n_events: Optional[int] = None):
+
+        obj = cls(read_column(group["initial_gamma"]), read_column(group["initial_mass"]), group.attrs["r_min"])
+
+        n = group["kind"].shape[0] if n_events is None else int(n_events)
+
+        events = np.zeros(max(n, 1), dtype=EVENT_DTYPE)
+
+        for name in EVENT_DTYPE.names:
+
+            events[name][:n] = read_column(group[name], slice(0, n))
+
+        obj._events = events
+
+        obj._n_events = n
+
+        return obj
+
+    @classmethod
+    def from_file(cls, file_name: str, path: str = "events"):
+        """
+        read the event log of a jet file
+
+        :param file_name:
+        :param path: the group of the log
+        :returns:
+
+        """
+
+        with h5py.File(file_name, "r") as f:
+
+            if path not in f:
+
+                log.error(f"{file_name} has no event log at {path}")
+
+                raise RuntimeError()
+
+            return cls.from_hdf5(f[path])
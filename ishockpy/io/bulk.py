@@ -0,0 +1,131 @@
+import glob
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence, Union
+
+import h5py
+import numpy as np
+import pandas as pd
+from tqdm.auto import tqdm
+
+from ..collision import COLLISION_COLUMNS
+from ..utils.configuration import ishockpy_config
+from ..utils.constants import c
+from .hdf5_writer import read_column
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+def _read_columns(file_name: str, path: str, columns: Sequence[str]) -> Dict[str, np.ndarray]:
+
+    with h5py.File(file_name, "r") as f:
+
+        group = f[path]
+
+        # time_observer is computed from time and radius
+
+        names = set(columns) - {"time_observer"}
+
+        if "time_observer" in columns:
+
+            names |= {"time", "radius"}
+
+        out = {name: np.asarray(read_column(group[name]), dtype=float) for name in names}
+
+    if "time_observer" in columns:
+
+        out["time_observer"] = out["time"] - out["radius"] / c
+
+    return {name: out[name] for name in columns}
+
+
+def _resolve_files(files: Union[str, Sequence[str]]) -> List[str]:
+
+    if isinstance(files, str):
+
+        resolved = sorted(glob.glob(files))
+
+    else:
+
+        resolved = [str(f) for f in files]
+
+    if not resolved:
+
+        log.error(f"no files to load from {files}")
+
+        raise RuntimeError()
+
+    return resolved
+
+
+def load_collisions(
+    files: Union[str, Sequence[str]],
+    columns: Optional[Sequence[str]] = None,
+    n_workers: int = 8,
+    processes: bool = False,
+    path: str = "collisions",
+) -> pd.DataFrame:
+    """
+    read the collisions of many result files into a single table
+    with a run column giving the position of each file in the list.
+    The file names are kept in the attrs of the table under files.
+
+    The files are read by a pool of workers. h5py runs one HDF5 call
+    at a time per process, so threads mostly overlap the opening and
+    decoding of files, while processes also read in parallel
+
+    :param files: a glob pattern (sorted) or a list of files
+    :param columns: the columns to read, any of the collision columns
+    and time_observer. By default, all collision columns
+    :param n_workers: the number of workers
+    :param processes: use processes instead of threads
+    :param path: the collisions group in the files
+    :returns:
+
+    """
+
+    file_names = _resolve_files(files)
+
+    columns = list(columns) if columns is not None else list(COLLISION_COLUMNS)
+
+    unknown = set(columns) - set(COLLISION_COLUMNS) - {"time_observer"}
+
+    if unknown:
+
+        log.error(f"unknown columns {sorted(unknown)}")
+
+        raise ValueError()
+
+    results: List[Optional[Dict[str, np.ndarray]]] = [None] * len(file_names)
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+
+    with executor(max_workers=max(1, n_workers)) as pool:
+
+        futures = {pool.submit(_read_columns, file_name, path, columns): i for i, file_name in enumerate(file_names)}
+
+        with tqdm(
+            total=len(file_names), desc="loading runs", disable=not ishockpy_config.show_progress
+        ) as progress:
+
+            for future in as_completed(futures):
+
+                results[futures[future]] = future.result()
+
+                progress.update(1)
+
+    lengths = [len(result[columns[0]]) if columns else 0 for result in results]
+
+    table = dict(run=np.repeat(np.arange(len(file_names)), lengths))
+
+    for name in columns:
+
+        table[name] = np.concatenate([result[name] for result in results])
+
+    out = pd.DataFrame(table, copy=False)
+
+    out.attrs["files"] = file_names
+
+    log.debug(f"loaded {len(out)} collisions from {len(file_names)} files")
+
+    return out
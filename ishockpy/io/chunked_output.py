@@ -0,0 +1,529 @@
+import os
+import queue
+import threading
+from typing import Optional, Tuple
+
+import h5py
+import numpy as np
+
+from ..collision import _INDEX_RUN, OBSERVER_BLOCK, ObserverIndexBuilder
+from ..shell_history import HISTORY_FORMAT_VERSION
+from .hdf5_writer import WriterOptions
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_COLLISION_COLUMNS = ("radiated_energy", "gamma", "radius", "time")
+
+_SNAPSHOT_COLUMNS = ("gamma", "radius", "mass")
+
+# tells the writer thread to stop
+_STOP = None
+
+# the number of blocks of each kind that can wait for the writer
+_QUEUE_DEPTH = 2
+
+# the number of values per column to buffer for the
+# snapshots, which have one value per shell in each row
+_MAX_SNAPSHOT_BUFFER = 1 << 22
+
+
+class ChunkedOutput(object):
+
+    def __init__(
+        self,
+        file_name: str,
+        n_shells: int,
+        store: bool = False,
+        chunk_size: int = 1024,
+        options: Optional[WriterOptions] = None,
+        swmr: bool = False,
+        resume_from: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        Appends the collisions and (if storing) the history snapshots of
+        a running jet to resizable, chunked HDF5 datasets. Rows are buffered
+        in blocks of chunk_size and handed to a background thread that does
+        the writing, so that the simulation does not wait on the disk.
+        Snapshot blocks hold fewer rows when there are many shells.
+
+        The observer time index is sorted as the collisions are written,
+        in runs kept in a temporary file next to the output, and is
+        merged into the file when it is closed.
+
+        The file is flushed after every block, so a crash only loses
+        the rows not yet on disk: the partly filled buffer, the block
+        being written and up to _QUEUE_DEPTH blocks waiting for the
+        writer, per kind of row. In SWMR mode, readers can follow the file
+        as it grows (see CollisionTail) and see a new block of rows
+        every chunk_size collisions.
+
+        :param file_name: the file to write
+        :type file_name: str
+        :param n_shells: the number of shells in the jet
+        :type n_shells: int
+        :param store: write history snapshots
+        :type store: bool
+        :param chunk_size: the number of rows per block
+        :type chunk_size: int
+        :param options: the writer options. By default, those of the
+        configuration. Blocks are always written as whole chunks
+        :type options: Optional[WriterOptions]
+        :param swmr: write in single-writer/multiple-reader mode
+        :type swmr: bool
+        :param resume_from: reopen an existing file holding this number of
+        collisions and snapshots, dropping any rows written after them
+        :type resume_from: Optional[Tuple[int, int]]
+        :returns:
+
+        """
+
+        self._file_name: str = file_name
+
+        self._n_shells: int = int(n_shells)
+
+        self._store: bool = store
+
+        self._chunk_size: int = int(chunk_size)
+
+        options = options if options is not None else WriterOptions.from_config()
+
+        self._options: WriterOptions = options
+
+        self._filters = options.filter_kwargs()
+
+        self._float = "f4" if options.float32 else "f8"
+
+        precision = options.precision if options.precision is not None else {}
+
+        quantized = sorted(name for name, policy in precision.items() if policy.kind == "quantized")
+
+        if quantized:
+
+            log.warning(f"{quantized} can not be quantized while streaming and are written as {self._float}")
+
+        self._snapshot_rows: int = max(1, min(self._chunk_size, _MAX_SNAPSHOT_BUFFER // max(self._n_shells, 1)))
+
+        self._swmr: bool = swmr
+
+        self._n_collisions_written: int = 0
+        self._n_snapshots_written: int = 0
+
+        self._index = ObserverIndexBuilder(os.path.dirname(os.path.abspath(file_name)))
+
+        self._closed: bool = False
+
+        if resume_from is None:
+
+            self._file = h5py.File(file_name, "w", libver="latest" if swmr else None)
+
+            self._file.attrs["store"] = store
+
+            self._create_datasets()
+
+        else:
+
+            self._file = h5py.File(file_name, "a", libver="latest" if swmr else None)
+
+            self._truncate(*resume_from)
+
+        if self._swmr:
+
+            # no new objects can be made from here on
+
+            self._file.swmr_mode = True
+
+        self._new_collision_buffer()
+
+        if self._store:
+
+            self._new_snapshot_buffer()
+
+        # keep the number of blocks in flight small
+        # so that memory stays bounded
+
+        self._queue: queue.Queue = queue.Queue(maxsize=_QUEUE_DEPTH)
+
+        self._error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+
+        self._thread.start()
+
+    @property
+    def file_name(self) -> str:
+
+        return self._file_name
+
+    @property
+    def chunk_size(self) -> int:
+
+        return self._chunk_size
+
+    @property
+    def swmr(self) -> bool:
+
+        return self._swmr
+
+    @property
+    def n_collisions_written(self) -> int:
+
+        return self._n_collisions_written
+
+    @property
+    def n_snapshots_written(self) -> int:
+
+        return self._n_snapshots_written
+
+    def _truncate(self, n_collisions: int, n_snapshots: int) -> None:
+
+        collision_grp = self._file["collisions"]
+
+        for name in _COLLISION_COLUMNS:
+
+            collision_grp[name].resize((n_collisions,))
+
+        if self._store:
+
+            shell_grp = self._file["shells"]
+
+            shell_grp["time"].resize((n_snapshots,))
+
+            for name in _SNAPSHOT_COLUMNS + ("status",):
+
+                shell_grp[name].resize((n_snapshots, self._n_shells))
+
+        self._n_collisions_written = n_collisions
+        self._n_snapshots_written = n_snapshots
+
+        # the collisions already written go into the index a slice at a time
+
+        for start in range(0, n_collisions, _INDEX_RUN):
+
+            stop = min(start + _INDEX_RUN, n_collisions)
+
+            self._index.add(collision_grp["time"][start:stop], collision_grp["radius"][start:stop])
+
+    def _create_datasets(self) -> None:
+
+        collision_grp = self._file.create_group("collisions")
+
+        for name in _COLLISION_COLUMNS:
+
+            collision_grp.create_dataset(
+                name, shape=(0,), maxshape=(None,), dtype=self._options.stream_dtype(f"collisions/{name}"), chunks=(self._chunk_size,), **self._filters
+            )
+
+        # filled in when we close, but made now as
+        # nothing can be created in SWMR mode
+
+        index_grp = collision_grp.create_group("observer_index")
+
+        index_grp.attrs["block_size"] = OBSERVER_BLOCK
+
+        for name, dtype in (("order", "i8"), ("time_observer", "f8"), ("block_min", "f8"), ("block_max", "f8")):
+
+            index_grp.create_dataset(
+                name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(self._chunk_size,), **self._filters
+            )
+
+        if self._store:
+
+            shell_grp = self._file.create_group("shells")
+
+            shell_grp.attrs["version"] = HISTORY_FORMAT_VERSION
+            shell_grp.attrs["n_shells"] = self._n_shells
+
+            row_chunks = (self._snapshot_rows, min(self._n_shells, 256))
+
+            shell_grp.create_dataset(
+                "time", shape=(0,), maxshape=(None,), dtype=self._options.stream_dtype("shells/time"), chunks=(self._chunk_size,), **self._filters
+            )
+
+            for name in _SNAPSHOT_COLUMNS:
+
+                shell_grp.create_dataset(
+                    name,
+                    shape=(0, self._n_shells),
+                    maxshape=(None, self._n_shells),
+                    dtype=self._options.stream_dtype(f"shells/{name}"),
+                    chunks=row_chunks,
+                    **self._filters
+                )
+
+            shell_grp.create_dataset(
+                "status",
+                shape=(0, self._n_shells),
+                maxshape=(None, self._n_shells),
+                dtype=bool,
+                chunks=row_chunks,
+                **self._filters
+            )
+
+    def _new_collision_buffer(self) -> None:
+
+        self._collision_buffer = np.empty((len(_COLLISION_COLUMNS), self._chunk_size))
+
+        self._n_collisions_buffered = 0
+
+    def _new_snapshot_buffer(self) -> None:
+
+        self._time_buffer = np.empty(self._snapshot_rows)
+
+        self._snapshot_buffer = np.empty((len(_SNAPSHOT_COLUMNS), self._snapshot_rows, self._n_shells))
+
+        self._status_buffer = np.empty((self._snapshot_rows, self._n_shells), dtype=bool)
+
+        self._n_snapshots_buffered = 0
+
+    def add_collision(self, radiated_energy: float, gamma: float, radius: float, time: float) -> None:
+
+        idx = self._n_collisions_buffered
+
+        buffer = self._collision_buffer
+
+        buffer[0, idx] = radiated_energy
+        buffer[1, idx] = gamma
+        buffer[2, idx] = radius
+        buffer[3, idx] = time
+
+        self._n_collisions_buffered += 1
+
+        if self._n_collisions_buffered == self._chunk_size:
+
+            self._submit_collisions()
+
+    def record_snapshot(self, time: float, gamma: np.ndarray, radius: np.ndarray, mass: np.ndarray, status: np.ndarray) -> None:
+
+        idx = self._n_snapshots_buffered
+
+        self._time_buffer[idx] = time
+        self._snapshot_buffer[0, idx] = gamma
+        self._snapshot_buffer[1, idx] = radius
+        self._snapshot_buffer[2, idx] = mass
+        self._status_buffer[idx] = status
+
+        self._n_snapshots_buffered += 1
+
+        if self._n_snapshots_buffered == self._snapshot_rows:
+
+            self._submit_snapshots()
+
+    def _submit_collisions(self) -> None:
+
+        n = self._n_collisions_buffered
+
+        if n == 0:
+
+            return
+
+        # the writer thread owns the old buffer from now on
+
+        self._put(("collisions", self._collision_buffer[:, :n]))
+
+        self._new_collision_buffer()
+
+    def _submit_snapshots(self) -> None:
+
+        n = self._n_snapshots_buffered
+
+        if n == 0:
+
+            return
+
+        self._put(
+            ("shells", (self._time_buffer[:n], self._snapshot_buffer[:, :n], self._status_buffer[:n]))
+        )
+
+        self._new_snapshot_buffer()
+
+    def flush(self) -> None:
+        """
+        hand the buffered rows to the writer and
+        wait until everything is on disk
+
+        :returns:
+
+        """
+
+        self._submit_collisions()
+
+        if self._store:
+
+            self._submit_snapshots()
+
+        self._queue.join()
+
+        self._check_error()
+
+    def _put(self, item) -> None:
+
+        if self._closed:
+
+            log.error(f"{self._file_name} has already been closed")
+
+            raise RuntimeError()
+
+        self._check_error()
+
+        self._queue.put(item)
+
+    def _check_error(self) -> None:
+
+        if self._error is not None:
+
+            log.error(f"writing to {self._file_name} failed: {self._error}")
+
+            raise RuntimeError() from self._error
+
+    def _write_loop(self) -> None:
+
+        while True:
+
+            item = self._queue.get()
+
+            if item is _STOP:
+
+                self._queue.task_done()
+
+                break
+
+            if self._error is None:
+
+                try:
+
+                    kind, data = item
+
+                    if kind == "collisions":
+
+                        self._write_collisions(data)
+
+                    else:
+
+                        self._write_snapshots(*data)
+
+                    self._file.flush()
+
+                except BaseException as e:
+
+                    self._error = e
+
+            # after a failure everything else is dropped
+
+            self._queue.task_done()
+
+    def _write_collisions(self, block: np.ndarray) -> None:
+
+        n = block.shape[1]
+
+        start = self._n_collisions_written
+
+        grp = self._file["collisions"]
+
+        for i, name in enumerate(_COLLISION_COLUMNS):
+
+            dset = grp[name]
+
+            dset.resize((start + n,))
+
+            dset[start:] = block[i]
+
+        # index the values as they were stored
+
+        time, radius = (block[_COLLISION_COLUMNS.index(name)].astype(grp[name].dtype) for name in ("time", "radius"))
+
+        self._index.add(time, radius)
+
+        self._n_collisions_written += n
+
+    def _write_snapshots(self, time: np.ndarray, block: np.ndarray, status: np.ndarray) -> None:
+
+        n = len(time)
+
+        start = self._n_snapshots_written
+
+        grp = self._file["shells"]
+
+        grp["time"].resize((start + n,))
+        grp["time"][start:] = time
+
+        for i, name in enumerate(_SNAPSHOT_COLUMNS):
+
+            dset = grp[name]
+
+            dset.resize((start + n, self._n_shells))
+
+            dset[start:] = block[i]
+
+        grp["status"].resize((start + n, self._n_shells))
+        grp["status"][start:] = status
+
+        self._n_snapshots_written += n
+
+    def close(self) -> None:
+        """
+        write out what is left in the buffers, wait
+        for the writer to finish and close the file
+
+        :returns:
+
+        """
+
+        if self._closed:
+
+            return
+
+        self._submit_collisions()
+
+        if self._store:
+
+            self._submit_snapshots()
+
+        self._stop()
+
+        try:
+
+            if self._error is None:
+
+                self._index.write(self._file["collisions/observer_index"])
+
+        finally:
+
+            self._index.close()
+
+            self._file.close()
+
+        self._check_error()
+
+        log.debug(
+            f"wrote {self._n_collisions_written} collisions and {self._n_snapshots_written} snapshots to {self._file_name}"
+        )
+
+    def abort(self) -> None:
+        """
+        stop the writer and close the file after the run failed. The
+        rows handed to the writer so far are kept, but the buffered rows
+        and the observer time index are not written
+
+        :returns:
+
+        """
+
+        if self._closed:
+
+            return
+
+        self._stop()
+
+        self._index.close()
+
+        self._file.close()
+
+    def _stop(self) -> None:
+
+        self._closed = True
+
+        self._queue.put(_STOP)
+
+        self._thread.join()
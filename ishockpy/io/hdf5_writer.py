@@ -0,0 +1,669 @@
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+from ..utils.configuration import ishockpy_config
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+_CODECS = ("none", "gzip", "lzf")
+
+_PRECISIONS = ("float64", "float32", "quantized")
+
+# the rows between anchors of delta encoded columns
+# when the chunks are left to h5py
+_DELTA_BLOCK = 1024
+
+# datasets smaller than this are compressed by h5py, as
+# handing their chunks to the threads costs more than it saves
+_THREADED_BYTES = 1 << 20
+
+# the compression pools by number of threads, kept for
+# the life of the process
+_POOLS: Dict[int, ThreadPoolExecutor] = {}
+
+
+def _configured(name: str):
+
+    # read when the options are made, so that changes
+    # to the loaded configuration are picked up
+
+    return field(default_factory=lambda: getattr(ishockpy_config.hdf5_writer, name))
+
+
+def _configured_chunks() -> Optional[Tuple[int, ...]]:
+
+    chunk_size = ishockpy_config.hdf5_writer.chunk_size
+
+    return (chunk_size,) if chunk_size > 0 else None
+
+
+def _pool(n_threads: int) -> ThreadPoolExecutor:
+
+    if n_threads not in _POOLS:
+
+        _POOLS[n_threads] = ThreadPoolExecutor(max_workers=n_threads)
+
+    return _POOLS[n_threads]
+
+
+@dataclass(frozen=True)
+class ColumnPrecision:
+    """
+    How the values of a floating point column are stored
+
+    :param kind: float64, float32 or quantized. Quantized values
+    are stored as integers on a logarithmic grid, which bounds
+    the relative error. They must not be negative
+    :param max_rel_error: the largest relative error allowed when quantized
+    :param delta: store the differences of the quantized values
+    along the first (time) axis, which compress much better. The
+    first row of every chunk keeps its value, so a slice is decoded
+    from the start of its chunk rather than from the first row
+    """
+
+    kind: str = "float64"
+    max_rel_error: float = 1e-4
+    delta: bool = False
+
+    def __post_init__(self):
+
+        if self.kind not in _PRECISIONS:
+
+            log.error(f"kind must be one of {_PRECISIONS} not {self.kind}")
+
+            raise ValueError()
+
+        if self.kind == "quantized" and not 0 < self.max_rel_error < 1:
+
+            log.error(f"max_rel_error must be in (0, 1) not {self.max_rel_error}")
+
+            raise ValueError()
+
+        if self.delta and self.kind != "quantized":
+
+            log.error("only quantized columns can be delta encoded")
+
+            raise ValueError()
+
+
+@dataclass(frozen=True)
+class WriterOptions:
+    """
+    How datasets are written to HDF5
+
+    :param compression: the codec: none, gzip or lzf
+    :param compression_level: the gzip level (0-9)
+    :param shuffle: apply the byte shuffle filter before compressing
+    :param chunks: the chunk shape. A single value is used along every
+    axis, datasets of lower rank use the leading axes and the shape is
+    clipped to that of each dataset. None lets the writer choose
+    :param float32: downcast floating point columns to float32
+    :param n_threads: the number of threads compressing the chunks
+    of large datasets
+    :param precision: the precision of columns keyed by group and
+    column, e.g. {"shells/radius": ColumnPrecision("quantized", 1e-5)}.
+    It takes the place of float32 for those datasets. The streaming
+    ChunkedOutput only applies float32 and float64, other columns are
+    quantized when whole columns are written
+    """
+
+    # the defaults are those of the loaded configuration
+
+    compression: str = _configured("compression")
+    compression_level: int = _configured("compression_level")
+    shuffle: bool = _configured("shuffle")
+    chunks: Optional[Tuple[int, ...]] = field(default_factory=_configured_chunks)
+    float32: bool = _configured("float32")
+    n_threads: int = _configured("n_threads")
+    precision: Optional[Mapping[str, ColumnPrecision]] = None
+
+    def __post_init__(self):
+
+        if self.compression not in _CODECS:
+
+            log.error(f"compression must be one of {_CODECS} not {self.compression}")
+
+            raise ValueError()
+
+        for key in self.precision if self.precision is not None else ():
+
+            if key.count("/") != 1:
+
+                log.error(f"precision is keyed by <group>/<column>, e.g. shells/radius, not {key}")
+
+                raise ValueError()
+
+    @classmethod
+    def from_config(cls, **overrides) -> "WriterOptions":
+        """
+        the options set in the ishockpy configuration with
+        any of the fields overridden
+
+        :returns:
+
+        """
+
+        return cls(**overrides)
+
+    def filter_kwargs(self) -> Dict[str, Any]:
+        """
+        the filter keywords for h5py create_dataset
+
+        :returns:
+
+        """
+
+        if self.compression == "none":
+
+            return dict(shuffle=self.shuffle) if self.shuffle else {}
+
+        kwargs: Dict[str, Any] = dict(compression=self.compression, shuffle=self.shuffle)
+
+        if self.compression == "gzip":
+
+            kwargs["compression_opts"] = self.compression_level
+
+        return kwargs
+
+    def column_precision(self, key: str) -> Optional[ColumnPrecision]:
+        """
+        the precision policy of a column, if there is one
+
+        :param key: <group>/<column>, see column_key
+        :returns:
+
+        """
+
+        return self.precision.get(key) if self.precision is not None else None
+
+    def stream_dtype(self, key: str) -> str:
+        """
+        the float dtype of a column that is appended to as it
+        is produced. Such columns can not be quantized
+
+        :param key: <group>/<column>, see column_key
+        :returns:
+
+        """
+
+        precision = self.column_precision(key)
+
+        if precision is None or precision.kind == "quantized":
+
+            return "f4" if self.float32 else "f8"
+
+        return "f8" if precision.kind == "float64" else "f4"
+
+    def chunk_shape(self, shape: Tuple[int, ...], default=None):
+        """
+        the chunk shape for a dataset of the given shape
+
+        :param shape: the shape of the dataset
+        :param default: the chunks to use if none are set
+        :returns:
+
+        """
+
+        chunks = self.chunks if self.chunks is not None else default
+
+        if chunks is None or chunks is True:
+
+            return chunks
+
+        chunks = tuple(chunks)
+
+        if len(chunks) == 1:
+
+            chunks = chunks * len(shape)
+
+        # datasets of lower rank take the leading axes
+
+        chunks = chunks[: len(shape)]
+
+        if len(chunks) != len(shape):
+
+            log.error(f"chunks {chunks} do not match the shape {shape}")
+
+            raise ValueError()
+
+        return tuple(max(1, min(c, s)) for c, s in zip(chunks, shape))
+
+
+def column_key(group, name: str) -> str:
+    """
+    the key of a dataset in WriterOptions.precision: the
+    name of the group it is in and its own name
+
+    :param group: the h5py group, or the name of the group
+    :param name: the name of the dataset
+    :returns:
+
+    """
+
+    group_name = group if isinstance(group, str) else group.name
+
+    return f"{group_name.rstrip('/').rsplit('/', 1)[-1]}/{name}"
+
+
+def _smallest_int(lo: int, hi: int) -> np.dtype:
+
+    for dtype in (np.uint8, np.uint16, np.uint32, np.int8, np.int16, np.int32):
+
+        info = np.iinfo(dtype)
+
+        if info.min <= lo and hi <= info.max:
+
+            return np.dtype(dtype)
+
+    return np.dtype(np.int64)
+
+
+def _relative_error(data: np.ndarray, decoded: np.ndarray) -> float:
+
+    nonzero = data != 0
+
+    if not np.any(nonzero):
+
+        return 0.
+
+    return float(np.max(np.abs(decoded[nonzero] - data[nonzero]) / np.abs(data[nonzero])))
+
+
+def encode_column(
+    data: np.ndarray, precision: ColumnPrecision, block: int = _DELTA_BLOCK
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    encode a column with a precision policy
+
+    :param data: the column
+    :param precision: the policy
+    :param block: the number of rows between the rows that keep their
+    value when delta encoded, which should be the rows per chunk
+    :returns: the stored array and the attributes that describe it
+
+    """
+
+    data = np.asarray(data)
+
+    if data.dtype.kind != "f":
+
+        log.error(f"precision policies only apply to floating point columns not {data.dtype}")
+
+        raise ValueError()
+
+    if precision.kind == "float64":
+
+        return data.astype(np.float64), {}
+
+    if precision.kind == "float32":
+
+        stored = data.astype(np.float32)
+
+        return stored, dict(encoding="float32", max_rel_error=_relative_error(data, stored))
+
+    if not np.all(np.isfinite(data)) or np.any(data < 0):
+
+        log.error("quantized columns must be finite and not negative")
+
+        raise ValueError()
+
+    # rounding log(x) to a multiple of step is off by at
+    # most step / 2, which is a relative error of exp(step / 2) - 1
+
+    step = 2 * np.log1p(precision.max_rel_error)
+
+    positive = data > 0
+
+    q = np.zeros(data.shape, dtype=np.int64)
+
+    q[positive] = np.rint(np.log(data[positive]) / step)
+
+    # 0 is kept for zero and the rest start from 1
+
+    offset = int(q[positive].min()) - 1 if np.any(positive) else 0
+
+    codes = np.where(positive, q - offset, 0)
+
+    attrs = dict(encoding="log_quantized", step=step, offset=offset, delta=precision.delta, dtype=data.dtype.str)
+
+    attrs["max_rel_error"] = _relative_error(data, _decode_codes(codes, attrs))
+
+    if precision.delta and codes.size > 0:
+
+        anchors = codes[::block].copy()
+
+        codes = np.diff(codes, axis=0, prepend=np.zeros((1,) + codes.shape[1:], dtype=codes.dtype))
+
+        codes[::block] = anchors
+
+        attrs["delta_block"] = block
+
+    lo, hi = (int(codes.min()), int(codes.max())) if codes.size > 0 else (0, 0)
+
+    return codes.astype(_smallest_int(lo, hi)), attrs
+
+
+def _decode_codes(codes: np.ndarray, attrs) -> np.ndarray:
+
+    codes = np.asarray(codes, dtype=np.int64)
+
+    values = np.exp((codes + int(attrs["offset"])) * float(attrs["step"]))
+
+    return np.where(codes == 0, 0., values).astype(np.dtype(attrs["dtype"]))
+
+
+def _undelta(deltas: np.ndarray, block: int) -> np.ndarray:
+
+    # the rows at multiples of block (from the first row
+    # read) hold their value, and the rest the difference
+    # to the row before
+
+    codes = deltas.astype(np.int64)
+
+    if block <= 0:
+
+        return np.cumsum(codes, axis=0)
+
+    for lo in range(0, len(codes), block):
+
+        codes[lo : lo + block] = np.cumsum(codes[lo : lo + block], axis=0)
+
+    return codes
+
+
+def read_column(dataset, selection=()) -> np.ndarray:
+    """
+    read a selection of a dataset, decoding it if it
+    was written with a precision policy
+
+    :param dataset: the h5py dataset
+    :param selection: anything that can index the dataset
+    :returns:
+
+    """
+
+    attrs = dataset.attrs
+
+    if attrs.get("encoding", "") != "log_quantized":
+
+        return dataset[selection]
+
+    if not attrs["delta"]:
+
+        return _decode_codes(dataset[selection], attrs)
+
+    # the differences are summed from the start of the block holding
+    # the first selected row, so read from there to the last selected row,
+    # with the rest of the selection applied as it is read
+
+    selection = selection if isinstance(selection, tuple) else (selection,)
+
+    first, rest = (selection[0], selection[1:]) if len(selection) > 0 else (slice(None), ())
+
+    if first is Ellipsis or any(item is Ellipsis for item in rest):
+
+        return _decode_codes(_undelta(dataset[()], int(attrs.get("delta_block", 0))), attrs)[selection]
+
+    block = int(attrs.get("delta_block", 0))
+
+    rows = np.arange(dataset.shape[0])[first]
+
+    if np.size(rows) == 0:
+
+        lo, hi = 0, 0
+
+    else:
+
+        hi = int(np.max(rows)) + 1
+
+        lo = int(np.min(rows)) // block * block if block > 0 else 0
+
+    codes = _undelta(dataset[(slice(lo, hi),) + tuple(rest)], block)
+
+    return _decode_codes(codes, attrs)[rows - lo]
+
+
+def decoded_dtype(dataset) -> np.dtype:
+    """
+    the dtype of a dataset once it is read with read_column
+
+    :param dataset:
+    :returns:
+
+    """
+
+    if dataset.attrs.get("encoding", "") == "log_quantized":
+
+        return np.dtype(dataset.attrs["dtype"])
+
+    return dataset.dtype
+
+
+def _as_written(key: str, data, options: WriterOptions, block: int) -> Tuple[np.ndarray, Dict[str, Any]]:
+
+    data = np.asarray(data)
+
+    precision = options.column_precision(key)
+
+    if precision is not None:
+
+        return encode_column(data, precision, block)
+
+    if options.float32 and data.dtype.kind == "f":
+
+        data = data.astype(np.float32)
+
+    return data, {}
+
+
+def _compress_chunk(data: np.ndarray, offset: Tuple[int, ...], chunks: Tuple[int, ...], level: int, shuffle: bool) -> bytes:
+
+    # edge chunks are padded out to the full chunk shape
+
+    block = np.zeros(chunks, dtype=data.dtype)
+
+    view = data[tuple(slice(o, o + c) for o, c in zip(offset, chunks))]
+
+    block[tuple(slice(0, s) for s in view.shape)] = view
+
+    raw = block.view(np.uint8).reshape(-1, data.dtype.itemsize)
+
+    if shuffle:
+
+        # the HDF5 shuffle filter groups the n-th byte of every element
+
+        raw = raw.T
+
+    return zlib.compress(np.ascontiguousarray(raw).tobytes(), level)
+
+
+def write_datasets(group, columns: Dict[str, Any], options: Optional[WriterOptions] = None, chunks=None) -> None:
+    """
+    write a set of columns to datasets in an HDF5 group
+
+    when gzip is used with more than one thread, the chunks of the
+    large datasets are compressed in a shared thread pool (zlib does not
+    hold the GIL) and written to the file directly, as h5py runs its own
+    filter pipeline serially
+
+    :param group: the group to write to
+    :param columns: the data to write by dataset name
+    :param options: the writer options. By default, those of the configuration
+    :param chunks: the chunks to use when the options do not set any
+    :returns:
+
+    """
+
+    if options is None:
+
+        options = WriterOptions.from_config()
+
+    datasets = []
+
+    for name, data in columns.items():
+
+        data = np.asarray(data)
+
+        chunk_shape = options.chunk_shape(data.shape, chunks)
+
+        if chunk_shape is None or chunk_shape is True:
+
+            # delta encoded columns start over every chunk, so
+            # they need to know the chunks
+
+            precision = options.column_precision(column_key(group, name))
+
+            if precision is not None and precision.delta and data.ndim > 0 and data.size > 0:
+
+                chunk_shape = (min(_DELTA_BLOCK, data.shape[0]),) + tuple(min(256, n) for n in data.shape[1:])
+
+        block = chunk_shape[0] if isinstance(chunk_shape, tuple) else _DELTA_BLOCK
+
+        data, attrs = _as_written(column_key(group, name), data, options, block)
+
+        direct = (
+            options.compression == "gzip"
+            and options.n_threads > 1
+            and data.ndim > 0
+            and data.size > 0
+            and data.nbytes >= _THREADED_BYTES
+        )
+
+        if direct:
+
+            # create with the filters, then let h5py pick
+            # the chunks if we have not
+
+            dset = group.create_dataset(
+                name, shape=data.shape, dtype=data.dtype, chunks=chunk_shape or True, **options.filter_kwargs()
+            )
+
+            datasets.append((dset, data))
+
+        else:
+
+            dset = group.create_dataset(name, data=data, chunks=chunk_shape, **options.filter_kwargs())
+
+        dset.attrs.update(attrs)
+
+    if not datasets:
+
+        return
+
+    tasks = []
+
+    for dset, data in datasets:
+
+        chunk_shape = dset.chunks
+
+        grid = [range(0, s, c) for s, c in zip(data.shape, chunk_shape)]
+
+        for offset in itertools.product(*grid):
+
+            tasks.append((dset, data, offset, chunk_shape))
+
+    # only the compression runs in the pool, h5py is
+    # only touched from this thread
+
+    compressed = _pool(options.n_threads).map(
+        lambda task: _compress_chunk(task[1], task[2], task[3], options.compression_level, options.shuffle),
+        tasks,
+    )
+
+    for (dset, _, offset, _), chunk in zip(tasks, compressed):
+
+        dset.id.write_direct_chunk(offset, chunk)
+
+
+def append_datasets(
+    group, columns: Dict[str, Any], start: int, options: Optional[WriterOptions] = None, chunks=None
+) -> None:
+    """
+    write rows to resizable datasets in an HDF5 group from row start on,
+    making the datasets the first time. Any rows after those written are
+    dropped, so a writer can carry on from the last rows it knows to be
+    complete. Columns can be stored as float32, but not quantized
+
+    :param group: the group to write to
+    :param columns: the rows to write by dataset name
+    :param start: the first row to write
+    :param options: the writer options. By default, those of the configuration
+    :param chunks: the chunks to use when the options do not set any
+    :returns:
+
+    """
+
+    if options is None:
+
+        options = WriterOptions.from_config()
+
+    for name, data in columns.items():
+
+        data = np.asarray(data)
+
+        if name not in group:
+
+            dtype = options.stream_dtype(column_key(group, name)) if data.dtype.kind == "f" else data.dtype
+
+            chunk_shape = options.chunk_shape((_DELTA_BLOCK,) + data.shape[1:], chunks)
+
+            if chunk_shape not in (None, True):
+
+                # only the first axis grows
+
+                chunk_shape = chunk_shape[:1] + tuple(min(c, max(n, 1)) for c, n in zip(chunk_shape[1:], data.shape[1:]))
+
+            group.create_dataset(
+                name,
+                shape=(0,) + data.shape[1:],
+                maxshape=(None,) + data.shape[1:],
+                dtype=dtype,
+                chunks=chunk_shape if chunk_shape is not None else True,
+                **options.filter_kwargs()
+            )
+
+        dset = group[name]
+
+        dset.resize((start + len(data),) + data.shape[1:])
+
+        if len(data) > 0:
+
+            dset[start:] = data
+
+
+def replace_dataset(group, name: str, data) -> None:
+    """
+    write a dataset in place when one of the same shape and
+    dtype is already there, which keeps the file from growing
+    when the same state is written again and again
+
+    :param group:
+    :param name:
+    :param data:
+    :returns:
+
+    """
+
+    data = np.asarray(data)
+
+    if name in group:
+
+        dset = group[name]
+
+        if dset.shape == data.shape and dset.dtype == data.dtype:
+
+            if data.size > 0:
+
+                dset[()] = data
+
+            return
+
+        del group[name]
+
+    group.create_dataset(name, data=data)
@@ -0,0 +1,387 @@
+import fcntl
+from typing import Dict, Optional
+
+import h5py
+import numpy as np
+
+from ..collision import CollisionHistory
+from ..shell_history import DetailedHistory, ShellHistory
+from ..utils.constants import c
+from .hdf5_writer import decoded_dtype, read_column
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+class DatasetProxy(object):
+
+    def __init__(self, dataset) -> None:
+        """
+        An array-like view of an HDF5 dataset that only reads
+        the hyperslab that is sliced out of it
+
+        :param dataset: the h5py dataset
+        :returns:
+
+        """
+
+        self._dataset = dataset
+
+    @property
+    def shape(self):
+
+        return self._dataset.shape
+
+    @property
+    def dtype(self):
+
+        return decoded_dtype(self._dataset)
+
+    @property
+    def ndim(self) -> int:
+
+        return self._dataset.ndim
+
+    def __len__(self) -> int:
+
+        return self._dataset.shape[0]
+
+    def __getitem__(self, item) -> np.ndarray:
+
+        return read_column(self._dataset, item)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+
+        out = self[()]
+
+        if dtype is not None:
+
+            out = out.astype(dtype)
+
+        return out
+
+    def read(self) -> np.ndarray:
+        """
+        read the full dataset
+
+        :returns:
+
+        """
+
+        return self[()]
+
+    def __repr__(self):
+
+        return f"DatasetProxy(shape={self.shape}, dtype={self.dtype})"
+
+
+class ObserverTimeProxy(DatasetProxy):
+
+    def __init__(self, time, radius) -> None:
+        """
+        the observer time of the collisions computed
+        from the slices of the time and radius datasets
+
+        :param time: the time dataset
+        :param radius: the radius dataset
+        :returns:
+
+        """
+
+        super(ObserverTimeProxy, self).__init__(time)
+
+        self._radius = radius
+
+    def __getitem__(self, item) -> np.ndarray:
+
+        return read_column(self._dataset, item) - read_column(self._radius, item) / c
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+
+        out = self[()]
+
+        if dtype is not None:
+
+            out = out.astype(dtype)
+
+        return out
+
+
+class LazyCollisionHistory(object):
+
+    def __init__(self, group) -> None:
+        """
+        The collisions of a jet file, read on demand
+
+        :param group: the collisions group of an open file
+        :returns:
+
+        """
+
+        self._group = group
+
+        # keep the file open as long as we are around
+
+        self._file = group.file
+
+    @property
+    def n_collisions(self) -> int:
+
+        return self._group["time"].shape[0]
+
+    def __len__(self) -> int:
+
+        return self.n_collisions
+
+    @property
+    def radiated_energy(self) -> DatasetProxy:
+
+        return DatasetProxy(self._group["radiated_energy"])
+
+    @property
+    def gamma(self) -> DatasetProxy:
+
+        return DatasetProxy(self._group["gamma"])
+
+    @property
+    def radius(self) -> DatasetProxy:
+
+        return DatasetProxy(self._group["radius"])
+
+    @property
+    def time(self) -> DatasetProxy:
+
+        return DatasetProxy(self._group["time"])
+
+    @property
+    def time_observer(self) -> ObserverTimeProxy:
+
+        return ObserverTimeProxy(self._group["time"], self._group["radius"])
+
+    def load(self, selection=slice(None)) -> CollisionHistory:
+        """
+        read a selection of the collisions into memory
+
+        :param selection: the slice or indices to read
+        :returns:
+
+        """
+
+        return CollisionHistory.from_hdf5(self._group, selection)
+
+    def observer_window(self, t_start: float, t_stop: float) -> CollisionHistory:
+        """
+        read the collisions with an observer time in [t_start, t_stop]
+        in observer time order
+
+        :param t_start:
+        :param t_stop:
+        :returns:
+
+        """
+
+        return CollisionHistory.from_hdf5_observer_window(self._group, t_start, t_stop)
+
+
+class LazyDetailedHistory(object):
+
+    def __init__(self, group) -> None:
+        """
+        The shell histories of a jet file. The shells are
+        read when they are first accessed
+
+        :param group: the shells group of an open file
+        :returns:
+
+        """
+
+        self._group = group
+
+        self._file = group.file
+
+        self._version: int = int(group.attrs.get("version", 1))
+
+        self._n_shells: int = int(group.attrs["n_shells"])
+
+        self._loaded: Dict[int, ShellHistory] = {}
+
+    @property
+    def n_shells(self) -> int:
+
+        return self._n_shells
+
+    @property
+    def n_time_steps(self) -> int:
+
+        if self._version >= 2:
+
+            return self._group["time"].shape[0]
+
+        return self._group["shell_0/time"].shape[0]
+
+    def __len__(self) -> int:
+
+        return self._n_shells
+
+    def _column(self, name: str) -> DatasetProxy:
+
+        if self._version < 2:
+
+            log.error("the per-shell layout has no (time, shell) columns")
+
+            raise RuntimeError()
+
+        return DatasetProxy(self._group[name])
+
+    @property
+    def time(self) -> DatasetProxy:
+
+        return self._column("time")
+
+    @property
+    def gamma(self) -> DatasetProxy:
+
+        return self._column("gamma")
+
+    @property
+    def radius(self) -> DatasetProxy:
+
+        return self._column("radius")
+
+    @property
+    def mass(self) -> DatasetProxy:
+
+        return self._column("mass")
+
+    @property
+    def status(self) -> DatasetProxy:
+
+        return self._column("status")
+
+    def __getitem__(self, shell_id: int) -> ShellHistory:
+
+        if shell_id < 0:
+
+            shell_id += self._n_shells
+
+        if not 0 <= shell_id < self._n_shells:
+
+            raise IndexError(shell_id)
+
+        if shell_id not in self._loaded:
+
+            self._loaded[shell_id] = self._read_shell(shell_id)
+
+        return self._loaded[shell_id]
+
+    def __iter__(self):
+
+        for i in range(self._n_shells):
+
+            yield self[i]
+
+    def _read_shell(self, shell_id: int) -> ShellHistory:
+
+        if self._version < 2:
+
+            return ShellHistory.from_hdf5(self._group[f"shell_{shell_id}"])
+
+        group = self._group
+
+        return ShellHistory(
+            gamma=read_column(group["gamma"], (slice(None), shell_id)),
+            time=read_column(group["time"]),
+            radius=read_column(group["radius"], (slice(None), shell_id)),
+            mass=read_column(group["mass"], (slice(None), shell_id)),
+            status=read_column(group["status"], (slice(None), shell_id)),
+        )
+
+    def load(self) -> DetailedHistory:
+        """
+        read the full history into memory
+
+        :returns:
+
+        """
+
+        return DetailedHistory.from_hdf5(self._group)
+
+
+class JetFile(object):
+
+    def __init__(self, file_name: str, path: str = "/", lock_file: Optional[str] = None) -> None:
+        """
+        A jet file that is kept open and read on demand
+
+        :param file_name: the file written by a jet
+        :type file_name: str
+        :param path: the group holding the jet, e.g. a run of an EnsembleStore
+        :type path: str
+        :param lock_file: hold a shared lock on this file while open,
+        so that writers taking an exclusive lock wait for us
+        :type lock_file: Optional[str]
+        :returns:
+
+        """
+
+        self._lock = None
+
+        if lock_file is not None:
+
+            self._lock = open(lock_file, "a")
+
+            fcntl.flock(self._lock, fcntl.LOCK_SH)
+
+        try:
+
+            self._file = h5py.File(file_name, "r")
+
+            group = self._file[path]
+
+        except BaseException:
+
+            self._release()
+
+            raise
+
+        self._collisions = LazyCollisionHistory(group["collisions"])
+
+        self._shells: Optional[LazyDetailedHistory] = None
+
+        if group.attrs["store"]:
+
+            self._shells = LazyDetailedHistory(group["shells"])
+
+    @property
+    def collisions(self) -> LazyCollisionHistory:
+
+        return self._collisions
+
+    @property
+    def shells(self) -> Optional[LazyDetailedHistory]:
+
+        return self._shells
+
+    def _release(self) -> None:
+
+        if self._lock is not None:
+
+            fcntl.flock(self._lock, fcntl.LOCK_UN)
+
+            self._lock.close()
+
+            self._lock = None
+
+    def close(self) -> None:
+
+        self._file.close()
+
+        self._release()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self.close()
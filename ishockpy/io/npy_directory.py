@@ -0,0 +1,186 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import h5py
+import numpy as np
+
+from ..collision import COLLISION_COLUMNS, CollisionHistory
+from ..shell_history import DetailedHistory
+from .hdf5_writer import WriterOptions
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+NPY_FORMAT_VERSION = 1
+
+MANIFEST = "manifest.json"
+
+_HISTORY_COLUMNS = ("time", "gamma", "radius", "mass", "status")
+
+
+def _save(directory: Path, name: str, data) -> Dict[str, Any]:
+
+    data = np.asarray(data)
+
+    np.save(directory / f"{name}.npy", data, allow_pickle=False)
+
+    return dict(file=f"{name}.npy", dtype=data.dtype.str, shape=list(data.shape))
+
+
+def write_npy_directory(directory: str, collisions: CollisionHistory, shells: Optional[DetailedHistory] = None) -> None:
+    """
+    write the collisions and shell history as uncompressed .npy
+    files in a directory along with a JSON manifest:
+
+    * collisions/<column>.npy, one value per collision
+    * shells/time.npy and shells/<column>.npy with one row per
+      time step and one column per shell, as in the HDF5 files
+
+    The files can be memory mapped by read_npy_directory
+
+    :param directory: the directory, created if needed
+    :param collisions: the collisions
+    :param shells: the shell history if it was stored
+    :returns:
+
+    """
+
+    directory = Path(directory)
+
+    manifest: Dict[str, Any] = dict(
+        format="ishockpy-npy", version=NPY_FORMAT_VERSION, store=shells is not None, arrays={}
+    )
+
+    collision_dir = directory / "collisions"
+
+    collision_dir.mkdir(parents=True, exist_ok=True)
+
+    for name in COLLISION_COLUMNS:
+
+        manifest["arrays"][f"collisions/{name}"] = _save(collision_dir, name, collisions.column(name))
+
+    if shells is not None:
+
+        shell_dir = directory / "shells"
+
+        shell_dir.mkdir(exist_ok=True)
+
+        for name in _HISTORY_COLUMNS:
+
+            manifest["arrays"][f"shells/{name}"] = _save(shell_dir, name, getattr(shells, name))
+
+    # the manifest goes last, so a directory
+    # with one is complete
+
+    with (directory / MANIFEST).open("w") as f:
+
+        json.dump(manifest, f, indent=1)
+
+
+def read_npy_manifest(directory: str) -> Dict[str, Any]:
+
+    manifest_file = Path(directory) / MANIFEST
+
+    if not manifest_file.exists():
+
+        log.error(f"{directory} has no {MANIFEST}")
+
+        raise RuntimeError()
+
+    with manifest_file.open() as f:
+
+        manifest = json.load(f)
+
+    if manifest.get("version", 0) > NPY_FORMAT_VERSION:
+
+        log.error(f"{directory} was written with a newer format version {manifest['version']}")
+
+        raise RuntimeError()
+
+    return manifest
+
+
+def read_npy_directory(directory: str, mmap: bool = True) -> Tuple[CollisionHistory, Optional[DetailedHistory]]:
+    """
+    read a directory written by write_npy_directory. By default the
+    arrays are memory mapped read-only, so only the pages that
+    are touched are ever read
+
+    :param directory: the directory
+    :param mmap: memory map the arrays instead of reading them
+    :returns: the collisions and the shell history (None if not stored)
+
+    """
+
+    directory = Path(directory)
+
+    manifest = read_npy_manifest(directory)
+
+    arrays = {}
+
+    for path, info in manifest["arrays"].items():
+
+        data = np.load(directory / Path(path).parent / info["file"], mmap_mode="r" if mmap else None, allow_pickle=False)
+
+        if data.dtype.str != info["dtype"] or list(data.shape) != info["shape"]:
+
+            log.error(f"{path} in {directory} does not match the manifest")
+
+            raise RuntimeError()
+
+        arrays[path] = data
+
+    collisions = CollisionHistory.from_arrays(*(arrays[f"collisions/{name}"] for name in COLLISION_COLUMNS))
+
+    shells = None
+
+    if manifest["store"]:
+
+        shells = DetailedHistory.from_arrays(*(arrays[f"shells/{name}"] for name in _HISTORY_COLUMNS))
+
+    return collisions, shells
+
+
+def hdf5_to_npy(file_name: str, directory: str) -> None:
+    """
+    convert a jet file to the .npy directory format
+
+    :param file_name: the HDF5 file
+    :param directory: the directory to write
+    :returns:
+
+    """
+
+    with h5py.File(file_name, "r") as f:
+
+        collisions = CollisionHistory.from_hdf5(f["collisions"])
+
+        shells = DetailedHistory.from_hdf5(f["shells"]) if f.attrs["store"] else None
+
+    write_npy_directory(directory, collisions, shells)
+
+
+def npy_to_hdf5(directory: str, file_name: str, options: Optional[WriterOptions] = None) -> None:
+    """
+    convert a .npy directory to a jet file. The values are
+    copied exactly unless the options downcast them
+
+    :param directory: the directory
+    :param file_name: the HDF5 file to write
+    :param options: the writer options. By default, those of the configuration
+    :returns:
+
+    """
+
+    collisions, shells = read_npy_directory(directory)
+
+    with h5py.File(file_name, "w") as f:
+
+        f.attrs["store"] = shells is not None
+
+        collisions.to_hdf5(f.create_group("collisions"), options)
+
+        if shells is not None:
+
+            shells.to_hdf5(f.create_group("shells"), options)
@@ -0,0 +1,83 @@
+import h5py
+import numpy as np
+
+from ..collision import COLLISION_COLUMNS, CollisionHistory
+from .logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+class CollisionTail(object):
+
+    def __init__(self, file_name: str) -> None:
+        """
+        Follows the collisions of a jet that is writing its
+        output file in SWMR mode (Jet(..., output=OutputOptions(output_file=..., swmr=True))).
+        Each poll returns the collisions written since the last one.
+
+        The writer flushes whole blocks, so new collisions
+        show up chunk_size at a time.
+
+        :param file_name: the output file of the running jet
+        :type file_name: str
+        :returns:
+
+        """
+
+        self._file_name: str = file_name
+
+        self._file = h5py.File(file_name, "r", libver="latest", swmr=True)
+
+        self._group = self._file["collisions"]
+
+        self._n_read: int = 0
+
+    @property
+    def n_read(self) -> int:
+        """
+        the number of collisions returned so far
+
+        :returns:
+
+        """
+
+        return self._n_read
+
+    def poll(self) -> CollisionHistory:
+        """
+        the collisions that were written since the last poll
+
+        :returns:
+
+        """
+
+        datasets = [self._group[name] for name in COLLISION_COLUMNS]
+
+        for dset in datasets:
+
+            dset.refresh()
+
+        # the columns are resized one after the other, so only
+        # read the rows that every column already has
+
+        n = min(dset.shape[0] for dset in datasets)
+
+        start = self._n_read
+
+        columns = {name: np.asarray(dset[start:n], dtype=float) for name, dset in zip(COLLISION_COLUMNS, datasets)}
+
+        self._n_read = max(n, start)
+
+        return CollisionHistory.from_arrays(**columns)
+
+    def close(self) -> None:
+
+        self._file.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self.close()
@@ -1,134 +1,1254 @@
 __author__ = "grburgess"
 
-from typing import List, Optional
+import copy
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence
 
 import h5py
 import numpy as np
-import pandas as pd
 
-from ishockpy.shell import Shell, ShellSet
+from ishockpy.shell import ShellSet
 
-from .collision import Collision, CollisionHistory
+from .accumulators import Accumulator, LightCurve, Summary
+from .collision import COLLISION_COLUMNS, Collision, CollisionHistory
 from .distribution import InitialConditions
+from .event_log import EventLog
+from .io.chunked_output import ChunkedOutput
+from .io.hdf5_writer import WriterOptions, append_datasets, read_column, replace_dataset, write_datasets
+from .io.lazy import JetFile
 from .io.logging import setup_logger
-from .shell_history import DetailedHistory
+from .io.npy_directory import read_npy_directory, write_npy_directory
+from .scaling import rescale_results
+from .shell_history import _SHELL_CHUNK, _TIME_CHUNK, DetailedHistory, ShellHistory, ShellHistorySink
+from .utils.numba_funcs import velocity
 
 log = setup_logger(__name__)
 
 MIN_DELTAT = 1e300
 
+CHECKPOINT_VERSION = 2
+
+# the number of collisions given to the accumulators at once
+_ACCUMULATOR_BATCH = 1024
+
+# tells fork to keep a setting
+_UNCHANGED = object()
+
+# the scalar state of a running jet
+_CHECKPOINT_ATTRS = (
+    "time",
+    "shell_emit_iterator",
+    "time_until_next_emission",
+    "n_collisions",
+    "radiated_energy",
+    "n_steps",
+    "status",
+)
+
+# the state of the shells, as returned by ShellSet.get_state
+_SHELL_STATE = ("gamma", "mass", "radius", "active", "birth_time", "death_time")
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """
+    What a jet keeps of its results and where it writes them while it runs
+
+    :param history_file: if storing, stream the history of each shell
+    to this file as soon as the shell dies. The file is completed with
+    the collisions when the jet finishes and can be read with from_file
+    :param output_file: append the collisions and history snapshots
+    to this file in blocks while the jet runs instead of keeping
+    them in memory. The file can be read with from_file
+    :param chunk_size: the number of rows per block of the output file.
+    The collisions are flushed to disk every chunk_size collisions
+    :param swmr: write the output file in SWMR mode so that it can be
+    followed with CollisionTail while the jet runs
+    :param record_events: keep a compact log of the emissions, collisions
+    and exits from which the history can be rebuilt, see event_log
+    :param retain_collisions: keep the collisions for collision_history.
+    Without them, the collisions can only be taken from iter_collisions
+    :param summary_only: keep neither the collisions nor the history, only
+    a fixed size summary, see summary. For screening many initial conditions
+    """
+
+    history_file: Optional[str] = None
+    output_file: Optional[str] = None
+    chunk_size: int = 1024
+    swmr: bool = False
+    record_events: bool = False
+    retain_collisions: bool = True
+    summary_only: bool = False
+
+    def __post_init__(self):
+
+        if self.history_file is not None and self.output_file is not None:
+
+            log.error("use either a history file or an output file")
+
+            raise RuntimeError()
+
+        if self.summary_only and (self.history_file is not None or self.output_file is not None):
+
+            log.error("a jet that only keeps a summary can not write its results")
+
+            raise RuntimeError()
+
+    def check(self, store: bool) -> None:
+        """
+        check that a jet can run with these options and store
+
+        :param store: whether the jet stores the history of its shells
+        :returns:
+
+        """
+
+        if self.summary_only and store:
+
+            log.error("a jet that only keeps a summary can not store its history")
+
+            raise RuntimeError()
+
+        if self.history_file is not None and not store:
+
+            log.error("a history file can only be used when storing")
+
+            raise RuntimeError()
+
+
+def _checkpoint_run_id(file_name: str) -> Optional[str]:
+
+    if not os.path.exists(file_name):
+
+        return None
+
+    with h5py.File(file_name, "r") as f:
+
+        return f.attrs.get("run_id")
+
 
 class Jet(object):
     def __init__(
-            self, initial_conditions: InitialConditions, store=False
+            self,
+            initial_conditions: InitialConditions,
+            store=False,
+            output: Optional["OutputOptions"] = None,
+            accumulators: Optional[Sequence[Accumulator]] = None,
+            checkpoint_file: Optional[str] = None,
+            checkpoint_every: Optional[int] = None,
+            checkpoint_interval: Optional[float] = None,
     ):
 
         """
-        A jet to be simulated from the given inital conditions
+        A jet to be simulated from the given inital conditions
+
+        :param initial_conditions: 
+        :type initial_conditions: InitialConditions
+        :param store: 
+        :type store: 
+        :param output: what the jet keeps of its results and where it
+        writes them while it runs. By default, it keeps the collisions
+        in memory
+        :type output: Optional[OutputOptions]
+        :param accumulators: accumulators fed with the collisions as they
+        happen, e.g. with retain_collisions=False to keep only statistics
+        :type accumulators: Optional[Sequence[Accumulator]]
+        :param checkpoint_file: write checkpoints to this file while
+        the jet runs, see checkpoint and resume
+        :type checkpoint_file: Optional[str]
+        :param checkpoint_every: checkpoint every this many steps
+        :type checkpoint_every: Optional[int]
+        :param checkpoint_interval: checkpoint every this many seconds
+        :type checkpoint_interval: Optional[float]
+        :returns: 
+
+        """
+        output = output if output is not None else OutputOptions()
+
+        output.check(store)
+
+        self._initial_conditions: InitialConditions = initial_conditions
+
+        self._n_shells: int = initial_conditions.n_shells
+
+        self._shell_emit_iterator = 0
+
+        # initialize the shells
+        
+        self._shells = ShellSet(
+            initial_conditions.gamma_distribution.values,
+            initial_conditions.mass_distribution.values,
+            initial_conditions.r_min,
+            self,
+        )
+
+        self._collisions: List[Collision] = []
+        self._retain_collisions: bool = output.retain_collisions and not output.summary_only
+
+        self._summary: Optional[Summary] = Summary() if output.summary_only else None
+
+        # the collisions not yet taken by iter_collisions
+        self._pending: Optional[deque] = None
+
+        self._accumulators: List[Accumulator] = list(accumulators) if accumulators is not None else []
+
+        # the collisions not yet given to the accumulators
+        self._accumulator_buffer: List[tuple] = []
+        self._n_collisions: int = 0
+
+        # kept whether or not the collisions are
+        self._radiated_energy: float = 0.0
+
+        self._time: float = 0.
+        self._variability_time: float = initial_conditions.variability_time
+        self._max_radius: Optional[float] = initial_conditions.r_max
+        
+
+        self._store: bool = store
+
+        self._collision_history: Optional[CollisionHistory] = None
+
+        self._runtime: Optional[float] = None
+
+        # the runtime before the last resume
+
+        self._previous_runtime: float = 0.
+        self._start_time: Optional[float] = None
+
+        self._n_steps: int = 0
+
+        self._checkpoint_file: Optional[str] = checkpoint_file
+        self._checkpoint_every: Optional[int] = checkpoint_every
+        self._checkpoint_interval: Optional[float] = checkpoint_interval
+        self._last_checkpoint: Optional[float] = None
+
+        # how far the last checkpoint got, to add to it
+        self._checkpointed: Optional[dict] = None
+
+        self._detailed_history: Optional[DetailedHistory] = None
+
+        # the file the results end up in when
+        # they are written during the run
+
+        self._result_file: Optional[str] = None
+
+        self._history_sink: Optional[ShellHistorySink] = None
+        self._output: Optional[ChunkedOutput] = None
+
+        self._event_log: Optional[EventLog] = None
+
+        if output.record_events:
+
+            self._event_log = EventLog(
+                initial_conditions.gamma_distribution.values,
+                initial_conditions.mass_distribution.values,
+                initial_conditions.r_min,
+            )
+
+        if output.history_file is not None:
+
+            self._result_file = output.history_file
+
+            self._history_h5 = h5py.File(output.history_file, "w")
+
+            self._history_sink = ShellHistorySink(self._history_h5.create_group("shells"), self._shells.n_shells)
+
+        if output.output_file is not None:
+
+            self._result_file = output.output_file
+
+            self._output = ChunkedOutput(
+                output.output_file,
+                self._shells.n_shells,
+                store=self._store,
+                chunk_size=output.chunk_size,
+                swmr=output.swmr,
+            )
+
+        if self._store:
+
+            self._record_history()
+        
+        # we need to go ahead and emit a shell
+        
+        
+        self._shells.activate_shells(self._time, self._shell_emit_iterator)
+        self._log_emission(0.)
+        self._shells.move(self._variability_time)
+        self._time += self._variability_time
+        self._shell_emit_iterator += 1
+
+        if self._event_log is not None:
+
+            self._event_log.move(self._time, self._variability_time)
+            self._event_log.mark_snapshot()
+
+        if self._store:
+
+            self._record_history()
+        
+
+        
+        self._shells.activate_shells(self._time, self._shell_emit_iterator)
+        self._log_emission(0.)
+        self._shells.move(self._variability_time)
+        self._time += self._variability_time
+        self._shell_emit_iterator += 1
+
+        self._time_until_next_emission = self._variability_time
+
+        if self._event_log is not None:
+
+            self._event_log.move(self._time, self._variability_time)
+            self._event_log.mark_snapshot()
+
+        if self._store:
+
+            self._record_history()
+        
+        
+        self._status = True
+
+        
+
+    def start(self):
+        """
+        
+        Start the jet 
+
+        :returns: 
+
+        """
+        self._begin()
+
+        while self._status:
+
+            self._step()
+
+        self._finish()
+
+    def _finish(self) -> None:
+
+        # the results are only built once
+
+        if self._runtime is not None:
+
+            return
+
+        self._runtime = self._elapsed()
+
+        self._start_time = None
+
+        self._feed_accumulators()
+
+        if self._output is not None:
+
+            self._output.close()
+
+            # read back from disk on demand
+
+            self._collision_history = None
+            self._detailed_history = None
+
+            return
+
+        self._collision_history = CollisionHistory(self._collisions) if self._retain_collisions else None
+
+        if self._history_sink is not None:
+
+            self._close_history_file()
+
+            # read back from disk on demand
+
+            self._detailed_history = None
+
+        elif self._store:
+
+            self._detailed_history  = DetailedHistory(self._shells.histories())
+
+        else:
+
+            self._detailed_history = None
+
+    def step(self, n_events: int = 1) -> bool:
+        """
+        advance the jet by a number of events, each an emission or
+        a collision. The results are built once the jet has finished,
+        as with start
+
+        :param n_events: 
+        :type n_events: int
+        :returns: whether the jet is still running
+
+        """
+
+        self._begin()
+
+        for _ in range(n_events):
+
+            if not self._status:
+
+                break
+
+            self._step()
+
+        if not self._status:
+
+            self._finish()
+
+        return self._status
+
+    def run_until(self, time: float) -> bool:
+        """
+        advance the jet until its time reaches the given time. The
+        jet moves from event to event, so it stops at the first event
+        at or after that time
+
+        :param time: 
+        :type time: float
+        :returns: whether the jet is still running
+
+        """
+
+        self._begin()
+
+        while self._status and self._time < time:
+
+            self._step()
+
+        if not self._status:
+
+            self._finish()
+
+        return self._status
+
+    def iter_collisions(self, batch_size: Optional[int] = None) -> Iterator:
+        """
+        run the jet, yielding the collisions as they happen. With
+        retain_collisions=False, the jet keeps no collisions itself
+
+        :param batch_size: yield CollisionHistory batches of this many
+        collisions (the last may be shorter) instead of single collisions
+        :type batch_size: Optional[int]
+        :returns: 
+
+        """
+
+        self._pending = deque()
+
+        try:
+
+            while self._status or self._pending:
+
+                if self._status:
+
+                    self.step()
+
+                if batch_size is None:
+
+                    while self._pending:
+
+                        yield Collision(*self._pending.popleft())
+
+                    continue
+
+                while len(self._pending) >= batch_size or (self._pending and not self._status):
+
+                    rows = [self._pending.popleft() for _ in range(min(batch_size, len(self._pending)))]
+
+                    yield CollisionHistory.from_arrays(*(np.array(column, dtype=float) for column in zip(*rows)))
+
+        finally:
+
+            self._pending = None
+
+    def advance_to_shell(self, shell_id: int) -> bool:
+        """
+        run the jet until shell_id is the next shell to be emitted.
+        Calling start afterwards finishes the run
+
+        :param shell_id: 
+        :type shell_id: int
+        :returns: whether the jet is still running
+
+        """
+
+        self._begin()
+
+        while self._status and self._shell_emit_iterator < shell_id:
+
+            self._step()
+
+        return self._status
+
+    def _begin(self) -> None:
+
+        if self._start_time is None:
+
+            self._start_time = time.perf_counter()
+
+            self._last_checkpoint = self._start_time
+
+    def _step(self) -> None:
+
+        try:
+
+            self._advance_time()
+
+            self._n_steps += 1
+
+            if self._event_log is not None:
+
+                self._event_log.mark_snapshot()
+
+            if self._store:
+
+                self._record_history()
+
+            if self._checkpoint_file is not None and self._checkpoint_due():
+
+                self.checkpoint(self._checkpoint_file)
+
+        except BaseException:
+
+            self._abort()
+
+            raise
+
+    def _abort(self) -> None:
+        """
+        close the files written during the run after a step failed.
+        What is on disk stays readable, but the jet can not go on
+
+        :returns: 
+
+        """
+
+        if self._output is not None:
+
+            self._output.abort()
+
+        if self._history_sink is not None:
+
+            self._history_h5.close()
+
+    def _record_history(self) -> None:
+
+        if self._output is not None:
+
+            self._output.record_snapshot(self._time, *self._shells.snapshot())
+
+            return
+
+        if self._history_sink is not None:
+
+            self._history_sink.record_time(self._time)
+
+        self._shells.record_history(self._time)
+
+    def _elapsed(self) -> float:
+
+        if self._start_time is None:
+
+            return self._previous_runtime
+
+        return self._previous_runtime + time.perf_counter() - self._start_time
+
+    def _checkpoint_due(self) -> bool:
+
+        if self._checkpoint_every is not None and self._n_steps % self._checkpoint_every == 0:
+
+            return True
+
+        if self._checkpoint_interval is not None:
+
+            return time.perf_counter() - self._last_checkpoint >= self._checkpoint_interval
+
+        return False
+
+    def checkpoint(self, file_name: str) -> None:
+        """
+        save everything needed to carry on with the jet to a file. The
+        first checkpoint of a run writes a new file, which is replaced
+        atomically. Later checkpoints of the run to the same file only add
+        the collisions, snapshots and events since the last one and write
+        the state of the shells and the accumulators next to the last state,
+        which resume reads until the new one is complete. Jets streaming
+        their histories to a history file can not be checkpointed
+
+        :param file_name: 
+        :type file_name: str
+        :returns: 
+
+        """
+
+        if self._history_sink is not None:
+
+            log.error("a jet with a history file can not be checkpointed")
+
+            raise RuntimeError()
+
+        # the state is written exactly
+
+        options = WriterOptions.from_config(float32=False, precision=None)
+
+        saved = self._checkpointed
+
+        if saved is not None and (saved["file_name"] != file_name or _checkpoint_run_id(file_name) != saved["run_id"]):
+
+            saved = None
+
+        if self._output is not None:
+
+            # what is on disk stays there and we only note how far it goes
+
+            self._output.flush()
+
+        self._feed_accumulators()
+
+        if saved is None:
+
+            saved = dict(file_name=file_name, run_id=uuid.uuid4().hex, n_collisions=0, n_snapshots=0, n_events=0, slot=1)
+
+            tmp_file = f"{file_name}.tmp"
+
+            with h5py.File(tmp_file, "w") as f:
+
+                f.attrs["version"] = CHECKPOINT_VERSION
+                f.attrs["run_id"] = saved["run_id"]
+
+                write_datasets(
+                    f.create_group("initial"),
+                    dict(
+                        gamma=self._initial_conditions.gamma_distribution.values,
+                        mass=self._initial_conditions.mass_distribution.values,
+                    ),
+                    options,
+                )
+
+                saved = self._write_checkpoint(f, saved, options)
+
+            os.replace(tmp_file, file_name)
+
+        else:
+
+            with h5py.File(file_name, "a") as f:
+
+                saved = self._write_checkpoint(f, saved, options)
+
+        self._checkpointed = saved
+
+        self._last_checkpoint = time.perf_counter()
+
+        log.debug(f"checkpointed the jet at time {self._time} to {file_name}")
+
+    def _write_checkpoint(self, f, saved: dict, options: WriterOptions) -> dict:
+
+        saved = dict(saved)
+
+        if self._output is None:
+
+            collisions = self._collisions[saved["n_collisions"] :]
+
+            append_datasets(
+                f.require_group("collisions"),
+                {name: np.array([getattr(c, name) for c in collisions], dtype=float) for name in COLLISION_COLUMNS},
+                saved["n_collisions"],
+                options,
+            )
+
+            saved["n_collisions"] += len(collisions)
+
+            if self._store:
+
+                rows = self._shells.history_rows(saved["n_snapshots"])
+
+                append_datasets(
+                    f.require_group("history"), rows, saved["n_snapshots"], options, chunks=(_TIME_CHUNK, _SHELL_CHUNK)
+                )
+
+                saved["n_snapshots"] += len(rows["time"])
+
+        if self._event_log is not None:
+
+            self._event_log.append_to_hdf5(f.require_group("events"), saved["n_events"], options)
+
+            saved["n_events"] = self._event_log.n_events
+
+        # the new state goes next to the last one, which
+        # stays the one that is read until this one is done
+
+        saved["slot"] = 1 - saved["slot"]
+
+        grp = f.require_group(f"state_{saved['slot']}")
+
+        for name in _CHECKPOINT_ATTRS:
+
+            grp.attrs[name] = getattr(self, f"_{name}")
+
+        grp.attrs["runtime"] = self._elapsed()
+        grp.attrs["store"] = self._store
+        grp.attrs["retain_collisions"] = self._retain_collisions
+        grp.attrs["summary_only"] = self._summary is not None
+
+        grp.attrs["collisions_saved"] = saved["n_collisions"]
+        grp.attrs["snapshots_saved"] = saved["n_snapshots"]
+        grp.attrs["events_saved"] = saved["n_events"]
+
+        if self._output is not None:
+
+            grp.attrs["output_file"] = self._output.file_name
+            grp.attrs["chunk_size"] = self._output.chunk_size
+            grp.attrs["swmr"] = self._output.swmr
+            grp.attrs["n_collisions_written"] = self._output.n_collisions_written
+            grp.attrs["n_snapshots_written"] = self._output.n_snapshots_written
+
+        shell_grp = grp.require_group("shells")
+
+        for name, data in zip(_SHELL_STATE, self._shells.get_state()):
+
+            replace_dataset(shell_grp, name, data)
+
+        if self._accumulators:
+
+            accumulator_grp = grp.require_group("accumulators")
+
+            for i, accumulator in enumerate(self._accumulators):
+
+                accumulator.to_hdf5(accumulator_grp.require_group(str(i)))
+
+        if self._summary is not None:
+
+            self._summary.to_hdf5(grp.require_group("summary"))
+
+        f.flush()
+
+        f.attrs["state"] = saved["slot"]
+
+        return saved
+
+    @classmethod
+    def resume(cls, file_name: str, initial_conditions: InitialConditions, prefix: bool = False, **kwargs) -> "Jet":
+        """
+        carry on with a jet from a checkpoint. Calling start on the
+        returned jet finishes the run with the same results as a run that
+        was never interrupted. Unless prefix is set, further checkpoints
+        of the jet to the same file add to it
+
+        :param file_name: the checkpoint
+        :type file_name: str
+        :param initial_conditions: the initial conditions of the jet
+        :type initial_conditions: InitialConditions
+        :param prefix: the checkpoint may be of a jet that only shares
+        the shells emitted so far with these initial conditions. The
+        shells still to be emitted are taken from the initial conditions
+        :type prefix: bool
+        :param kwargs: checkpoint_file, checkpoint_every and checkpoint_interval
+        for further checkpoints
+        :returns: 
+
+        """
+
+        with h5py.File(file_name, "r") as f:
+
+            if f.attrs.get("version") != CHECKPOINT_VERSION:
+
+                log.error(f"{file_name} is not a checkpoint of version {CHECKPOINT_VERSION}")
+
+                raise RuntimeError()
+
+            slot = int(f.attrs["state"])
+
+            state_grp = f[f"state_{slot}"]
+
+            attrs = dict(state_grp.attrs)
+
+            state = [read_column(state_grp["shells"][name]) for name in _SHELL_STATE]
+
+            output_file = attrs.get("output_file")
+
+            # the number of shells emitted so far
+            n_emitted = int(attrs["shell_emit_iterator"])
+
+            if prefix:
+
+                if output_file is not None:
+
+                    log.error(f"{file_name} can not be resumed with other initial conditions")
+
+                    raise RuntimeError()
+
+                matches = n_emitted <= len(initial_conditions.gamma_distribution.values) and all(
+                    np.array_equal(read_column(f["initial"][name])[:n_emitted], values[:n_emitted])
+                    for name, values in (
+                        ("gamma", initial_conditions.gamma_distribution.values),
+                        ("mass", initial_conditions.mass_distribution.values),
+                    )
+                )
+
+            else:
+
+                matches = np.array_equal(read_column(f["initial/gamma"]), initial_conditions.gamma_distribution.values)
+
+            if not matches:
+
+                log.error(f"{file_name} is not a checkpoint of a jet with these initial conditions")
+
+                raise RuntimeError()
+
+            output = OutputOptions(
+                record_events="events" in f,
+                retain_collisions=bool(attrs["retain_collisions"]),
+                summary_only=bool(attrs["summary_only"]),
+            )
+
+            jet = cls(initial_conditions, store=bool(attrs["store"]), output=output, **kwargs)
+
+            histories = None
+
+            # only the rows up to the state are read, anything
+            # after them is from a checkpoint that did not finish
+
+            n_collisions = int(attrs["collisions_saved"])
+            n_snapshots = int(attrs["snapshots_saved"])
+            n_events = int(attrs["events_saved"])
+
+            if output_file is None:
+
+                columns = [read_column(f["collisions"][name], slice(0, n_collisions)) for name in COLLISION_COLUMNS]
+
+                jet._collisions = CollisionHistory.from_arrays(*columns).collisions
+
+                if jet._store:
+
+                    times = f["history/time"][:n_snapshots].tolist()
+
+                    rows = {
+                        name: read_column(f["history"][name], slice(0, n_snapshots))
+                        for name in ("gamma", "radius", "mass", "status")
+                    }
+
+                    # these are appended to as the jet runs
+
+                    histories = [
+                        ShellHistory(
+                            gamma=rows["gamma"][:, i].tolist(),
+                            time=list(times),
+                            radius=rows["radius"][:, i].tolist(),
+                            mass=rows["mass"][:, i].tolist(),
+                            status=rows["status"][:, i].tolist(),
+                        )
+                        for i in range(jet._shells.n_shells)
+                    ]
+
+            if "events" in f:
+
+                jet._event_log = EventLog.from_hdf5(f["events"], n_events)
+
+            if "accumulators" in state_grp:
+
+                accumulator_grp = state_grp["accumulators"]
+
+                jet._accumulators = [Accumulator.from_hdf5(accumulator_grp[str(i)]) for i in range(len(accumulator_grp))]
+
+            if "summary" in state_grp:
+
+                jet._summary = Accumulator.from_hdf5(state_grp["summary"])
+
+            if not prefix:
+
+                jet._checkpointed = dict(
+                    file_name=file_name,
+                    run_id=f.attrs["run_id"],
+                    n_collisions=n_collisions,
+                    n_snapshots=n_snapshots,
+                    n_events=n_events,
+                    slot=slot,
+                )
+
+        if prefix:
+
+            # the shells that are not out yet are as the
+            # initial conditions have them
+
+            fresh = jet._shells.get_state()
+
+            state = [np.concatenate([old[:n_emitted], new[n_emitted:]]) for old, new in zip(state, fresh)]
+
+            if histories is not None:
+
+                times = histories[0].time
+
+                histories = histories[:n_emitted] + [
+                    ShellHistory(
+                        gamma=[float(fresh[0][i])] * len(times),
+                        time=list(times),
+                        radius=[float(fresh[2][i])] * len(times),
+                        mass=[float(fresh[1][i])] * len(times),
+                        status=[False] * len(times),
+                    )
+                    for i in range(n_emitted, len(fresh[0]))
+                ]
+
+            if jet._event_log is not None:
+
+                jet._event_log = jet._event_log.fork(
+                    initial_conditions.gamma_distribution.values, initial_conditions.mass_distribution.values
+                )
+
+        jet._shells.set_state(*state, histories=histories)
+
+        for name in _CHECKPOINT_ATTRS:
+
+            setattr(jet, f"_{name}", type(getattr(jet, f"_{name}"))(attrs[name]))
+
+        jet._previous_runtime = float(attrs["runtime"])
+
+        if output_file is not None:
+
+            jet._result_file = str(output_file)
+
+            jet._output = ChunkedOutput(
+                jet._result_file,
+                jet._shells.n_shells,
+                store=jet._store,
+                chunk_size=int(attrs["chunk_size"]),
+                swmr=bool(attrs["swmr"]),
+                resume_from=(int(attrs["n_collisions_written"]), int(attrs["n_snapshots_written"])),
+            )
+
+        log.debug(f"resumed the jet at time {jet._time} from {file_name}")
+
+        return jet
+
+    def fork(self, r_max=_UNCHANGED, gamma: Optional[np.ndarray] = None) -> "Jet":
+        """
+        a copy of the jet in its current state that carries on
+        independently, e.g. with another r_max or another gamma for the
+        shells that have not been emitted yet.
+
+        The shells are shared with copy-on-write: each jet copies a shell
+        (and its history) the first time it changes it, so shells that are
+        not yet emitted or already dead are never copied. The fork can be
+        pickled to run in another process. Jets writing to files can not
+        be forked
+
+        :param r_max: the maximum radius of the fork. By default, that of this jet
+        :param gamma: the gamma of the shells that are still to be emitted.
+        Their masses are changed to keep the energy given to each shell
+        :type gamma: Optional[np.ndarray]
+        :returns: 
+
+        """
+
+        if self._output is not None or self._history_sink is not None:
+
+            log.error("a jet writing to a file can not be forked")
+
+            raise RuntimeError()
+
+        out = copy.copy(self)
+
+        out._shells = self._shells.fork(out)
+
+        out._collisions = list(self._collisions)
+
+        out._pending = None
+
+        out._accumulators = copy.deepcopy(self._accumulators)
+
+        out._summary = copy.deepcopy(self._summary)
+
+        out._accumulator_buffer = list(self._accumulator_buffer)
+
+        out._collision_history = None
+        out._detailed_history = None
+
+        out._checkpoint_file = None
+        out._checkpointed = None
+
+        if r_max is not _UNCHANGED:
+
+            out._max_radius = r_max
+
+        # the new gamma and mass by shell id
+
+        changed = {}
+
+        if gamma is not None:
+
+            first = self._shell_emit_iterator
+
+            gamma = np.asarray(gamma, dtype=float)
+
+            if len(gamma) != out._shells.n_shells - first:
+
+                log.error(f"gamma must be given for the {out._shells.n_shells - first} shells still to be emitted")
+
+                raise ValueError()
+
+            state = out._shells.get_state()
+
+            shell_ids = np.arange(first, out._shells.n_shells)
+
+            # keep m v c^2, the energy the initial
+            # conditions give each shell
+
+            new_mass = [
+                state[1][shell_id] * velocity(state[0][shell_id]) / velocity(new_gamma)
+                for shell_id, new_gamma in zip(shell_ids, gamma)
+            ]
+
+            out._shells.set_initial(shell_ids, gamma, new_mass)
+
+            changed = dict(zip(shell_ids, zip(gamma, new_mass)))
+
+        if self._event_log is not None:
+
+            initial_gamma = self._event_log.initial_gamma.copy()
+            initial_mass = self._event_log.initial_mass.copy()
+
+            for shell_id, (new_gamma, new_mass) in changed.items():
+
+                initial_gamma[shell_id], initial_mass[shell_id] = new_gamma, new_mass
+
+            out._event_log = self._event_log.fork(initial_gamma, initial_mass)
+
+        return out
+
+    def rescaled(self, initial_conditions: InitialConditions) -> "Jet":
+        """
+        a finished jet with the results this jet would have had with
+        initial conditions that only differ in the total energy, r_min
+        and variability time, see rescale_results. Only the results are
+        carried over, and the returned jet can not be run or checkpointed
+
+        :param initial_conditions: 
+        :type initial_conditions: InitialConditions
+        :returns: 
+
+        """
+
+        if self._status or self._runtime is None:
+
+            log.error("only a finished jet can be rescaled")
+
+            raise RuntimeError()
+
+        collisions, shells = rescale_results(
+            self.collision_history, self.detailed_history, self._initial_conditions, initial_conditions
+        )
+
+        out = copy.copy(self)
+
+        out._initial_conditions = initial_conditions
+        out._collision_history = collisions
+        out._detailed_history = shells
+        out._collisions = collisions.collisions
+        out._radiated_energy = float(np.sum(collisions.column("radiated_energy")))
+        out._result_file = None
+        out._output = None
+        out._history_sink = None
+        out._event_log = None
+        out._shells = None
+
+        # it was never run
+        out._runtime = 0.
+
+        return out
+
+    @property
+    def n_steps(self) -> int:
+        """
+        the number of steps taken since the jet was started
 
-        :param initial_conditions: 
-        :type initial_conditions: InitialConditions
-        :param store: 
-        :type store: 
         :returns: 
 
         """
-        self._n_shells: int = initial_conditions.n_shells
 
-        self._shell_emit_iterator = 0
+        return self._n_steps
 
-        # initialize the shells
-        
-        self._shells = ShellSet(
-            [
-                Shell(gamma, mass, initial_conditions.r_min, self)
-                for gamma, mass in zip(initial_conditions.gamma_distribution.values,
-                                       initial_conditions. mass_distribution.values)
-            ]
-        )
+    @property
+    def n_emitted(self) -> int:
+        """
+        the number of shells emitted so far. The others
+        can be changed with fork
 
-        self._collisions: List[Collision] = []
-        self._n_collisions: int = 0
+        :returns: 
 
-        self._time: float = 0.
-        self._variability_time: float = initial_conditions.variability_time
-        self._max_radius: Optional[float] = initial_conditions.r_max
-        
+        """
 
-        self._store: bool = store
+        return self._shell_emit_iterator
 
+    @property
+    def injected_energy(self) -> float:
+        """
+        the kinetic energy of the shells emitted so far, in the units
+        of the radiated energy of the collisions (erg / c^2)
 
-        if self._store:
+        :returns: 
 
-            self._shells.record_history(self._time)
-        
-        # we need to go ahead and emit a shell
-        
-        
-        self._shells.activate_shells(self._time, self._shell_emit_iterator)
-        self._shells.move(self._variability_time)
-        self._time += self._variability_time
-        self._shell_emit_iterator += 1
+        """
 
+        return self._shells.injected_energy
 
-        if self._store:
+    def _log_emission(self, delta_time: float) -> None:
 
-            self._shells.record_history(self._time)
-        
+        if self._event_log is not None:
 
-        
-        self._shells.activate_shells(self._time, self._shell_emit_iterator)
-        self._shells.move(self._variability_time)
-        self._time += self._variability_time
-        self._shell_emit_iterator += 1
+            self._event_log.emission(self._time, delta_time, self._shell_emit_iterator)
 
-        self._time_until_next_emission = self._variability_time
+    def _close_history_file(self) -> None:
+        """
+        write the surviving shells and the collisions
+        to the history file so that it is a complete
+        jet file
 
-        if self._store:
+        :returns: 
 
-            self._shells.record_history(self._time)
-        
-        
-        self._status = True
+        """
 
-        
+        try:
 
-    def start(self):
+            self._history_sink.close(self._shells.histories())
+
+            self._history_h5.attrs["store"] = self._store
+
+            self._collision_history.to_hdf5(self._history_h5.create_group("collisions"))
+
+        finally:
+
+            self._history_h5.close()
+
+        log.debug(f"streamed {self._history_sink.n_flushed} dead shells to {self._result_file}")
+
+    def add_collision(self, radiated_energy, gamma, radius):
+
+        self._n_collisions += 1
+
+        self._radiated_energy += radiated_energy
+
+        if self._summary is not None:
+
+            self._summary.add_one(radiated_energy, radius, self._time)
+
+        if self._pending is not None:
+
+            self._pending.append((radiated_energy, gamma, radius, self._time))
+
+        if self._accumulators:
+
+            self._accumulator_buffer.append((radiated_energy, gamma, radius, self._time))
+
+            if len(self._accumulator_buffer) >= _ACCUMULATOR_BATCH:
+
+                self._feed_accumulators()
+
+        if self._output is not None:
+
+            self._output.add_collision(radiated_energy, gamma, radius, self._time)
+
+            return
+
+        if self._retain_collisions:
+
+            self._collisions.append( Collision(
+                radiated_energy,
+                gamma,
+                radius,
+                self._time,
+            ))
+
+    def _feed_accumulators(self) -> None:
+
+        if not self._accumulator_buffer:
+
+            return
+
+        columns = [np.array(column, dtype=float) for column in zip(*self._accumulator_buffer)]
+
+        for accumulator in self._accumulators:
+
+            accumulator.add(*columns)
+
+        self._accumulator_buffer = []
+
+    @property
+    def accumulators(self) -> List[Accumulator]:
         """
-        
-        Start the jet 
+        the accumulators, up to date with the collisions so far
 
         :returns: 
 
         """
-        while self._status:
 
-            self._advance_time()
+        self._feed_accumulators()
 
-            if self._store:
+        return self._accumulators
 
-                self._shells.record_history(self._time)
-        
+    @property
+    def summary(self) -> Optional[np.void]:
+        """
+        the summary of a jet run with summary_only, a record of
+        SUMMARY_DTYPE. Records of many jets stack into an array
+
+        :returns: 
 
-        self._collision_history = CollisionHistory(self._collisions)
+        """
 
-        if self._store:
+        if self._summary is None:
 
-            self._detailed_history: Optional[DetailedHistory]  = DetailedHistory([shell.history for shell in self._shells])
+            return None
 
-        else:
+        self._summary.n_shells_final = self._shells.n_active_shells
 
-            self._detailed_history = None
-    def add_collision(self, radiated_energy, gamma, radius):
+        self._summary.injected_energy = self.injected_energy
 
-        self._collisions.append( Collision(
-            radiated_energy,
-            gamma,
-            radius,
-            self._time,
-        ))
+        return self._summary.record
 
-        self._n_collisions += 1
+    @property
+    def light_curve(self) -> Optional[np.ndarray]:
+        """
+        the energy in each observer time bin of the
+        first LightCurve accumulator, if there is one
+
+        :returns: 
+
+        """
+
+        for accumulator in self.accumulators:
+
+            if isinstance(accumulator, LightCurve):
+
+                return accumulator.values
+
+        return None
+
+    @property
+    def store(self) -> bool:
+
+        return self._store
+
+    @property
+    def initial_conditions(self) -> InitialConditions:
+
+        return self._initial_conditions
+
+    @property
+    def runtime(self) -> Optional[float]:
+        """
+        the wall clock time in seconds that start took
+
+        :returns: 
+
+        """
+
+        return self._runtime
 
     @property
     def shells(self) -> ShellSet:
@@ -139,14 +1259,45 @@ class Jet(object):
     def n_collisions(self) -> int:
         return self._n_collisions
 
+    @property
+    def radiated_energy(self) -> float:
+        """
+        the energy radiated in all the collisions so far, in erg / c^2
+
+        :returns: 
+
+        """
+
+        return self._radiated_energy
+
     @property
     def collision_history(self) -> CollisionHistory:
 
+        if self._collision_history is None and self._result_file is not None:
+
+            self._collision_history = CollisionHistory.from_file(self._result_file, "collisions")
+
         return self._collision_history
 
+    @property
+    def event_log(self) -> Optional[EventLog]:
+
+        return self._event_log
+
+    @property
+    def history_sink(self) -> Optional[ShellHistorySink]:
+
+        return self._history_sink
+
     @property
     def detailed_history(self) -> Optional[DetailedHistory]:
 
+        if self._detailed_history is None and self._result_file is not None and self._store:
+
+            with h5py.File(self._result_file, "r") as f:
+
+                self._detailed_history = DetailedHistory.from_hdf5(f["shells"])
+
         return self._detailed_history
     
     def _advance_time(self):
@@ -165,11 +1316,22 @@ class Jet(object):
 
             delta_time = time_until_next_collision[collision_idx]
 
-            if (
-                delta_time > self._time_until_next_emission
-                and self._shell_emit_iterator < self._n_shells
+            emitting = self._shell_emit_iterator < self._n_shells
+
+            time_until_next_exit, exit_id = self._time_until_next_exit()
+
+            if time_until_next_exit <= delta_time and not (
+                emitting and time_until_next_exit >= self._time_until_next_emission
             ):
 
+                # a shell gets to the maximum radius before anything
+                # else happens. It leaves first on a tie, as the
+                # collisions at the maximum radius are outside of it
+
+                self._exit(time_until_next_exit, exit_id)
+
+            elif delta_time > self._time_until_next_emission and emitting:
+
                 # if the next collision will happen AFTER a shell will be
                 # emitted, then we will go ahead and emit that shell
 
@@ -185,31 +1347,8 @@ class Jet(object):
 
                 self._shells.activate_shells(self._time, self._shell_emit_iterator)
 
-                if self._max_radius is not None:
-                    
-                    # check if any shells are beyond the
-                    # maximum
-
-                    shells_to_deactivate = []
-                    
-                    for shell in self._shells:
+                self._log_emission(self._time_until_next_emission)
 
-                        # if a shell is beyond the maximum
-                        # raidus, then deactivate iterator
-                        if shell.radius >= self._max_radius:
-
-                            shells_to_deactivate.append(shell.id)
-
-                        else:
-
-                            # since the shells are order with the
-                            # highest radius first, as soon as
-                            # we do not find a shell, we can quit
-
-                            break
-
-                    self._shells.deactivate_shells(self._time, shells_to_deactivate)
-                
                 # reset time until next emission
 
                 self._time_until_next_emission = self._variability_time
@@ -230,9 +1369,23 @@ class Jet(object):
 
                 # collide the shells
 
-                self._shells.velocity_ordered_shells[collision_idx].collide_shell(
-                    self._shells.velocity_ordered_shells[collision_idx + 1]
-                )
+                shell = self._shells.velocity_ordered_shells[collision_idx]
+                other = self._shells.velocity_ordered_shells[collision_idx + 1]
+
+                # the shell we change may still be shared with a fork
+
+                shell = self._shells.own(shell.id)
+
+                gamma_pre, mass_pre = shell.gamma, shell.mass
+
+                shell.collide_shell(other)
+
+                if self._event_log is not None:
+
+                    self._event_log.collision(
+                        self._time, delta_time, shell.id, other.id, gamma_pre, mass_pre, shell.gamma, shell.mass
+                    )
+
                 # deactivate the forward shell
 
                 self._shells.deactivate_shells(
@@ -249,6 +1402,10 @@ class Jet(object):
 
                 self._status = False
 
+                if self._event_log is not None:
+
+                    self._event_log.end(self._time)
+
             else:
 
                 self._time += self._time_until_next_emission
@@ -257,24 +1414,187 @@ class Jet(object):
 
                 self._shells.activate_shells(self._time, self._shell_emit_iterator)
 
+                # the shells are not moved here
+
+                self._log_emission(0.)
+
                 self._shell_emit_iterator += 1
 
-    def write_to(self, file_name: str) -> None:
+    def _time_until_next_exit(self):
+        """
+        the time until the next active shell passes the maximum
+        radius and its id, or inf and None without a maximum radius
+
+        :returns: 
+
+        """
+
+        if self._max_radius is None:
+
+            return np.inf, None
+
+        shells = self._shells.active_shells
+
+        if len(shells) == 0:
+
+            return np.inf, None
+
+        time_until_exit = np.array([(self._max_radius - shell.radius) / shell.velocity for shell in shells])
+
+        idx = time_until_exit.argmin()
+
+        return max(float(time_until_exit[idx]), 0.), shells[idx].id
+
+    def _exit(self, delta_time: float, shell_id: int) -> None:
+
+        self._shells.move(delta_time)
+
+        self._time += delta_time
+
+        self._time_until_next_emission -= delta_time
+
+        # the shell is at the maximum radius up to rounding,
+        # and any other shell that got there leaves with it
+
+        shells_to_deactivate = [shell_id] + [
+            shell.id for shell in self._shells.active_shells if shell.radius >= self._max_radius and shell.id != shell_id
+        ]
+
+        if self._event_log is not None:
+
+            self._event_log.move(self._time, delta_time)
+
+            for exit_id in shells_to_deactivate:
+
+                self._event_log.exit(self._time, exit_id)
+
+        self._shells.deactivate_shells(self._time, *shells_to_deactivate)
+
+    def write_to(self, file_name: str, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the collisions and shell history to a file
+
+        :param file_name: 
+        :type file_name: str
+        :param options: the writer options. By default, those of the
+        configuration. Results already written during the run are copied as is
+        :type options: Optional[WriterOptions]
+        :returns: 
+
+        """
+
+        if self._result_file is not None and Path(file_name).resolve() == Path(self._result_file).resolve():
+
+            log.info(f"{file_name} was already written while the jet ran")
+
+            return
 
         with h5py.File(file_name, "w") as f:
 
-            f.attrs["store"] = self._store
+            self.to_hdf5(f, options)
+
+    def to_hdf5(self, group, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the initial conditions, collisions, shell history
+        and event log to an HDF5 group. A jet that did not keep its
+        collisions writes its summary and accumulators in their place
+
+        :param group: 
+        :param options: the writer options. By default, those of the
+        configuration. Results already written during the run are copied as is
+        :type options: Optional[WriterOptions]
+        :returns: 
+
+        """
+
+        group.attrs["store"] = self._store
 
+        self._initial_conditions.to_hdf5(group.create_group("initial_conditions"))
 
-            collision_grp = f.create_group("collisions")
+        if self._event_log is not None:
 
-            self._collision_history.to_hdf5(collision_grp)
+            self._event_log.to_hdf5(group.create_group("events"), options)
 
-            if self._store:
+        if self._result_file is not None:
+
+            # the results are already on disk
+
+            with h5py.File(self._result_file, "r") as src:
+
+                for name in src:
+
+                    src.copy(src[name], group, name)
+
+            return
+
+        if self._collision_history is not None:
+
+            self._collision_history.to_hdf5(group.create_group("collisions"), options)
+
+        else:
+
+            # what the jet kept instead of its collisions
+
+            if self._summary is not None:
+
+                self._summary.to_hdf5(group.create_group("summary"))
 
-                shell_grp = f.create_group("shells")
+            for i, accumulator in enumerate(self._accumulators):
 
-                self._detailed_history.to_hdf5(shell_grp)
+                accumulator.to_hdf5(group.require_group("accumulators").create_group(str(i)))
+
+        if self._store:
+
+            shell_grp = group.create_group("shells")
+
+            self._detailed_history.to_hdf5(shell_grp, options)
+
+    def write_npy(self, directory: str) -> None:
+        """
+        write the collisions and shell history as uncompressed
+        .npy files plus a JSON manifest in a directory. This is
+        much faster to reload than HDF5, see from_npy
+
+        :param directory: 
+        :type directory: str
+        :returns: 
+
+        """
+
+        write_npy_directory(directory, self.collision_history, self.detailed_history if self._store else None)
+
+    @staticmethod
+    def from_npy(directory: str, mmap: bool = True):
+        """
+        read the collisions and shell history written by write_npy
+        as a tuple. The arrays are memory mapped by default, so
+        loading is instant and only the pages touched are read
+
+        :param directory: 
+        :type directory: str
+        :param mmap: 
+        :type mmap: bool
+        :returns: 
+
+        """
+
+        return read_npy_directory(directory, mmap=mmap)
+
+    @staticmethod
+    def open(file_name: str) -> JetFile:
+        """
+        open a jet file for reading on demand. The file is kept
+        open, and the collisions and shells of the returned JetFile
+        are array proxies that only read what is sliced from them.
+        Close it, or use it as a context manager, when done
+
+        :param file_name: 
+        :type file_name: str
+        :returns: 
+
+        """
+
+        return JetFile(file_name)
 
     @staticmethod
     def from_file(file_name: str):
@@ -288,8 +1608,15 @@ class Jet(object):
         :returns: 
 
         """
+
         with h5py.File(file_name, "r") as f:
 
+            if "collisions" not in f:
+
+                log.error(f"{file_name} holds a jet that did not keep its collisions")
+
+                raise RuntimeError()
+
             collisons = CollisionHistory.from_hdf5(f["collisions"])
 
             
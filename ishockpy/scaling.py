@@ -0,0 +1,69 @@
+from typing import Optional, Tuple
+
+from .collision import CollisionHistory
+from .distribution import InitialConditions
+from .io.logging import setup_logger
+from .shell_history import DetailedHistory
+
+log = setup_logger(__name__)
+
+
+def is_rescaling(source: InitialConditions, target: InitialConditions) -> bool:
+    """
+    whether the results of one jet can be rescaled to those of another
+
+    :param source:
+    :param target:
+    :returns:
+
+    """
+
+    return source.canonical_digest() == target.canonical_digest()
+
+
+def rescale_results(
+    collisions: CollisionHistory,
+    shells: Optional[DetailedHistory],
+    source: InitialConditions,
+    target: InitialConditions,
+) -> Tuple[CollisionHistory, Optional[DetailedHistory]]:
+    """
+    turn the results of a jet into those of a jet that only differs
+    in its total energy, r_min and variability time (with r_max moving
+    along). The dynamics only depend on the mass ratios of the shells
+    and on differences of radii, so
+
+    * the masses and radiated energies scale with the total energy
+    * the times scale with the variability time
+    * the distances from r_min scale with the variability time
+
+    The results agree with a run of the target to rounding.
+
+    :param collisions: the collisions of the source
+    :param shells: the shell history of the source if stored
+    :param source: the initial conditions of the source
+    :param target: the initial conditions to rescale to
+    :returns: the collisions and the shell history (if given)
+
+    """
+
+    if not is_rescaling(source, target):
+
+        log.error("the initial conditions are not a rescaling of each other")
+
+        raise ValueError()
+
+    scales = dict(
+        energy_scale=target.total_energy / source.total_energy,
+        time_scale=target.variability_time / source.variability_time,
+        r_min=source.r_min,
+        new_r_min=target.r_min,
+    )
+
+    collisions = collisions.rescaled(**scales)
+
+    if shells is not None:
+
+        shells = shells.rescaled(**scales)
+
+    return collisions, shells
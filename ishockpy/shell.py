@@ -1,11 +1,12 @@
 __author__ = "grburgess"
 
 
-from typing import List, Optional
+import copy
+from typing import Dict, List, Optional
 
 # import astropy.constants as constants
 import numpy as np
-from numba import jit, njit
+from numba import njit
 
 from ishockpy.io.logging import setup_logger
 
@@ -55,7 +56,16 @@ class Shell(object):
         self._id: Optional[int] = None
         self._initialized: bool = False
         
-        self._history = ShellHistory()
+        # made when first needed, as only a jet that
+        # is storing records the history
+        self._history: Optional[ShellHistory] = None
+
+        # set once the history has been streamed to disk
+        self._history_flushed: bool = False
+
+        # the token of the shell set that may change this shell,
+        # see ShellSet.fork
+        self._owner: Optional[object] = None
 
         self._has_changed = True
 
@@ -133,6 +143,10 @@ class Shell(object):
     @property
     def history(self) -> ShellHistory:
 
+        if self._history is None:
+
+            self._history = ShellHistory()
+
         return self._history
     
     def move(self, delta_time) -> None:
@@ -203,6 +217,19 @@ class Shell(object):
 
         self._death_time = time
 
+        history_sink = self._jet.history_sink
+
+        if history_sink is not None and not self._history_flushed:
+
+            # the shell will never change again, so record
+            # its final state and send the history to disk
+
+            self.record_history(time)
+
+            history_sink.flush(self._id, self.history)
+
+            self._history_flushed = True
+
     def activate(self, time: float) -> None:
         """
         turn the shell on and record the comoving time
@@ -212,9 +239,86 @@ class Shell(object):
 
         self._birth_time = time
 
+    def copy(self, jet) -> "Shell":
+        """
+        a copy of the shell that belongs to another jet.
+        The history is copied as well
+
+        :param jet: the jet of the copy
+        :returns: 
+
+        """
+
+        out = copy.copy(self)
+
+        out._jet = jet
+
+        if self._history is not None:
+
+            out._history = ShellHistory(
+                gamma=list(self._history.gamma),
+                time=list(self._history.time),
+                radius=list(self._history.radius),
+                mass=list(self._history.mass),
+                status=list(self._history.status),
+            )
+
+        out._owner = None
+
+        return out
+
+    def get_state(self):
+        """
+        everything that changes while the jet runs,
+        except for the history
+
+        :returns: gamma, mass, radius, active, birth time and death time
+
+        """
+
+        return (
+            self._gamma,
+            self._mass,
+            self._radius,
+            self._active,
+            getattr(self, "_birth_time", np.nan),
+            getattr(self, "_death_time", np.nan),
+        )
+
+    def set_state(self, gamma, mass, radius, active, birth_time, death_time, history: Optional[ShellHistory] = None) -> None:
+        """
+        restore the state returned by get_state
+
+        :returns: 
+
+        """
+
+        self._gamma = float(gamma)
+        self._mass = float(mass)
+        self._radius = float(radius)
+        self._active = bool(active)
+
+        if not np.isnan(birth_time):
+
+            self._birth_time = float(birth_time)
+
+        if not np.isnan(death_time):
+
+            self._death_time = float(death_time)
+
+        if history is not None:
+
+            self._history = history
+
+        self._has_changed = True
+
     def record_history(self, time: float) -> None:
 
-        self._history.add_entry(
+        if self._history_flushed:
+
+            return
+
+        self.history.add_entry(
             time=time,
             gamma=self.gamma,
             radius=self.radius,
@@ -233,24 +337,55 @@ class Shell(object):
 
 
 class ShellSet(object):
-    def __init__(self, list_of_shells: List[Shell]):
+    def __init__(self, initial_gamma: np.ndarray, initial_mass: np.ndarray, initial_radius: float, jet):
         """
-        A set of shells
-
-        :param list_of_shells: 
+        The shells of a jet. A Shell object is made when the shell is
+        emitted and dropped when it dies. The shells that are not out yet
+        and the dead shells are kept as compact arrays, so the number of
+        objects follows the number of active shells. Asking for a shell
+        that is not alive makes its object, which is kept from then on
+
+        :param initial_gamma: the initial gamma of every shell
+        :param initial_mass: the initial mass of every shell
+        :param initial_radius: the radius the shells are emitted at
+        :param jet: the jet the shells belong to
         :returns: 
         :rtype: 
 
         """
 
-        self._shells: List[Shell] = np.array(list_of_shells)
+        self._jet = jet
+
+        # the state of the shells that are not alive
+
+        self._gamma: np.ndarray = np.array(initial_gamma, dtype=float)
+        self._mass: np.ndarray = np.array(initial_mass, dtype=float)
+        self._radius: np.ndarray = np.full(len(self._gamma), float(initial_radius))
+        self._birth_time: np.ndarray = np.full(len(self._gamma), np.nan)
+        self._death_time: np.ndarray = np.full(len(self._gamma), np.nan)
+
+        self._currently_active = np.zeros(len(self._gamma), dtype=bool)
+
+        # the gamma and mass the shells are emitted with
+        self._initial_gamma: np.ndarray = self._gamma.copy()
+        self._initial_mass: np.ndarray = self._mass.copy()
 
-        # set the static shell id
-        for i, shell in enumerate(self._shells):
+        # the shells that exist as objects, by id, and which they are
+        self._shells: np.ndarray = np.full(len(self._gamma), None, dtype=object)
+        self._made: np.ndarray = np.zeros(len(self._gamma), dtype=bool)
 
-            shell.set_id(i)
+        # when storing, the time of every recorded snapshot and
+        # the histories of the dead shells
 
-        self._currently_active = np.array([shell.status for shell in self._shells])
+        self._history_time: List[float] = []
+        self._dead_histories: Dict[int, ShellHistory] = {}
+
+        # shells shared with a fork are copied before they
+        # are changed, see fork
+
+        self._token = object()
+
+        self._shared: bool = False
 
         # we need to recompute the ordering
 
@@ -258,18 +393,193 @@ class ShellSet(object):
 
     def __iter__(self):
 
-        for shell in self._shells:
-            yield shell
+        for index in range(self.n_shells):
+            yield self[index]
+
+    def __len__(self) -> int:
+
+        return self.n_shells
 
     def __getitem__(self, item) -> Shell:
+        """
+        the shell with this id, made if it does not exist yet
+
+        """
+
+        item = range(self.n_shells)[item]
+
+        if self._made[item]:
+
+            return self._shells[item]
+
+        return self._materialize(item, self._dead_histories.get(item))
+
+    def _materialize(self, index: int, history: Optional[ShellHistory] = None) -> Shell:
+
+        shell = Shell(self._gamma[index], self._mass[index], self._radius[index], self._jet)
+
+        shell.set_id(index)
+
+        shell.set_state(
+            self._gamma[index],
+            self._mass[index],
+            self._radius[index],
+            self._currently_active[index],
+            self._birth_time[index],
+            self._death_time[index],
+            history,
+        )
+
+        if history is None and self._history_time:
+
+            # the snapshots from before the shell was made
+
+            for time in self._history_time:
+
+                shell.history.add_entry(
+                    time=time, gamma=shell.gamma, radius=shell.radius, mass=shell.mass, status=False
+                )
+
+        shell._owner = self._token
+
+        self._shells[index] = shell
+        self._made[index] = True
+
+        return shell
+
+    def _release(self, index: int) -> None:
+
+        shell = self._shells[index]
+
+        self._shells[index] = None
+        self._made[index] = False
+
+        (
+            self._gamma[index],
+            self._mass[index],
+            self._radius[index],
+            _,
+            self._birth_time[index],
+            self._death_time[index],
+        ) = shell.get_state()
+
+        if self._history_time:
+
+            self._dead_histories[index] = shell.history
+
+    def own(self, index: int) -> Shell:
+        """
+        the shell with this id, made if needed and copied
+        first if it is still shared with a fork
+
+        :param index: 
+        :returns: 
+
+        """
+
+        if not self._made[index]:
+
+            return self._materialize(index)
+
+        shell = self._shells[index]
+
+        if self._shared and shell._owner is not self._token:
+
+            shell = shell.copy(self._jet)
+
+            shell._owner = self._token
+
+            self._shells[index] = shell
+
+            # the orderings hold the old shell
+            self._has_moved = True
+
+        return shell
+
+    def fork(self, jet) -> "ShellSet":
+        """
+        a shell set for another jet that shares the shells with this
+        one. Each set copies a shell the first time it changes it
+
+        :param jet: the jet of the new set
+        :returns: 
+
+        """
+
+        out = copy.copy(self)
+
+        for name in (
+            "_gamma",
+            "_mass",
+            "_radius",
+            "_birth_time",
+            "_death_time",
+            "_currently_active",
+            "_initial_gamma",
+            "_initial_mass",
+        ):
+
+            setattr(out, name, getattr(self, name).copy())
+
+        out._shells = self._shells.copy()
+        out._made = self._made.copy()
+
+        out._history_time = list(self._history_time)
+
+        # the dead do not change any more
+        out._dead_histories = dict(self._dead_histories)
+
+        out._jet = jet
+
+        out._token = object()
+
+        out._shared = True
+
+        out._has_moved = True
+
+        # this set no longer owns its shells either
+
+        self._token = object()
+
+        self._shared = True
+
+        return out
+
+    def set_initial(self, shell_index, gamma, mass) -> None:
+        """
+        change the gamma and mass of shells that are not out yet
+
+        :param shell_index: the ids of the shells
+        :param gamma: 
+        :param mass: 
+        :returns: 
+
+        """
 
-        return self._shells[item]
+        for index, new_gamma, new_mass in zip(shell_index, gamma, mass):
+
+            if not np.isnan(self._birth_time[index]):
+
+                log.error(f"shell {index} has already been emitted")
+
+                raise RuntimeError()
+
+            # a shell made before it was emitted is made again
+
+            self._shells[index] = None
+            self._made[index] = False
+
+            self._gamma[index] = new_gamma
+            self._mass[index] = new_mass
+
+            self._initial_gamma[index] = new_gamma
+            self._initial_mass[index] = new_mass
 
     def activate_shells(self, time=0.0, *shell_index) -> None:
 
         for index in shell_index:
 
-            self._shells[index].activate(time)
+            self.own(index).activate(time)
             self._currently_active[index] = True
 
         self._has_moved = True
@@ -278,9 +588,11 @@ class ShellSet(object):
 
         for index in shell_index:
 
-            self._shells[index].deactivate(time)
+            self.own(index).deactivate(time)
             self._currently_active[index] = False
 
+            self._release(index)
+
         self._has_moved = True
 
     @property
@@ -360,35 +672,253 @@ class ShellSet(object):
 
         """
 
-        for shell in self.active_shells:
+        if self._shared:
 
-            shell.move(delta_time)
+            for index in np.flatnonzero(self._currently_active):
+
+                self.own(index).move(delta_time)
+
+        else:
+
+            for shell in self.active_shells:
+
+                shell.move(delta_time)
 
         # the shells have move
         self._has_moved = True
 
-        
-
-        
     @property
     def active_shells(self) -> List[Shell]:
 
         return self._shells[self._currently_active]
 
     @property
-    def n_shells(self):
+    def n_shells(self) -> int:
 
-        return self._n_shells
+        return len(self._gamma)
     
     @property
     def n_active_shells(self) -> int:
 
-        return len(self.active_shells)
+        return int(np.count_nonzero(self._currently_active))
+
+    @property
+    def injected_energy(self) -> float:
+        """
+        the kinetic energy the emitted shells were emitted with, in
+        the units of the radiated energy of the collisions (erg / c^2)
+
+        :returns: 
+
+        """
+
+        # the birth time of a live shell is kept by its object
+        emitted = self._currently_active | ~np.isnan(self._birth_time)
+
+        return float(np.sum(self._initial_mass[emitted] * (self._initial_gamma[emitted] - 1.0)))
+
+    @property
+    def n_live_shells(self) -> int:
+        """
+        the number of shells that exist as objects
+
+        :returns: 
+
+        """
+
+        return int(np.count_nonzero(self._made))
+
+    def _recording(self) -> np.ndarray:
+
+        # the dead shells made again by __getitem__ keep
+        # the history they had when they died
+
+        return self._made & np.isnan(self._death_time)
 
     def record_history(self, time) -> None:
 
-        for shell in self._shells:
+        self._history_time.append(time)
+
+        for index in np.flatnonzero(self._recording()):
+
+            shell = self.own(index) if self._shared else self._shells[index]
+
             shell.record_history(time)
+
+    def histories(self) -> List[ShellHistory]:
+        """
+        the histories of all shells ordered by id. The dead shells
+        keep their last state and the shells that are not out yet
+        their initial state up to the last snapshot
+
+        :returns: 
+
+        """
+
+        n_time_steps = len(self._history_time)
+
+        recording = self._recording()
+
+        out = []
+
+        for index in range(self.n_shells):
+
+            if recording[index]:
+
+                out.append(self._shells[index].history)
+
+                continue
+
+            if index in self._dead_histories and self._dead_histories[index].n_time_steps == 0:
+
+                # streamed to disk
+
+                out.append(self._dead_histories[index])
+
+                continue
+
+            history = self._dead_histories.get(index, ShellHistory())
+
+            n = history.n_time_steps
+
+            if n < n_time_steps:
+
+                missing = n_time_steps - n
+
+                history = ShellHistory(
+                    gamma=list(history.gamma) + [float(self._gamma[index])] * missing,
+                    time=list(history.time) + self._history_time[n:],
+                    radius=list(history.radius) + [float(self._radius[index])] * missing,
+                    mass=list(history.mass) + [float(self._mass[index])] * missing,
+                    status=list(history.status) + [False] * missing,
+                )
+
+            out.append(history)
+
+        return out
+
+    def history_rows(self, start: int = 0):
+        """
+        the snapshots from start on as (time, shell) arrays, as
+        histories would give them: time and the gamma, radius, mass
+        and status of every shell ordered by id
+
+        :param start: the first snapshot
+        :returns:
+
+        """
+
+        n_rows = max(len(self._history_time) - start, 0)
+
+        out = dict(time=np.array(self._history_time[start:], dtype=float))
+
+        for name in ("gamma", "radius", "mass"):
+
+            out[name] = np.empty((n_rows, self.n_shells))
+
+        out["status"] = np.zeros((n_rows, self.n_shells), dtype=bool)
+
+        recording = self._recording()
+
+        for index in range(self.n_shells):
+
+            history = self._shells[index].history if recording[index] else self._dead_histories.get(index)
+
+            n = 0
+
+            if history is not None and history.n_time_steps > start:
+
+                n = min(history.n_time_steps - start, n_rows)
+
+                for name in ("gamma", "radius", "mass", "status"):
+
+                    out[name][:n, index] = getattr(history, name)[start : start + n]
+
+            # the shells keep their last state
+
+            out["gamma"][n:, index] = self._gamma[index]
+            out["radius"][n:, index] = self._radius[index]
+            out["mass"][n:, index] = self._mass[index]
+
+        return out
+
+    def _state_arrays(self):
+
+        gamma, mass, radius = self._gamma.copy(), self._mass.copy(), self._radius.copy()
+
+        birth_time, death_time = self._birth_time.copy(), self._death_time.copy()
+
+        for index in np.flatnonzero(self._recording()):
+
+            shell = self._shells[index]
+
+            gamma[index], mass[index], radius[index], _, birth_time[index], death_time[index] = shell.get_state()
+
+        return gamma, mass, radius, birth_time, death_time
+
+    def get_state(self):
+        """
+        the state of every shell as arrays ordered by shell id:
+        gamma, mass, radius, active, birth time and death time
+
+        :returns: 
+
+        """
+
+        gamma, mass, radius, birth_time, death_time = self._state_arrays()
+
+        return gamma, mass, radius, self._currently_active.copy(), birth_time, death_time
+
+    def set_state(self, gamma, mass, radius, active, birth_time, death_time, histories=None) -> None:
+        """
+        restore the state returned by get_state
+
+        :param histories: the histories of the shells, if storing
+        :returns: 
+
+        """
+
+        self._gamma = np.array(gamma, dtype=float)
+        self._mass = np.array(mass, dtype=float)
+        self._radius = np.array(radius, dtype=float)
+        self._birth_time = np.array(birth_time, dtype=float)
+        self._death_time = np.array(death_time, dtype=float)
+
+        self._currently_active = np.array(active, dtype=bool)
+
+        self._shells = np.full(len(self._gamma), None, dtype=object)
+        self._made = np.zeros(len(self._gamma), dtype=bool)
+
+        self._dead_histories = {}
+
+        self._history_time = []
+
+        if histories is not None and len(histories) > 0:
+
+            self._history_time = list(histories[0].time)
+
+            for index in np.flatnonzero(~np.isnan(self._death_time)):
+
+                self._dead_histories[index] = histories[index]
+
+        for index in np.flatnonzero(self._currently_active):
+
+            self._materialize(index, histories[index] if histories is not None else None)
+
+        self._has_moved = True
+
+    def snapshot(self):
+        """
+        the current gamma, radius, mass and status of
+        every shell as arrays ordered by shell id
+
+        :returns: 
+
+        """
+
+        gamma, mass, radius, _, _ = self._state_arrays()
+
+        return gamma, radius, mass, self._currently_active.copy()
     
 
 @njit(fastmath=False)
@@ -1,8 +1,24 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import Dict, List, Optional
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
+
+from .io.hdf5_writer import WriterOptions, column_key, read_column, write_datasets
+from .io.logging import setup_logger
+
+log = setup_logger(__name__)
+
+
+_HISTORY_COLUMNS = ("gamma", "time", "radius", "mass", "status")
+
+# version 1: one group per shell
+# version 2: 2D (time, shell) datasets with a shared time axis
+HISTORY_FORMAT_VERSION = 2
+
+_TIME_CHUNK = 256
+_SHELL_CHUNK = 256
 
 
 @dataclass(frozen=True)
@@ -29,6 +45,20 @@ class ShellHistory:
         self.mass.append(mass)
         self.status.append(status)
 
+    def clear(self) -> None:
+        """
+        drop all entries, freeing the memory held by the history
+
+        :returns: 
+
+        """
+
+        self.time.clear()
+        self.radius.clear()
+        self.gamma.clear()
+        self.mass.clear()
+        self.status.clear()
+
     def _at_time(self, time) -> int:
 
         return np.searchsorted(self.time, time)
@@ -44,39 +74,260 @@ class ShellHistory:
 
         return len(self.time)
     
-    def to_hdf5(self, group) -> None:
+    def to_hdf5(self, group, options: Optional[WriterOptions] = None) -> None:
+
+        columns = dict(
+            gamma=np.asarray(self.gamma, dtype=float),
+            time=np.asarray(self.time, dtype=float),
+            radius=np.asarray(self.radius, dtype=float),
+            mass=np.asarray(self.mass, dtype=float),
+            status=np.asarray(self.status, dtype=bool),
+        )
 
-        group.create_dataset("gamma", data=self.gamma, compression="gzip")
-        group.create_dataset("time", data=self.time, compression="gzip")
-        group.create_dataset("radius", data=self.radius, compression="gzip")
-        group.create_dataset("mass", data=self.mass, compression="gzip")
-        group.create_dataset("status", data=self.status, compression="gzip")
+        write_datasets(group, columns, options)
 
     @classmethod
     def from_hdf5(cls, group):
 
-        gamma = group["gamma"][()]
-        time = group["time"][()]
-        radius = group["radius"][()]
-        mass = group["mass"][()]
-        status = group["status"][()]
+        gamma = read_column(group["gamma"])
+        time = read_column(group["time"])
+        radius = read_column(group["radius"])
+        mass = read_column(group["mass"])
+        status = read_column(group["status"])
 
         return cls(gamma=gamma, time=time, radius=radius, mass=mass, status=status)
 
     
 
+class ShellHistorySink(object):
+
+    def __init__(self, group, n_shells: int, options: Optional[WriterOptions] = None) -> None:
+        """
+        Streams the histories of dead shells into an HDF5 group as soon
+        as they are deactivated. The group ends up in the (time, shell)
+        layout written by DetailedHistory.to_hdf5. Dead shells are written
+        in blocks of columns so that each chunk is only touched a few times
+
+        :param group: the HDF5 group to write into
+        :param n_shells: the number of shells in the jet
+        :type n_shells: int
+        :param options: the writer options. By default, those of the configuration
+        :returns: 
+
+        """
+
+        self._group = group
+
+        self._n_shells: int = int(n_shells)
+
+        self._options: WriterOptions = options if options is not None else WriterOptions.from_config()
+
+        # the global time axis that every shell is sampled on
+
+        self._time: List[float] = []
+
+        self._flushed: List[int] = []
+
+        # the dead shells not yet written
+        self._buffer: Dict[int, ShellHistory] = {}
+
+        # the shells written together and the number of rows written
+        self._blocks: List[tuple] = []
+
+        group.attrs["version"] = HISTORY_FORMAT_VERSION
+        group.attrs["n_shells"] = self._n_shells
+
+        filters = self._options.filter_kwargs()
+
+        chunks = self._options.chunk_shape((_TIME_CHUNK, max(self._n_shells, 1)), (_TIME_CHUNK, _SHELL_CHUNK))
+
+        for name in _HISTORY_COLUMNS:
+
+            if name == "time":
+
+                continue
+
+            group.create_dataset(
+                name,
+                shape=(0, self._n_shells),
+                maxshape=(None, self._n_shells),
+                dtype=bool if name == "status" else self._options.stream_dtype(column_key(group, name)),
+                chunks=chunks,
+                **filters
+            )
+
+    @property
+    def n_flushed(self) -> int:
+
+        return len(self._flushed)
+
+    def record_time(self, time: float) -> None:
+
+        self._time.append(time)
+
+    def flush(self, shell_id: int, history: ShellHistory) -> None:
+        """
+        take the history of a dead shell, which is written
+        to disk with the next block, and free the in memory lists
+
+        :param shell_id: the id of the shell
+        :type shell_id: int
+        :param history: 
+        :type history: ShellHistory
+        :returns: 
+
+        """
+
+        self._buffer[shell_id] = ShellHistory(
+            gamma=np.asarray(history.gamma, dtype=float),
+            time=np.asarray(history.time, dtype=float),
+            radius=np.asarray(history.radius, dtype=float),
+            mass=np.asarray(history.mass, dtype=float),
+            status=np.asarray(history.status, dtype=bool),
+        )
+
+        history.clear()
+
+        self._flushed.append(shell_id)
+
+        if len(self._buffer) >= _SHELL_CHUNK:
+
+            self._write_buffer()
+
+    def _resize(self, n_time_steps: int) -> None:
+
+        for name in ("gamma", "radius", "mass", "status"):
+
+            dset = self._group[name]
+
+            if dset.shape[0] < n_time_steps:
+
+                dset.resize((n_time_steps, self._n_shells))
+
+    def _write_block(self, shell_ids: List[int], histories: List[ShellHistory]) -> int:
+
+        n_rows = max(h.n_time_steps for h in histories)
+
+        self._resize(n_rows)
+
+        for name in ("gamma", "radius", "mass", "status"):
+
+            block = np.empty((n_rows, len(shell_ids)), dtype=bool if name == "status" else float)
+
+            for i, history in enumerate(histories):
+
+                values = np.asarray(getattr(history, name))
+
+                block[: len(values), i] = values
+
+                # a dead shell no longer moves, so its last
+                # entry holds for the rest of the run
+
+                block[len(values) :, i] = False if name == "status" else values[-1]
+
+            self._group[name][:n_rows, shell_ids] = block
+
+        return n_rows
+
+    def _write_buffer(self) -> None:
+
+        if not self._buffer:
+
+            return
+
+        shell_ids = sorted(self._buffer)
+
+        n_rows = self._write_block(shell_ids, [self._buffer[i] for i in shell_ids])
+
+        self._blocks.append((shell_ids, n_rows))
+
+        self._buffer = {}
+
+    def close(self, histories: List[ShellHistory]) -> None:
+        """
+        write the histories of the surviving shells and pad
+        the dead shells out to the full time axis
+
+        :param histories: the histories of all shells ordered by id
+        :returns: 
+
+        """
+
+        self._write_buffer()
+
+        n_time_steps = len(self._time)
+
+        self._resize(n_time_steps)
+
+        self._group.create_dataset("time", data=np.asarray(self._time, dtype=self._options.stream_dtype(column_key(self._group, "time"))))
+
+        for shell_ids, n_rows in self._blocks:
+
+            if n_rows >= n_time_steps:
+
+                continue
+
+            for name in ("gamma", "radius", "mass", "status"):
+
+                dset = self._group[name]
+
+                last = False if name == "status" else dset[n_rows - 1, shell_ids]
+
+                dset[n_rows:n_time_steps, shell_ids] = np.broadcast_to(last, (n_time_steps - n_rows, len(shell_ids)))
+
+        flushed = set(self._flushed)
+
+        survivors = [shell_id for shell_id in range(len(histories)) if shell_id not in flushed]
+
+        for start in range(0, len(survivors), _SHELL_CHUNK):
+
+            shell_ids = survivors[start : start + _SHELL_CHUNK]
+
+            self._write_block(shell_ids, [histories[i] for i in shell_ids])
+
+
 class DetailedHistory(object):
 
     def __init__(self, shell_histories: List[ShellHistory]) -> None:
 
 
-        self._shell_histories: List[ShellHistory] =  shell_histories
+        self._shell_histories: Optional[List[ShellHistory]] =  shell_histories
 
         self._n_shells = len(self._shell_histories)
 
         self._n_time_steps =  self._shell_histories[0].n_time_steps
 
-        
+        # the (time, shell) arrays, built on demand
+
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def from_arrays(cls, time: np.ndarray, gamma: np.ndarray, radius: np.ndarray, mass: np.ndarray, status: np.ndarray):
+        """
+        build the history from arrays with one row per
+        time step and one column per shell
+
+        :param time: the shared time axis
+        :param gamma: 
+        :param radius: 
+        :param mass: 
+        :param status: 
+        :returns: 
+
+        """
+
+        obj = cls.__new__(cls)
+
+        obj._shell_histories = None
+
+        obj._n_shells = gamma.shape[1]
+
+        obj._n_time_steps = len(time)
+
+        obj._columns = dict(time=time, gamma=gamma, radius=radius, mass=mass, status=status)
+
+        return obj
+
     @property
     def n_shells(self) -> int:
 
@@ -91,28 +342,69 @@ class DetailedHistory(object):
     @property
     def histories(self) -> List[ShellHistory]:
 
+        if self._shell_histories is None:
+
+            columns = self._columns
+
+            self._shell_histories = [
+                ShellHistory(
+                    gamma=columns["gamma"][:, i],
+                    time=columns["time"],
+                    radius=columns["radius"][:, i],
+                    mass=columns["mass"][:, i],
+                    status=columns["status"][:, i],
+                )
+                for i in range(self._n_shells)
+            ]
+
         return self._shell_histories
-    
-    def _compute_values_at_time(self, time):
 
-        status = []
-        masses = []
-        gammas = []
+    def _get_columns(self) -> Dict[str, np.ndarray]:
 
-        for hist in self._shell_histories:
+        if self._columns is None:
 
-            condition: Conditions = hist.conditions_at_time(time)
-            
-            status.append(condition.status)
-            masses.append(condition.mass)
-            gammas.append(condition.gamma)
+            columns = dict(time=np.asarray(self._shell_histories[0].time))
 
+            for name in ("gamma", "radius", "mass", "status"):
 
-        status = np.array(status)
-        masses = np.array(masses)
-        gammas=np.array(gammas)
+                columns[name] = np.array([getattr(history, name) for history in self._shell_histories]).T
 
-        return gammas[status], masses[status]
+            self._columns = columns
+
+        return self._columns
+
+    @property
+    def time(self) -> np.ndarray:
+
+        return self._get_columns()["time"]
+
+    @property
+    def gamma(self) -> np.ndarray:
+
+        return self._get_columns()["gamma"]
+
+    @property
+    def radius(self) -> np.ndarray:
+
+        return self._get_columns()["radius"]
+
+    @property
+    def mass(self) -> np.ndarray:
+
+        return self._get_columns()["mass"]
+
+    @property
+    def status(self) -> np.ndarray:
+
+        return self._get_columns()["status"]
+
+    def _compute_values_at_time(self, time):
+
+        idx = np.searchsorted(self.time, time)
+
+        status = self.status[idx]
+
+        return self.gamma[idx][status], self.mass[idx][status]
 
     def plot_gamma_at_time(self, time):
 
@@ -132,22 +424,197 @@ class DetailedHistory(object):
         ax.set_ylabel("gamma")
 
 
-    def to_hdf5(self, group) -> None:
+    def rescaled(
+        self, energy_scale: float = 1.0, time_scale: float = 1.0, r_min: float = 0.0, new_r_min: Optional[float] = None
+    ) -> "DetailedHistory":
+        """
+        the history of a jet whose energy and times are scaled and
+        which is launched from another radius, see CollisionHistory.rescaled
+
+        :param energy_scale: the ratio of the total energies
+        :param time_scale: the ratio of the variability times
+        :param r_min: the r_min of this jet
+        :param new_r_min: the r_min of the other jet. By default, r_min
+        :returns: 
+
+        """
+
+        columns = dict(self._get_columns())
+
+        new_r_min = r_min if new_r_min is None else new_r_min
+
+        if energy_scale != 1.0:
+
+            columns["mass"] = columns["mass"] * energy_scale
+
+        if time_scale != 1.0:
+
+            columns["time"] = columns["time"] * time_scale
+
+        if time_scale != 1.0 or new_r_min != r_min:
+
+            columns["radius"] = new_r_min + (columns["radius"] - r_min) * time_scale
+
+        return DetailedHistory.from_arrays(**columns)
+
+    def to_dataframe(self, form: str = "long") -> pd.DataFrame:
+        """
+        the history as a DataFrame that wraps the (time, shell)
+        arrays without copying them
+
+        * long: one row per time step and shell with the columns
+          step, shell, time, gamma, radius, mass and status. The rows
+          follow the memory layout of the arrays, and only step, shell
+          and time are new
+        * wide: indexed by time with (quantity, shell) columns
+
+        :param form: long or wide
+        :returns: 
 
+        """
 
+        columns = self._get_columns()
+
+        if form == "wide":
+
+            frames = {
+                name: pd.DataFrame(columns[name], index=pd.Index(columns["time"], name="time"), copy=False)
+                for name in ("gamma", "radius", "mass", "status")
+            }
+
+            out = pd.concat(frames, axis=1)
+
+            out.columns.names = ["quantity", "shell"]
+
+            return out
+
+        if form != "long":
+
+            log.error(f"form must be long or wide not {form}")
+
+            raise ValueError()
+
+        n_steps, n_shells = self._n_time_steps, self._n_shells
+
+        # flatten in the order the arrays are stored so that
+        # the columns are views
+
+        order = "F" if columns["gamma"].flags.f_contiguous and not columns["gamma"].flags.c_contiguous else "C"
+
+        if order == "C":
+
+            step = np.repeat(np.arange(n_steps), n_shells)
+            shell = np.tile(np.arange(n_shells), n_steps)
+
+        else:
+
+            step = np.tile(np.arange(n_steps), n_shells)
+            shell = np.repeat(np.arange(n_shells), n_steps)
+
+        data = dict(step=step, shell=shell, time=np.asarray(columns["time"])[step])
+
+        for name in ("gamma", "radius", "mass", "status"):
+
+            data[name] = np.ravel(columns[name], order=order)
+
+        return pd.DataFrame(data, copy=False)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame):
+        """
+        build the history from a DataFrame in either of the forms
+        of to_dataframe. Whole time steps can be filtered out, but
+        every remaining step needs a row for each shell
+
+        :param df: 
+        :returns: 
+
+        """
+
+        if isinstance(df.columns, pd.MultiIndex):
+
+            # the wide form
+
+            return cls.from_arrays(
+                time=df.index.to_numpy(),
+                **{name: df[name].to_numpy() for name in ("gamma", "radius", "mass", "status")}
+            )
+
+        step = df["step"].to_numpy()
+        shell = df["shell"].to_numpy()
+
+        n_steps = len(np.unique(step))
+        n_shells = len(np.unique(shell))
+
+        if n_steps * n_shells != len(df):
+
+            log.error("every time step needs a row for each shell")
+
+            raise RuntimeError()
+
+        order = np.lexsort((shell, step))
+
+        if np.array_equal(order, np.arange(len(order))):
+
+            # already in (step, shell) order, so we can reshape in place
+            order = slice(None)
+
+        def _grid(name: str) -> np.ndarray:
+
+            return df[name].to_numpy()[order].reshape(n_steps, n_shells)
+
+        return cls.from_arrays(
+            time=_grid("time")[:, 0],
+            gamma=_grid("gamma"),
+            radius=_grid("radius"),
+            mass=_grid("mass"),
+            status=_grid("status"),
+        )
+
+    def to_hdf5(self, group, options: Optional[WriterOptions] = None) -> None:
+        """
+        write the history as 2D (time, shell) datasets
+        that share a single time axis
+
+        :param group: 
+        :param options: the writer options. By default, those of the configuration
+        :returns: 
+
+        """
+
+        group.attrs["version"] = HISTORY_FORMAT_VERSION
         group.attrs["n_shells"] = self._n_shells
-        
-        for i, history in enumerate(self._shell_histories):
 
-            shell_group = group.create_group(f"shell_{i}")
+        columns = self._get_columns()
 
-            history.to_hdf5(shell_group)
+        write_datasets(group, dict(time=columns["time"]), options)
+
+        write_datasets(
+            group,
+            {name: columns[name] for name in ("gamma", "radius", "mass", "status")},
+            options,
+            chunks=(_TIME_CHUNK, _SHELL_CHUNK),
+        )
     
     @classmethod
     def from_hdf5(cls, group):
 
         n_shells = int(group.attrs["n_shells"])
 
+        version = int(group.attrs.get("version", 1))
+
+        if version >= 2:
+
+            return cls.from_arrays(
+                time=read_column(group["time"]),
+                gamma=read_column(group["gamma"]),
+                radius=read_column(group["radius"]),
+                mass=read_column(group["mass"]),
+                status=read_column(group["status"]),
+            )
+
+        # the original layout with one group per shell
+
         histories = [ShellHistory.from_hdf5(group[f"shell_{i}"]) for i in range(n_shells)]
 
         return cls(histories)
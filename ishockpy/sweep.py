@@ -0,0 +1,266 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import h5py
+import numpy as np
+
+from .cache import ResultCache
+from .collision import COLLISION_COLUMNS, CollisionHistory
+from .distribution import InitialConditions
+from .ensemble import EnsembleStore
+from .io.hdf5_writer import WriterOptions
+from .io.logging import setup_logger
+from .jet import Jet
+
+log = setup_logger(__name__)
+
+
+def _run_shard(
+    file_name: str,
+    work: List[Tuple[str, InitialConditions]],
+    store: bool,
+    options: Optional[WriterOptions],
+    rescale: bool = True,
+) -> str:
+
+    shard = EnsembleStore(file_name)
+
+    # the runs of a shard that are rescalings of each other come in
+    # a row, so only the last one run has to be kept
+
+    last: Optional[Tuple[str, Jet]] = None
+
+    for key, initial_conditions in work:
+
+        digest = initial_conditions.canonical_digest()
+
+        if rescale and last is not None and last[0] == digest:
+
+            jet = last[1].rescaled(initial_conditions)
+
+        else:
+
+            jet = Jet(initial_conditions, store=store)
+
+            jet.start()
+
+            last = (digest, jet)
+
+        shard.append(jet, key=key, options=options)
+
+    return file_name
+
+
+def run_sweep(
+    initial_conditions: Sequence[InitialConditions],
+    output_dir: str,
+    n_workers: int = 1,
+    store: bool = False,
+    keys: Optional[Sequence[str]] = None,
+    options: Optional[WriterOptions] = None,
+    name: str = "sweep",
+    rescale: bool = True,
+) -> str:
+    """
+    run a set of jets in parallel. Each worker writes its own
+    shard (an EnsembleStore) and the shards are then stitched
+    together in a master file without copying the runs
+
+    :param initial_conditions: the initial conditions to run
+    :param output_dir: the directory for the shards and master file
+    :param n_workers: the number of worker processes
+    :param store: store the shell histories
+    :param keys: the key of each run. By default, run_<n>
+    :param options: the writer options for the runs
+    :param name: the master file is <name>.h5 and the shards <name>_<n>.h5
+    :param rescale: run only one of the jets that differ only in their
+    total energy, r_min and variability time and rescale its results for
+    the others, see rescale_results
+    :returns: the master file name
+
+    """
+
+    output_dir = Path(output_dir)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if keys is None:
+
+        keys = [f"run_{i}" for i in range(len(initial_conditions))]
+
+    # the runs that are rescalings of each other go together
+
+    groups: Dict[str, List[Tuple[str, InitialConditions]]] = {}
+
+    for i, (key, ic) in enumerate(zip(keys, initial_conditions)):
+
+        groups.setdefault(ic.canonical_digest() if rescale else str(i), []).append((key, ic))
+
+    groups = list(groups.values())
+
+    n_workers = max(1, min(n_workers, len(groups)))
+
+    # deal the groups out round robin so the shards are balanced
+
+    work = [[run for group in groups[i::n_workers] for run in group] for i in range(n_workers)]
+
+    shard_files = [str(output_dir / f"{name}_{i}.h5") for i in range(n_workers)]
+
+    if n_workers == 1:
+
+        _run_shard(shard_files[0], work[0], store, options, rescale)
+
+    else:
+
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+
+            futures = [
+                pool.submit(_run_shard, file_name, shard_work, store, options, rescale)
+                for file_name, shard_work in zip(shard_files, work)
+            ]
+
+            for future in futures:
+
+                future.result()
+
+    master_file = str(output_dir / f"{name}.h5")
+
+    build_master_file(shard_files, master_file)
+
+    return master_file
+
+
+def r_max_scan(
+    initial_conditions: InitialConditions, r_max: Sequence[float], cache: Optional[ResultCache] = None
+) -> List[CollisionHistory]:
+    """
+    the collisions of a jet for each of several r_max from a
+    single run without r_max, see CollisionHistory.within. These are
+    the collisions of jets run with each r_max, whose shells leave when
+    they get to it. The total radiated energy as a function of r_max is
+    radiated_energy_within of the unbounded run
+
+    :param initial_conditions: the jet, whose r_max is ignored
+    :param r_max: the maximum radii
+    :param cache: take the unbounded run from this result cache
+    :returns: the collisions for each r_max
+
+    """
+
+    unbounded = initial_conditions.with_r_max(None)
+
+    if cache is not None:
+
+        collisions, _ = cache.run(unbounded)
+
+    else:
+
+        jet = Jet(unbounded)
+
+        jet.start()
+
+        collisions = jet.collision_history
+
+    return [collisions.within(value) for value in r_max]
+
+
+def build_master_file(shard_files: Sequence[str], master_file: str) -> None:
+    """
+    build a file that presents a set of EnsembleStore shards as one.
+
+    * runs/<key> are external links to the runs in the shards
+    * collisions/<column> are virtual datasets concatenating the collisions of every run
+    * collisions/offsets gives the first row of each run in those datasets,
+      in the order of the rows of the table
+    * table is the concatenated table of the shards
+
+    The master can be opened with EnsembleStore. Shards in the
+    same directory as the master are referenced by relative path,
+    so the directory can be moved as a whole.
+
+    :param shard_files: the shard files
+    :param master_file: the file to create
+    :returns:
+
+    """
+
+    master_dir = Path(master_file).resolve().parent
+
+    def _reference(file_name: str) -> str:
+
+        path = Path(file_name).resolve()
+
+        return path.name if path.parent == master_dir else str(path)
+
+    # (shard reference, key, number of collisions) for every run
+
+    runs = []
+
+    tables = []
+
+    for file_name in shard_files:
+
+        reference = _reference(file_name)
+
+        with h5py.File(file_name, "r") as f:
+
+            table = f["table"]
+
+            tables.append({name: (table[name][()], table[name].dtype) for name in table})
+
+            for key in table["key"].asstr()[()]:
+
+                collisions = f["runs"][key]["collisions"]
+
+                if any(collisions[column].attrs.get("encoding", "") == "log_quantized" for column in COLLISION_COLUMNS):
+
+                    # a virtual dataset can not decode them
+
+                    log.error(f"the collisions of {key} in {file_name} are quantized and can not be stitched")
+
+                    raise RuntimeError()
+
+                runs.append((reference, key, f["runs"][key]["collisions/time"].shape[0]))
+
+    offsets = np.concatenate([[0], np.cumsum([n for _, _, n in runs])]).astype(np.int64)
+
+    n_total = int(offsets[-1])
+
+    with h5py.File(master_file, "w") as f:
+
+        run_grp = f.create_group("runs")
+
+        for reference, key, _ in runs:
+
+            run_grp[key] = h5py.ExternalLink(reference, f"/runs/{key}")
+
+        collision_grp = f.create_group("collisions")
+
+        collision_grp.create_dataset("offsets", data=offsets)
+
+        for column in COLLISION_COLUMNS:
+
+            layout = h5py.VirtualLayout(shape=(n_total,), dtype="f8")
+
+            for (reference, key, n), start in zip(runs, offsets):
+
+                if n == 0:
+
+                    continue
+
+                layout[start: start + n] = h5py.VirtualSource(reference, f"/runs/{key}/collisions/{column}", shape=(n,))
+
+            collision_grp.create_virtual_dataset(column, layout)
+
+        # the table is one row per run, so it is cheap to copy
+
+        table_grp = f.create_group("table")
+
+        for name in tables[0] if tables else []:
+
+            data = np.concatenate([table[name][0] for table in tables])
+
+            table_grp.create_dataset(name, data=data, maxshape=(None,), chunks=(1024,), dtype=tables[0][name][1])
+
+    log.info(f"stitched {len(runs)} runs from {len(shard_files)} shards into {master_file}")
@@ -3,7 +3,7 @@ from pathlib import Path
 import numpy as np
 import pytest
 
-from ishockpy import InitialConditions, Jet, SingleGammaStep
+from ishockpy import InitialConditions, Jet, OutputOptions, SingleGammaStep
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -49,5 +49,30 @@ def finished_jet():
 
         f.unlink()
 
-    
-    
+
+def _small_conditions(r_max=None):
+
+    return InitialConditions(total_time=2.,
+                             delta_time=.05,
+                             total_energy=2*1.E51/(4* np.pi),
+                             gamma_distribtuion=SingleGammaStep(),
+                             r_min=1.2E4,
+                             r_max=r_max)
+
+
+@pytest.fixture(scope="session")
+def small_conditions():
+
+    # a short jet, made anew for each call
+
+    return _small_conditions
+
+
+@pytest.fixture(scope="session")
+def small_jet(small_conditions):
+
+    jet = Jet(small_conditions(), store=True, output=OutputOptions(record_events=True))
+
+    jet.start()
+
+    yield jet
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from ishockpy import Histogram, Jet, LightCurve, OutputOptions, QuantileSketch, Reservoir, Totals, merge_accumulators
+
+
+def test_accumulators(small_jet, small_conditions, tmp_path):
+
+    reference = small_jet
+
+    collisions = reference.collision_history
+
+    edges = np.geomspace(1e10, 1e17, 15)
+
+    def accumulators():
+
+        return [
+            Totals(small_conditions().kinetic_energy),
+            Histogram("radius", edges, weight="radiated_energy"),
+            QuantileSketch("gamma", relative_accuracy=0.01),
+            Reservoir(10, seed=1),
+        ]
+
+    jet = Jet(small_conditions(), output=OutputOptions(retain_collisions=False), accumulators=accumulators())
+    jet.start()
+
+    totals, histogram, sketch, reservoir = jet.accumulators
+
+    assert jet.collision_history is None
+
+    assert totals.n_collisions == reference.n_collisions
+    assert np.isclose(totals.radiated_energy, collisions.column("radiated_energy").sum())
+    # the kinetic energy of the shells, m (gamma - 1) in erg / c^2 like the radiated energy
+
+    conditions = small_conditions()
+
+    n_shells = int(conditions.n_shells)
+
+    kinetic = np.sum(conditions.mass_distribution.values[:n_shells] * (conditions.gamma_distribution.values[:n_shells] - 1.0))
+
+    assert np.isclose(totals.efficiency, collisions.column("radiated_energy").sum() / kinetic)
+    assert 0.0 < totals.efficiency < 1.0
+
+    expected, _ = np.histogram(collisions.radius, bins=edges, weights=collisions.radiated_energy)
+
+    assert np.allclose(histogram.counts, expected)
+    assert np.isclose(histogram.underflow + histogram.overflow + histogram.counts.sum(), collisions.column("radiated_energy").sum())
+
+    for q in (0.0, 0.1, 0.5, 0.9, 1.0):
+
+        exact = np.quantile(collisions.gamma, q, method="inverted_cdf")
+
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * exact * 1.0001
+
+    # the ends are the smallest and largest values, whatever their sign
+
+    signed = QuantileSketch("time", relative_accuracy=0.01)
+
+    for time in ([2.0, 5.0, 40.0], [-3.0, 0.0, 7.0]):
+
+        signed.add(np.ones(3), np.ones(3), np.ones(3), np.array(time))
+
+    assert np.allclose(signed.quantile([0.0, 1.0]), [-3.0, 40.0], rtol=0.01)
+
+    positive = QuantileSketch("time", relative_accuracy=0.01)
+
+    positive.add(np.ones(3), np.ones(3), np.ones(3), np.array([2.0, 5.0, 40.0]))
+
+    assert np.allclose(positive.quantile([0.0, 1.0]), [2.0, 40.0], rtol=0.01)
+
+    assert len(reservoir.sample) == 10
+    assert reservoir.n_seen == reference.n_collisions
+    assert np.all(np.isin(reservoir.sample.radius, collisions.radius))
+
+    # runs merge into the statistics of both
+
+    other = accumulators()
+
+    for accumulator in other:
+
+        accumulator.add_history(collisions)
+
+    merged = [merge_accumulators([a, b]) for a, b in zip(jet.accumulators, other)]
+
+    assert merged[0].n_collisions == 2 * reference.n_collisions
+    assert np.allclose(merged[1].counts, 2 * expected)
+    assert np.isclose(merged[2].count, 2 * reference.n_collisions)
+    assert merged[3].n_seen == 2 * reference.n_collisions and len(merged[3].sample) == 10
+
+    with pytest.raises(ValueError):
+
+        merged[1].merge(Histogram("radius", edges[:5]))
+
+    # a merged reservoir takes from each run in proportion to what it saw
+
+    small, large = Reservoir(100, seed=2), Reservoir(100, seed=3)
+
+    small.add(np.zeros(100), np.ones(100), np.ones(100), np.ones(100))
+    large.add(np.ones(900), np.ones(900), np.ones(900), np.ones(900))
+
+    fractions = [
+        merge_accumulators([small, large]).sample.column("radiated_energy").mean(),
+        merge_accumulators([large, small]).sample.column("radiated_energy").mean(),
+    ]
+
+    assert np.allclose(fractions, 0.9, atol=0.1)
+
+    # they carry on through a checkpoint
+
+    checkpoint = str(tmp_path / "jet.ckpt")
+
+    jet = Jet(small_conditions(), accumulators=accumulators(), checkpoint_file=checkpoint, checkpoint_every=reference.n_steps // 2)
+    jet.start()
+
+    resumed = Jet.resume(checkpoint, small_conditions())
+    resumed.start()
+
+    assert resumed.accumulators[0].n_collisions == reference.n_collisions
+
+
+def test_light_curve(small_jet, small_conditions):
+
+    reference = small_jet
+
+    collisions = reference.collision_history
+
+    edges = np.linspace(collisions.column("time_observer").min() - 0.1, collisions.column("time_observer").max() + 0.1, 50)
+
+    jet = Jet(small_conditions(), output=OutputOptions(retain_collisions=False), accumulators=[LightCurve(edges), LightCurve(edges, pulse="exponential")])
+    jet.start()
+
+    expected, _ = np.histogram(collisions.time_observer, bins=edges, weights=collisions.radiated_energy)
+
+    assert np.allclose(jet.light_curve, expected)
+
+    # the pulses only move the energy to later bins
+
+    spread = jet.accumulators[1]
+
+    assert np.isclose(spread.values.sum() + spread.outside, collisions.column("radiated_energy").sum())
+    assert np.all(np.cumsum(spread.values) <= np.cumsum(expected) * (1 + 1e-12))
+    assert np.allclose(jet.accumulators[0].rate * np.diff(edges), expected)
@@ -0,0 +1,241 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from ishockpy import EnsembleStore, InitialConditions, Jet, ResultCache, SingleGammaStep, TabulatedGamma, rescale_results
+from ishockpy.cache import ENGINE_VERSION
+from ishockpy.sweep import r_max_scan, run_sweep
+
+
+def test_result_cache(small_conditions, tmp_path):
+
+    cache = ResultCache(str(tmp_path / "cache"), max_size=1.)
+
+    ic = small_conditions()
+
+    assert ic not in cache
+    assert cache.get(ic) is None
+
+    collisions, shells = cache.run(ic)
+
+    assert shells is None
+    assert ic in cache
+
+    # the same conditions made again hit the cache
+
+    again, _ = cache.run(small_conditions())
+
+    assert np.array_equal(again.radius, collisions.radius)
+
+    # the history was not cached
+
+    assert cache.get(ic, store=True) is None
+
+    _, shells = cache.run(ic, store=True)
+
+    assert cache.get(ic, store=True)[1].n_time_steps == shells.n_time_steps
+
+    # a jet without the history does not replace it
+
+    jet = Jet(small_conditions())
+    jet.start()
+
+    cache.put(jet)
+
+    assert cache.get(ic, store=True)[1].n_time_steps == shells.n_time_steps
+
+    # the entries describe themselves
+
+    stored = cache.initial_conditions(cache.key(ic))
+
+    assert stored.digest() == ic.digest()
+    assert cache.key(small_conditions(r_max=1e12)) != cache.key(ic)
+
+    # the least recently used entries go first
+
+    directory = str(tmp_path / "lru")
+
+    conditions = [
+        InitialConditions(total_time=total_time, delta_time=.05, total_energy=1e51, gamma_distribtuion=SingleGammaStep(), r_min=1e4)
+        for total_time in (1., 1.1, 1.2)
+    ]
+
+    lru = ResultCache(directory)
+
+    lru.run(conditions[0])
+    lru.run(conditions[1])
+
+    now = time.time()
+
+    # the first was used more recently
+
+    os.utime(lru.directory / f"{lru.key(conditions[0])}.h5", (now - 10, now - 10))
+    os.utime(lru.directory / f"{lru.key(conditions[1])}.h5", (now - 20, now - 20))
+
+    lru = ResultCache(directory, max_size=2.5 * lru.size / 2 / 1e9)
+
+    lru.run(conditions[2])
+
+    assert conditions[0] in lru
+    assert conditions[1] not in lru
+    assert conditions[2] in lru
+
+
+def test_prefix_reuse(small_conditions, tmp_path, monkeypatch):
+
+    gamma = small_conditions().gamma_distribution.values
+
+    def conditions(tail):
+
+        values = gamma.copy()
+
+        values[30:] = tail
+
+        return InitialConditions(total_time=2., delta_time=.05, total_energy=2*1.E51/(4* np.pi),
+                                 gamma_distribtuion=TabulatedGamma(values), r_min=1.2E4)
+
+    cache = ResultCache(str(tmp_path / "cache"), prefix_every=10)
+
+    first = conditions(100.)
+
+    keys = first.prefix_digests([10, 20, 30], ENGINE_VERSION, False)
+
+    cache.run(first)
+
+    entries = {path.stem for path in cache.entries()}
+
+    assert all(key in entries for key in keys.values())
+
+    # only the tail differs, so the jet starts from the
+    # state at 30 shells and ends up as if run from scratch
+
+    second = conditions(400.)
+
+    assert second.prefix_digests([30], ENGINE_VERSION, False)[30] == keys[30]
+    assert second.prefix_digests([31], ENGINE_VERSION, False)[31] != first.prefix_digests([31], ENGINE_VERSION, False)[31]
+
+    # note the jets resumed from a prefix
+
+    resumed = []
+
+    resume = Jet.resume
+
+    def spy(file_name, initial_conditions, prefix=False, **kwargs):
+
+        jet = resume(file_name, initial_conditions, prefix=prefix, **kwargs)
+
+        resumed.append(jet.n_emitted)
+
+        return jet
+
+    monkeypatch.setattr(Jet, "resume", spy)
+
+    collisions, _ = cache.run(second)
+
+    assert resumed == [30]
+
+    reference = Jet(second, store=True)
+    reference.start()
+
+    assert np.array_equal(collisions.radius, reference.collision_history.radius)
+    assert np.array_equal(collisions.gamma, reference.collision_history.gamma)
+
+    # with the history, the shells still to be emitted are filled in
+
+    cache.run(first, store=True)
+
+    _, shells = cache.run(second, store=True)
+
+    assert resumed == [30, 30]
+    assert np.array_equal(shells.gamma, reference.detailed_history.gamma)
+    assert np.array_equal(shells.radius, reference.detailed_history.radius)
+    assert np.array_equal(shells.status, reference.detailed_history.status)
+
+
+def test_rescaling(small_conditions, tmp_path):
+
+    gamma = small_conditions().gamma_distribution.values
+
+    def conditions(total_energy=1e51, r_min=1.2e4, scale=1.):
+
+        return InitialConditions(total_time=2. * scale, delta_time=.05 * scale, total_energy=total_energy,
+                                 gamma_distribtuion=TabulatedGamma(gamma), r_min=r_min)
+
+    source = Jet(conditions(), store=True)
+    source.start()
+
+    target = conditions(total_energy=3e52, r_min=5e5, scale=2.)
+
+    reference = Jet(target, store=True)
+    reference.start()
+
+    collisions, shells = rescale_results(source.collision_history, source.detailed_history, source.initial_conditions, target)
+
+    for name in ("radiated_energy", "gamma", "radius", "time"):
+
+        assert np.allclose(getattr(collisions, name), getattr(reference.collision_history, name), rtol=1e-6)
+
+    for name in ("mass", "radius", "time"):
+
+        assert np.allclose(getattr(shells, name), getattr(reference.detailed_history, name), rtol=1e-6)
+
+    assert np.array_equal(shells.status, reference.detailed_history.status)
+
+    # another gamma profile is not a rescaling
+
+    with pytest.raises(ValueError):
+
+        rescale_results(source.collision_history, None, source.initial_conditions, small_conditions(r_max=1e12))
+
+    # the cache serves the rescaled jet from the source
+
+    cache = ResultCache(str(tmp_path / "cache"))
+
+    cache.put(source)
+
+    assert target in cache
+
+    cached, _ = cache.get(target)
+
+    assert np.allclose(cached.radiated_energy, reference.collision_history.radiated_energy, rtol=1e-6)
+
+    # and a sweep over energies runs once
+
+    energies = [1e50, 1e51, 1e52]
+
+    master = run_sweep([conditions(total_energy=e) for e in energies], str(tmp_path / "sweep"), n_workers=2)
+
+    table = EnsembleStore(master).table
+
+    assert np.allclose(table["total_radiated_energy"] / table["total_energy"], table["total_radiated_energy"].iloc[0] / energies[0])
+    assert (table["runtime"] == 0.).sum() == 2
+
+
+def test_r_max_scan(small_conditions, tmp_path):
+
+    unbounded = Jet(small_conditions())
+    unbounded.start()
+
+    radius = unbounded.collision_history.radius
+
+    r_max = np.percentile(radius, [25, 50, 75])
+
+    views = r_max_scan(small_conditions(r_max=1e30), r_max, cache=ResultCache(str(tmp_path / "cache")))
+
+    assert [len(view) for view in views] == [int(np.sum(radius < value)) for value in r_max]
+
+    # a jet run with r_max has the same collisions, as
+    # its shells leave when they get to r_max
+
+    bounded = Jet(small_conditions(r_max=r_max[1]))
+    bounded.start()
+
+    assert len(bounded.collision_history) == len(views[1])
+    assert np.allclose(np.sort(bounded.collision_history.column("radius")), np.sort(views[1].column("radius")))
+
+    energy = unbounded.collision_history.radiated_energy_within(r_max)
+
+    assert np.allclose(energy, [view.column("radiated_energy").sum() for view in views])
+    assert np.isclose(unbounded.collision_history.radiated_energy_within(np.inf), unbounded.collision_history.column("radiated_energy").sum())
@@ -0,0 +1,105 @@
+import h5py
+import numpy as np
+import pytest
+
+from ishockpy import EnsembleStore, Jet, OutputOptions
+from ishockpy.accumulators import Accumulator, Totals
+from ishockpy.sweep import run_sweep
+
+
+def test_ensemble_store(small_conditions, finished_jet, tmp_path):
+
+    store = EnsembleStore(str(tmp_path / "ensemble.h5"))
+
+    store.append(finished_jet)
+
+    jet = Jet(small_conditions(r_max=None), store=False)
+    jet.start()
+
+    store.append(jet, key="small")
+
+    table = store.table
+
+    assert len(store) == 2
+    assert list(table.index) == ["run_0", "small"]
+    assert table.loc["small", "n_collisions"] == jet.n_collisions
+    assert np.isclose(table.loc["small", "total_radiated_energy"], np.sum(jet.collision_history.radiated_energy))
+
+    assert store.select("total_time < 5") == ["small"]
+
+    collisions, shells = store.load("run_0")
+
+    assert np.array_equal(collisions.radius, finished_jet.collision_history.radius)
+    assert np.array_equal(shells.gamma, finished_jet.detailed_history.gamma)
+
+    collisions, shells = store.load_many(["small"])["small"]
+
+    assert shells is None
+    assert len(collisions) == jet.n_collisions
+
+    with store.open_lazy("run_0") as run:
+
+        assert np.array_equal(run.collisions.radius[5:9], finished_jet.collision_history.radius[5:9])
+        assert np.array_equal(run.shells[4].gamma, finished_jet.detailed_history.histories[4].gamma)
+
+    # the store can be written again once the run is closed
+
+    store.append(jet, key="again")
+
+    assert len(store) == 3
+
+    # runs that did not keep their collisions are summarised all the same
+
+    for key, output in (("totals", OutputOptions(retain_collisions=False)), ("summary", OutputOptions(summary_only=True))):
+
+        kept = Jet(small_conditions(r_max=None), output=output, accumulators=[Totals()])
+        kept.start()
+
+        store.append(kept, key=key)
+
+        row = store.table.loc[key]
+
+        assert row["n_collisions"] == jet.n_collisions
+        assert np.isclose(row["total_radiated_energy"], np.sum(jet.collision_history.radiated_energy))
+
+        with pytest.raises(RuntimeError):
+
+            store.load(key)
+
+    with h5py.File(store.file_name, "r") as f:
+
+        assert Accumulator.from_hdf5(f["runs/totals/accumulators/0"]).n_collisions == jet.n_collisions
+        assert "summary" in f["runs/summary"]
+
+
+def test_sharded_sweep(small_conditions, tmp_path, monkeypatch):
+
+    conditions = [small_conditions(), small_conditions(r_max=None), small_conditions()]
+
+    master = run_sweep(conditions, str(tmp_path / "sweep"), n_workers=2)
+
+    jet = Jet(small_conditions())
+    jet.start()
+
+    # read from somewhere else to check the links are relative
+
+    monkeypatch.chdir(tmp_path)
+
+    with h5py.File(master, "r") as f:
+
+        assert f["collisions/radius"].is_virtual
+
+        offsets = f["collisions/offsets"][()]
+
+        radius = f["collisions/radius"][()]
+
+    assert len(radius) == 3 * jet.n_collisions
+    assert np.array_equal(radius[offsets[1]: offsets[2]], jet.collision_history.radius)
+
+    store = EnsembleStore(master)
+
+    assert sorted(store.keys()) == ["run_0", "run_1", "run_2"]
+
+    collisions, _ = store.load("run_1")
+
+    assert np.array_equal(collisions.gamma, jet.collision_history.gamma)
@@ -0,0 +1,497 @@
+import h5py
+import numpy as np
+import pytest
+
+from ishockpy import Jet, OutputOptions
+from ishockpy import collision
+from ishockpy.collision import OBSERVER_BLOCK, CollisionHistory, ObserverIndexBuilder, observer_index_arrays
+from ishockpy.io import hdf5_writer
+from ishockpy.io.bulk import load_collisions
+from ishockpy.io.chunked_output import ChunkedOutput
+from ishockpy.io.hdf5_writer import ColumnPrecision, WriterOptions
+from ishockpy.io.npy_directory import hdf5_to_npy, npy_to_hdf5
+from ishockpy.io.swmr import CollisionTail
+from ishockpy.shell_history import HISTORY_FORMAT_VERSION, DetailedHistory
+from ishockpy.utils.configuration import ishockpy_config
+
+
+def test_history_sink(small_jet, small_conditions, tmp_path):
+
+    reference = small_jet
+
+    file_name = tmp_path / "streamed.h5"
+
+    jet = Jet(small_conditions(), store=True, output=OutputOptions(history_file=str(file_name)))
+
+    jet.start()
+
+    # the dead shells no longer hold their history in memory
+
+    assert any(shell.history.n_time_steps == 0 for shell in jet.shells)
+
+    for a, b in zip(reference.detailed_history.histories, jet.detailed_history.histories):
+
+        for name in ("gamma", "time", "radius", "mass", "status"):
+
+            assert np.array_equal(getattr(a, name), getattr(b, name))
+
+    # the same layout as DetailedHistory.to_hdf5
+
+    with h5py.File(file_name, "r") as f:
+
+        assert f["shells"].attrs["version"] == HISTORY_FORMAT_VERSION
+        assert f["shells/gamma"].shape == (reference.detailed_history.n_time_steps, reference.detailed_history.n_shells)
+
+    collisions, shells = Jet.from_file(str(file_name))
+
+    assert len(collisions.radius) == reference.n_collisions
+    assert shells.n_shells == reference.detailed_history.n_shells
+
+
+def test_chunked_output(small_jet, small_conditions, tmp_path):
+
+    reference = small_jet
+
+    file_name = tmp_path / "chunked.h5"
+
+    jet = Jet(small_conditions(), store=True, output=OutputOptions(output_file=str(file_name), chunk_size=7))
+
+    jet.start()
+
+    # the collisions are read back from the file
+
+    with h5py.File(file_name, "r") as f:
+
+        assert f["collisions/time"].shape == (reference.n_collisions,)
+
+    assert np.array_equal(jet.collision_history.radius, reference.collision_history.radius)
+    assert np.array_equal(jet.collision_history.time, reference.collision_history.time)
+
+    for a, b in zip(reference.detailed_history.histories, jet.detailed_history.histories):
+
+        for name in ("gamma", "time", "radius", "mass", "status"):
+
+            assert np.array_equal(getattr(a, name), getattr(b, name))
+
+    copy_name = tmp_path / "copy.h5"
+
+    jet.write_to(str(copy_name))
+
+    collisions, shells = Jet.from_file(str(copy_name))
+
+    assert np.array_equal(collisions.gamma, reference.collision_history.gamma)
+
+    # a run that fails closes its file and stops the writer
+
+    failing = Jet(small_conditions(), output=OutputOptions(output_file=str(file_name), chunk_size=2))
+
+    failing.step(20)
+
+    def fail():
+
+        raise ValueError()
+
+    failing._advance_time = fail
+
+    with pytest.raises(ValueError):
+
+        failing.start()
+
+    assert not failing._output._thread.is_alive()
+
+    with h5py.File(file_name, "r") as f:
+
+        assert f["collisions/time"].shape[0] > 0
+
+
+def test_detailed_history_layouts(finished_jet, tmp_path):
+
+    history = finished_jet.detailed_history
+
+    with h5py.File(tmp_path / "flat.h5", "w") as f:
+
+        history.to_hdf5(f.create_group("shells"))
+
+        # the original layout with one group per shell
+
+        legacy = f.create_group("legacy")
+
+        legacy.attrs["n_shells"] = history.n_shells
+
+        for i, shell_history in enumerate(history.histories):
+
+            shell_history.to_hdf5(legacy.create_group(f"shell_{i}"))
+
+    with h5py.File(tmp_path / "flat.h5", "r") as f:
+
+        assert f["shells"].attrs["version"] == 2
+        assert "shell_0" not in f["shells"]
+
+        flat = DetailedHistory.from_hdf5(f["shells"])
+        old = DetailedHistory.from_hdf5(f["legacy"])
+
+    for name in ("time", "gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(flat, name), getattr(history, name))
+        assert np.array_equal(getattr(old, name), getattr(history, name))
+
+    assert np.array_equal(flat.histories[3].radius, history.histories[3].radius)
+
+
+def test_writer_options(finished_jet, tmp_path, monkeypatch):
+
+    assert WriterOptions() == WriterOptions.from_config()
+
+    # the defaults follow the loaded configuration
+
+    monkeypatch.setattr(ishockpy_config.hdf5_writer, "compression_level", 7)
+    monkeypatch.setattr(ishockpy_config.hdf5_writer, "chunk_size", 32)
+
+    assert WriterOptions().compression_level == 7
+    assert WriterOptions().chunks == (32,)
+
+    monkeypatch.undo()
+
+    # send even these small datasets through the compression threads
+    monkeypatch.setattr(hdf5_writer, "_THREADED_BYTES", 0)
+
+    history = finished_jet.detailed_history
+
+    options = [
+        WriterOptions(compression="none"),
+        WriterOptions(compression="lzf", shuffle=True),
+        WriterOptions(n_threads=1),
+        WriterOptions(compression_level=9, shuffle=True, chunks=(64, 16), n_threads=4),
+        WriterOptions(n_threads=3, chunks=(100,)),
+    ]
+
+    for i, option in enumerate(options):
+
+        file_name = tmp_path / f"options_{i}.h5"
+
+        finished_jet.write_to(str(file_name), options=option)
+
+        collisions, shells = Jet.from_file(str(file_name))
+
+        assert np.array_equal(collisions.radius, finished_jet.collision_history.radius)
+
+        for name in ("time", "gamma", "radius", "mass", "status"):
+
+            assert np.array_equal(getattr(shells, name), getattr(history, name))
+
+    with h5py.File(tmp_path / "options_3.h5", "r") as f:
+
+        assert f["shells/gamma"].chunks == (64, 16)
+        assert f["shells/gamma"].compression_opts == 9
+
+    finished_jet.write_to(str(tmp_path / "small.h5"), options=WriterOptions(float32=True, n_threads=2))
+
+    with h5py.File(tmp_path / "small.h5", "r") as f:
+
+        assert f["collisions/radius"].dtype == np.float32
+        assert f["shells/status"].dtype == bool
+        assert np.allclose(f["shells/radius"][()], history.radius, rtol=1e-6)
+
+
+def test_lazy_read(finished_jet, tmp_path):
+
+    file_name = str(tmp_path / "lazy.h5")
+
+    finished_jet.write_to(file_name)
+
+    reference = finished_jet.collision_history
+
+    history = finished_jet.detailed_history
+
+    with Jet.open(file_name) as jet_file:
+
+        collisions, shells = jet_file.collisions, jet_file.shells
+
+        assert len(collisions) == finished_jet.n_collisions
+        assert np.array_equal(collisions.radius[10:20], reference.radius[10:20])
+        assert np.allclose(collisions.time_observer[:5], reference.time_observer[:5])
+        assert np.array_equal(np.asarray(collisions.gamma), reference.gamma)
+        assert collisions.load(slice(3, 6)).radius == reference.radius[3:6]
+
+        assert shells.n_shells == history.n_shells
+        assert np.array_equal(shells[5].radius, history.histories[5].radius)
+        assert np.array_equal(shells.gamma[2:4], history.gamma[2:4])
+
+    # the file is closed with the JetFile
+
+    with h5py.File(file_name, "w"):
+
+        pass
+
+
+def test_observer_window(finished_jet, tmp_path):
+
+    file_name = str(tmp_path / "window.h5")
+
+    finished_jet.write_to(file_name)
+
+    reference = finished_jet.collision_history
+
+    time_observer = reference.column("time_observer")
+
+    t_start, t_stop = np.quantile(time_observer, [0.3, 0.6])
+
+    expected = np.sort(time_observer[(time_observer >= t_start) & (time_observer <= t_stop)])
+
+    with Jet.open(file_name) as jet_file:
+
+        window = jet_file.collisions.observer_window(t_start, t_stop)
+
+        assert len(window) == len(expected)
+        assert np.array_equal(window.time_observer, expected)
+
+        assert len(jet_file.collisions.observer_window(time_observer.max() + 1, time_observer.max() + 2)) == 0
+
+    # a single collision fits in a window of zero width
+
+    one = CollisionHistory.from_file(file_name, "collisions")
+
+    t = one.time_observer[7]
+
+    with h5py.File(file_name, "r") as f:
+
+        single = CollisionHistory.from_hdf5_observer_window(f["collisions"], t, t)
+
+    assert single.radius[0] == one.radius[7]
+
+
+def test_observer_index_builder(tmp_path, monkeypatch):
+
+    # many short runs read back a few rows at a time, with ties
+
+    monkeypatch.setattr(collision, "_INDEX_READ", 7)
+
+    rng = np.random.default_rng(1)
+
+    time = rng.integers(0, 50, 3 * OBSERVER_BLOCK).astype(float)
+    radius = rng.uniform(0, 1e10, len(time))
+
+    builder = ObserverIndexBuilder(str(tmp_path), run_size=1000)
+
+    for start in range(0, len(time), 97):
+
+        builder.add(time[start: start + 97], radius[start: start + 97])
+
+    expected = observer_index_arrays(time, radius)
+
+    with h5py.File(tmp_path / "index.h5", "w") as f:
+
+        for name, data in expected.items():
+
+            f.create_dataset(name, shape=(0,), maxshape=(None,), dtype=data.dtype)
+
+        builder.write(f)
+
+        for name, data in expected.items():
+
+            assert np.array_equal(f[name][()], data)
+
+    builder.close()
+
+
+def test_swmr_tail(tmp_path):
+
+    file_name = str(tmp_path / "live.h5")
+
+    output = ChunkedOutput(file_name, n_shells=3, chunk_size=4, swmr=True)
+
+    with CollisionTail(file_name) as tail:
+
+        assert len(tail.poll()) == 0
+
+        for i in range(6):
+
+            output.add_collision(1., 2., 3., float(i))
+
+        # one full block is on disk already
+
+        output.flush()
+
+        first = tail.poll()
+
+        assert np.array_equal(first.time, np.arange(6.))
+
+        output.add_collision(1., 2., 3., 6.)
+
+        output.flush()
+
+        second = tail.poll()
+
+        assert np.array_equal(second.time, [6.])
+        assert tail.n_read == 7
+
+        output.close()
+
+    collisions, _ = Jet.from_file(file_name)
+
+    assert len(collisions) == 7
+
+    # the observer index is filled in on close
+
+    window = collisions.column("time_observer")
+
+    with Jet.open(file_name) as jet_file:
+
+        assert len(jet_file.collisions.observer_window(window.min(), window.max())) == 7
+
+
+def test_npy_directory(finished_jet, tmp_path):
+
+    directory = tmp_path / "run"
+
+    finished_jet.write_npy(str(directory))
+
+    collisions, shells = Jet.from_npy(str(directory))
+
+    assert isinstance(collisions.column("time"), np.memmap)
+
+    reference = finished_jet.collision_history
+
+    for name in ("radiated_energy", "gamma", "radius", "time"):
+
+        assert np.array_equal(getattr(collisions, name), getattr(reference, name))
+
+    for name in ("time", "gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(shells, name), getattr(finished_jet.detailed_history, name))
+
+    # through HDF5 and back
+
+    file_name = str(tmp_path / "run.h5")
+
+    npy_to_hdf5(str(directory), file_name)
+
+    hdf5_to_npy(file_name, str(tmp_path / "again"))
+
+    again, again_shells = Jet.from_npy(str(tmp_path / "again"), mmap=False)
+
+    assert np.array_equal(again.gamma, reference.gamma)
+    assert np.array_equal(again_shells.mass, shells.mass)
+
+
+def test_dataframes(finished_jet):
+
+    collisions = finished_jet.collision_history
+
+    df = collisions.to_dataframe()
+
+    assert np.shares_memory(df["gamma"].to_numpy(), collisions.column("gamma"))
+    assert np.allclose(df["time_observer"], collisions.time_observer)
+
+    late = CollisionHistory.from_dataframe(df[df["time"] > 1.])
+
+    assert len(late) == np.sum(collisions.column("time") > 1.)
+
+    history = finished_jet.detailed_history
+
+    long = history.to_dataframe("long")
+
+    assert len(long) == history.n_time_steps * history.n_shells
+    assert np.shares_memory(long["mass"].to_numpy(), history.mass)
+
+    wide = history.to_dataframe("wide")
+
+    assert np.array_equal(wide["gamma"][3].to_numpy(), history.gamma[:, 3])
+
+    for frame in (long, wide):
+
+        again = DetailedHistory.from_dataframe(frame)
+
+        for name in ("time", "gamma", "radius", "mass", "status"):
+
+            assert np.array_equal(getattr(again, name), getattr(history, name))
+
+    # whole time steps can be dropped
+
+    first = DetailedHistory.from_dataframe(long[long["step"] < 5])
+
+    assert first.n_time_steps == 5
+    assert np.array_equal(first.gamma, history.gamma[:5])
+
+
+def test_precision_policies(finished_jet, tmp_path):
+
+    precision = {
+        "shells/gamma": ColumnPrecision("quantized", 1e-4, delta=True),
+        "collisions/gamma": ColumnPrecision("quantized", 1e-4, delta=True),
+        "collisions/radius": ColumnPrecision("quantized", 1e-5),
+        "shells/mass": ColumnPrecision("float32"),
+        "collisions/radiated_energy": ColumnPrecision("float64"),
+    }
+
+    full = str(tmp_path / "full.h5")
+    lossy = str(tmp_path / "lossy.h5")
+
+    finished_jet.write_to(full, WriterOptions(shuffle=True))
+    finished_jet.write_to(lossy, WriterOptions(shuffle=True, precision=precision))
+
+    with h5py.File(full, "r") as f, h5py.File(lossy, "r") as g:
+
+        assert g["shells/gamma"].dtype.kind in "iu"
+        assert g["shells/radius"].dtype == np.float64
+        assert g["shells/gamma"].attrs["max_rel_error"] <= 1e-4
+        assert g["shells/mass"].dtype == np.float32
+
+        def _size(group):
+
+            return sum(group[name].id.get_storage_size() for name in ("gamma", "radius", "mass"))
+
+        assert _size(g["shells"]) < _size(f["shells"])
+
+    collisions, shells = Jet.from_file(lossy)
+
+    reference = finished_jet.detailed_history
+
+    assert np.all(np.abs(shells.gamma / reference.gamma - 1) <= 1e-4)
+    assert np.allclose(collisions.radius, finished_jet.collision_history.radius, rtol=1e-5, atol=0)
+    assert np.array_equal(collisions.radiated_energy, finished_jet.collision_history.radiated_energy)
+
+    # the lazy reader decodes slices of delta encoded columns
+
+    with Jet.open(lossy) as jet_file:
+
+        assert np.array_equal(jet_file.shells.gamma[10:20], shells.gamma[10:20])
+        assert np.array_equal(jet_file.shells[5].gamma, shells.gamma[:, 5])
+        assert np.array_equal(jet_file.collisions.gamma[[3, 1]], collisions.column("gamma")[[3, 1]])
+
+    # slices are decoded from the start of their chunk
+
+    small_chunks = str(tmp_path / "small_chunks.h5")
+
+    finished_jet.write_to(small_chunks, WriterOptions(chunks=(8, 16), precision=precision))
+
+    with Jet.open(small_chunks) as jet_file:
+
+        assert np.array_equal(jet_file.shells.gamma[13:29], shells.gamma[13:29])
+        assert np.array_equal(jet_file.shells.gamma[21, 3:7], shells.gamma[21, 3:7])
+        assert np.array_equal(jet_file.shells[5].gamma, shells.gamma[:, 5])
+        assert np.array_equal(jet_file.collisions.gamma[[2, 9, 17]], collisions.column("gamma")[[2, 9, 17]])
+
+    with pytest.raises(ValueError):
+
+        WriterOptions(precision=dict(radius=ColumnPrecision("float32")))
+
+
+def test_bulk_load(small_conditions, finished_jet, tmp_path):
+
+    jet = Jet(small_conditions())
+    jet.start()
+
+    jet.write_to(str(tmp_path / "bulk_0.h5"))
+    finished_jet.write_to(str(tmp_path / "bulk_1.h5"))
+
+    table = load_collisions(str(tmp_path / "bulk_*.h5"), columns=["gamma", "time_observer"], n_workers=2)
+
+    assert len(table) == jet.n_collisions + finished_jet.n_collisions
+    assert list(table.columns) == ["run", "gamma", "time_observer"]
+    assert table.attrs["files"][1].endswith("bulk_1.h5")
+
+    second = table[table["run"] == 1]
+
+    assert np.array_equal(second["gamma"], finished_jet.collision_history.gamma)
+    assert np.allclose(second["time_observer"], finished_jet.collision_history.time_observer)
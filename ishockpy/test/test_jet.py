@@ -0,0 +1,330 @@
+import pickle
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ishockpy import InitialConditions, Jet, OutputOptions, SingleGammaStep
+from ishockpy.accumulators import SUMMARY_DTYPE
+from ishockpy.event_log import EventLog
+
+
+def test_event_log(small_jet, tmp_path):
+
+    jet = small_jet
+
+    events = jet.event_log
+
+    assert jet.n_collisions > 0
+    assert events.n_events < jet.detailed_history.n_time_steps * jet.shells.n_shells
+
+    stored = jet.detailed_history
+
+    replayed = events.detailed_history()
+
+    for name in ("time", "gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(replayed, name), getattr(stored, name))
+
+    one = events.shell_history(7)
+
+    assert np.array_equal(one.radius, stored.radius[:, 7])
+    assert np.array_equal(one.status, stored.status[:, 7])
+
+    step = 40
+
+    gamma, radius, mass, status = events.state_at(stored.time[step])
+
+    assert np.array_equal(radius, stored.radius[step])
+    assert np.array_equal(status, stored.status[step])
+
+    # the log goes along with the results
+
+    file_name = str(tmp_path / "events.h5")
+
+    jet.write_to(file_name)
+
+    again = EventLog.from_file(file_name)
+
+    assert np.array_equal(again.detailed_history().mass, stored.mass)
+
+
+def test_checkpoint_resume(small_jet, small_conditions, tmp_path):
+
+    reference = small_jet
+
+    checkpoint = str(tmp_path / "jet.ckpt")
+
+    # a single checkpoint half way through
+
+    every = reference.n_steps // 2 + 1
+
+    jet = Jet(small_conditions(), store=True, output=OutputOptions(record_events=True), checkpoint_file=checkpoint, checkpoint_every=every)
+    jet.start()
+
+    resumed = Jet.resume(checkpoint, small_conditions())
+
+    assert resumed.n_steps == every
+
+    resumed.start()
+
+    assert resumed.n_steps == reference.n_steps
+
+    for name in ("radiated_energy", "gamma", "radius", "time"):
+
+        assert np.array_equal(getattr(resumed.collision_history, name), getattr(reference.collision_history, name))
+
+    for name in ("time", "gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(resumed.detailed_history, name), getattr(reference.detailed_history, name))
+
+    assert resumed.event_log.events.tobytes() == reference.event_log.events.tobytes()
+
+    # many checkpoints to the same file, which a
+    # resumed jet carries on checkpointing to
+
+    jet = Jet(small_conditions(), store=True, output=OutputOptions(record_events=True), checkpoint_file=checkpoint, checkpoint_every=3)
+    jet.step(every)
+
+    resumed = Jet.resume(checkpoint, small_conditions(), checkpoint_file=checkpoint, checkpoint_every=3)
+
+    assert resumed.n_steps == every // 3 * 3
+
+    resumed.start()
+
+    again = Jet.resume(checkpoint, small_conditions())
+
+    assert again.n_steps == reference.n_steps // 3 * 3
+
+    again.start()
+
+    for name in ("radiated_energy", "gamma", "radius", "time"):
+
+        assert np.array_equal(getattr(again.collision_history, name), getattr(reference.collision_history, name))
+
+    for name in ("time", "gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(again.detailed_history, name), getattr(reference.detailed_history, name))
+
+    assert again.event_log.events.tobytes() == reference.event_log.events.tobytes()
+
+    # the output file is cut back to the checkpoint and carried on
+
+    output_file = str(tmp_path / "output.h5")
+
+    jet = Jet(small_conditions(), output=OutputOptions(output_file=output_file, chunk_size=16), checkpoint_file=checkpoint, checkpoint_every=every)
+    jet.start()
+
+    resumed = Jet.resume(checkpoint, small_conditions())
+    resumed.start()
+
+    collisions, _ = Jet.from_file(output_file)
+
+    assert np.array_equal(collisions.time, reference.collision_history.time)
+
+
+def test_fork(small_jet, small_conditions, tmp_path):
+
+    reference = small_jet
+
+    # get a jet half way through from a checkpoint
+
+    checkpoint = str(tmp_path / "jet.ckpt")
+
+    jet = Jet(small_conditions(), output=OutputOptions(record_events=True), checkpoint_file=checkpoint, checkpoint_every=reference.n_steps // 2 + 1)
+    jet.start()
+
+    parent = Jet.resume(checkpoint, small_conditions())
+
+    same = parent.fork()
+
+    remaining = parent.shells.n_shells - parent.n_emitted
+
+    slower = parent.fork(gamma=np.full(remaining, 150.))
+
+    # the shells are shared until they change
+    assert same.shells[0] is parent.shells[0]
+
+    # the forks do not disturb each other or the parent
+
+    slower.start()
+    same.start()
+
+    assert np.array_equal(same.collision_history.time, reference.collision_history.time)
+    assert not np.array_equal(slower.collision_history.time, reference.collision_history.time)
+
+    parent.start()
+
+    assert np.array_equal(parent.collision_history.radius, reference.collision_history.radius)
+    assert parent.event_log.events.tobytes() == reference.event_log.events.tobytes()
+
+    # the energy given to the changed shells is kept
+
+    shell = slower.shells[-1]
+
+    assert shell.gamma == 150.
+    assert np.isclose(shell.mass * shell.velocity, parent.shells[-1].mass * parent.shells[-1].velocity)
+
+    # and a fork can be run elsewhere
+
+    other = pickle.loads(pickle.dumps(Jet.resume(checkpoint, small_conditions()).fork()))
+
+    other.start()
+
+    assert np.array_equal(other.collision_history.gamma, reference.collision_history.gamma)
+
+
+def _held_memory(make_jet):
+
+    tracemalloc.start()
+
+    try:
+
+        jet = make_jet()
+
+        return tracemalloc.get_traced_memory()[0]
+
+    finally:
+
+        tracemalloc.stop()
+
+
+def test_lazy_shells_memory():
+
+    conditions = InitialConditions(
+        total_time=40.0,
+        delta_time=0.05,
+        total_energy=2 * 1.0e51 / (4 * np.pi),
+        gamma_distribtuion=SingleGammaStep(),
+        r_min=1.2e4,
+    )
+
+    # the same jet with every shell made up front, as
+    # a set that does not make them lazily holds them
+
+    def made_up_front():
+
+        jet = Jet(conditions)
+
+        for _ in jet.shells:
+            pass
+
+        return jet
+
+    Jet(conditions)
+
+    assert _held_memory(lambda: Jet(conditions)) < 0.25 * _held_memory(made_up_front)
+
+
+def test_lazy_shells(small_conditions):
+
+    jet = Jet(small_conditions(), store=True)
+
+    # only the two shells emitted so far exist
+
+    assert jet.shells.n_live_shells == 2
+
+    jet.start()
+
+    assert jet.shells.n_live_shells == jet.shells.n_active_shells
+
+    # the dead shells keep their state
+
+    state = jet.shells.get_state()
+
+    dead = np.flatnonzero(~np.isnan(state[5]))[0]
+
+    assert jet.shells[dead].mass == state[1][dead]
+    assert not jet.shells[dead].is_active
+
+    # a shell that has been made is the same object from then on
+
+    assert jet.shells[dead] is jet.shells[dead]
+
+    for shell in jet.shells.active_shells:
+
+        assert jet.shells[shell.id] is shell
+
+    replay = Jet(small_conditions(), output=OutputOptions(record_events=True))
+    replay.start()
+
+    replayed = replay.event_log.detailed_history()
+
+    for name in ("gamma", "radius", "mass", "status"):
+
+        assert np.array_equal(getattr(jet.detailed_history, name), getattr(replayed, name))
+
+
+def test_incremental_run(small_jet, small_conditions):
+
+    reference = small_jet
+
+    jet = Jet(small_conditions())
+
+    assert jet.step(5)
+    assert jet.n_steps == 5
+
+    jet.run_until(reference.collision_history.time[10])
+
+    assert jet.n_collisions >= 11
+    assert jet.collision_history is None
+
+    while jet.step(100):
+        pass
+
+    assert np.array_equal(jet.collision_history.time, reference.collision_history.time)
+
+    # streamed one at a time without keeping them
+
+    streamed = Jet(small_conditions(), output=OutputOptions(retain_collisions=False))
+
+    radius = [collision.radius for collision in streamed.iter_collisions()]
+
+    assert np.array_equal(radius, reference.collision_history.radius)
+    assert streamed.collision_history is None
+
+    batches = list(Jet(small_conditions()).iter_collisions(batch_size=16))
+
+    assert [len(batch) for batch in batches] == [16, 16, reference.n_collisions - 32]
+    assert np.array_equal(np.concatenate([batch.gamma for batch in batches]), reference.collision_history.gamma)
+
+
+def test_summary_only(small_jet, small_conditions):
+
+    reference = small_jet
+
+    collisions = reference.collision_history
+
+    jet = Jet(small_conditions(), output=OutputOptions(summary_only=True))
+    jet.start()
+
+    summary = jet.summary
+
+    assert summary.dtype == SUMMARY_DTYPE
+    assert jet.collision_history is None
+    assert all(shell.history.n_time_steps == 0 for shell in jet.shells)
+
+    assert summary["n_collisions"] == reference.n_collisions
+    assert np.isclose(summary["radiated_energy"], collisions.column("radiated_energy").sum())
+    assert np.isclose(summary["radiated_energy_per_decade"].sum(), collisions.column("radiated_energy").sum())
+    assert summary["first_time_observer"] == collisions.column("time_observer").min()
+    assert summary["last_time_observer"] == collisions.column("time_observer").max()
+    assert summary["n_shells_final"] == reference.shells.n_active_shells
+
+    conditions = small_conditions()
+
+    n_shells = int(conditions.n_shells)
+
+    kinetic = np.sum(conditions.mass_distribution.values[:n_shells] * (conditions.gamma_distribution.values[:n_shells] - 1.0))
+
+    assert np.isclose(jet.injected_energy, kinetic)
+    assert np.isclose(summary["efficiency"], collisions.column("radiated_energy").sum() / kinetic)
+    assert 0.0 < summary["efficiency"] < 1.0
+
+    # the records of many runs stack
+    assert Jet(small_conditions()).summary is None
+    assert np.stack([summary, jet.summary]).shape == (2,)
+
+    with pytest.raises(RuntimeError):
+
+        Jet(small_conditions(), store=True, output=OutputOptions(summary_only=True))
@@ -36,6 +36,30 @@ class Logging:
     file: LogFile = LogFile()
 
 
+@dataclass
+class HDF5Writer:
+
+    # none, gzip or lzf
+    compression: str = "gzip"
+    compression_level: int = 4
+    shuffle: bool = False
+    # 0 lets the writer choose
+    chunk_size: int = 0
+    float32: bool = False
+    n_threads: int = 4
+
+
+@dataclass
+class Cache:
+
+    directory: str = "~/.cache/ishockpy"
+    # in GB
+    max_size: float = 10.
+    # keep the state of the jet every this many emitted
+    # shells for runs that share them. 0 turns this off
+    prefix_every: int = 256
+
+
 # @dataclass
 # class Cosmology:
 
@@ -49,6 +73,8 @@ class IShockpyConfig:
     logging: Logging = Logging()
 #    cosmology: Cosmology = Cosmology()
     show_progress: bool = True
+    hdf5_writer: HDF5Writer = HDF5Writer()
+    cache: Cache = Cache()
 
 
 # Read the default config